@@ -0,0 +1 @@
+"""Synthetic-thesis benchmarks for the export pipeline (see export_bench.py)."""
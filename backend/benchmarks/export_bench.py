@@ -0,0 +1,238 @@
+"""
+Export pipeline benchmark.
+
+    cd backend
+    python -m benchmarks.export_bench                      # run all scenarios, print a summary
+    python -m benchmarks.export_bench -s small,math -r 5   # selected scenarios, 5 warm runs
+    python -m benchmarks.export_bench --update-baseline    # record benchmarks/baseline.json
+    python -m benchmarks.export_bench --check              # exit 1 on regressions vs. the baseline
+
+Each scenario runs in a fresh process with an empty cache directory, and is
+exported three ways: cold (nothing cached), warm (same content again) and
+edit (one chapter changed, the incremental path).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+RUNS = ("cold", "warm", "edit")
+
+# Allowed growth before --check reports a regression
+DEFAULT_TIME_TOLERANCE = 0.5
+DEFAULT_SIZE_TOLERANCE = 0.05
+DEFAULT_MEMORY_TOLERANCE = 0.25
+# Timings below this many seconds of difference are treated as noise
+TIME_NOISE_FLOOR = 0.25
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and of its (waited-for) children, in MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def _timed_export(output_path, args, **kwargs):
+    from core.utils.export_docx import export_to_docx
+
+    timings = {}
+    start = time.perf_counter()
+    ok, msg = export_to_docx(output_path, *args, timings=timings, **kwargs)
+    total = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError(msg)
+    return {"total": round(total, 4), "phases": {k: round(v, 4) for k, v in timings.items()}}
+
+
+def _best_run(runs):
+    """The fastest of several timed runs (as timeit does: slower runs measure noise, not the code)."""
+    return min(runs, key=lambda r: r["total"])
+
+
+def run_scenario_here(name: str, repeat: int, work_dir: str) -> dict:
+    """Generate and export one scenario in this process. Expects a fresh cache dir."""
+    from benchmarks.synthetic import SCENARIOS, generate_thesis, edit_one_chapter
+
+    spec = SCENARIOS[name]
+    thesis = generate_thesis(spec, os.path.join(work_dir, "images"))
+    args = thesis.export_args()
+    output = os.path.join(work_dir, f"{name}.docx")
+
+    result = {"cold": _timed_export(output, args)}
+    output_bytes = os.path.getsize(output)
+    result["warm"] = _best_run([_timed_export(output, args) for _ in range(repeat)])
+
+    edits = []
+    content = thesis.content
+    for _ in range(repeat):
+        content = edit_one_chapter(content)
+        edits.append(_timed_export(output, (content,) + args[1:]))
+    result["edit"] = _best_run(edits)
+
+    peak, child_peak = _peak_rss_mb()
+    chars = len(thesis.content)
+    result.update({
+        "input_chars": chars,
+        "figures": len(thesis.figures),
+        "output_bytes": output_bytes,
+        "chars_per_sec": round(chars / result["cold"]["total"]) if result["cold"]["total"] else None,
+        "peak_rss_mb": peak,
+        "peak_child_rss_mb": child_peak,
+    })
+    return result
+
+
+def run_scenario(name: str, repeat: int) -> dict:
+    """Run a scenario in a child process with its own empty cache directory."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    env = dict(os.environ, GRAD_HELPER_CACHE_DIR=os.path.join(work_dir, "cache"))
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.export_bench", "--worker", name,
+             "--repeat", str(repeat), "--work-dir", work_dir],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Scenario {name} failed:\n{proc.stderr[-4000:]}")
+        # The result is the last line; the exporter prints progress before it
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def machine_info() -> dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: dict, baseline: dict, time_tol: float, size_tol: float, mem_tol: float):
+    """Return (regressions, notes) comparing results with a baseline, both keyed by scenario."""
+    regressions, notes = [], []
+
+    def check(label, new, old, tolerance, floor=0.0):
+        if new is None or not old:
+            return
+        change = (new - old) / old
+        line = f"{label}: {old:g} -> {new:g} ({change:+.1%})"
+        if new > old * (1 + tolerance) and new - old > floor:
+            regressions.append(line)
+        elif change < -tolerance:
+            notes.append(line + " improved")
+
+    for name, new in results.items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            notes.append(f"{name}: not in baseline")
+            continue
+        for run in RUNS:
+            check(f"{name}.{run}.total (s)", new[run]["total"], old[run]["total"], time_tol, TIME_NOISE_FLOOR)
+            # Phase growth is reported for diagnosis but only totals fail the check
+            for phase, seconds in new[run]["phases"].items():
+                before = old[run]["phases"].get(phase)
+                if before and seconds > before * (1 + time_tol) and seconds - before > TIME_NOISE_FLOOR:
+                    notes.append(f"{name}.{run}.{phase}: {before:g}s -> {seconds:g}s")
+        check(f"{name}.output_bytes", new["output_bytes"], old["output_bytes"], size_tol)
+        check(f"{name}.peak_rss_mb", new["peak_rss_mb"], old["peak_rss_mb"], mem_tol)
+    return regressions, notes
+
+
+def print_summary(results: dict):
+    print(f"{'scenario':<10} {'cold s':>8} {'warm s':>8} {'edit s':>8} {'chars/s':>9} {'docx KB':>9} {'peak MB':>8}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['cold']['total']:>8.2f} {r['warm']['total']:>8.2f} {r['edit']['total']:>8.2f} "
+              f"{r['chars_per_sec'] or 0:>9} {r['output_bytes'] / 1024:>9.0f} {r['peak_rss_mb'] or 0:>8}")
+        slowest = sorted(r["cold"]["phases"].items(), key=lambda kv: -kv[1])[:3]
+        print("           cold phases: " + ", ".join(f"{k} {v:.2f}s" for k, v in slowest))
+
+
+def main(argv=None):
+    from benchmarks.synthetic import SCENARIOS
+
+    parser = argparse.ArgumentParser(description="Benchmark the .docx export pipeline on synthetic theses.")
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="warm/edit runs per scenario (the fastest is kept)")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="compare with the baseline, exit 1 on regressions")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--size-tolerance", type=float, default=DEFAULT_SIZE_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        result = run_scenario_here(args.worker, max(1, args.repeat), args.work_dir)
+        print(json.dumps(result))
+        return 0
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        results[name] = run_scenario(name, max(1, args.repeat))
+    print_summary(results)
+
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(),
+              "repeat": args.repeat, "scenarios": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    status = 0
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --update-baseline first.")
+            return 2
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != report["machine"]:
+            print("Note: baseline was recorded on a different machine; timings may not be comparable.")
+        regressions, notes = compare(results, baseline, args.time_tolerance,
+                                     args.size_tolerance, args.memory_tolerance)
+        for line in notes:
+            print(f"  note: {line}")
+        for line in regressions:
+            print(f"  REGRESSION: {line}")
+        print("No regressions." if not regressions else f"{len(regressions)} regression(s).")
+        status = 1 if regressions else 0
+
+    if args.update_baseline:
+        if args.scenarios != parser.get_default("scenarios") and os.path.exists(args.baseline):
+            # Partial run: keep the other scenarios' numbers
+            with open(args.baseline, encoding="utf-8") as f:
+                previous = json.load(f)
+            report["scenarios"] = {**previous.get("scenarios", {}), **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
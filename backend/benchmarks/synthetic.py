@@ -0,0 +1,195 @@
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+from PIL import Image, ImageDraw
+from core.models.data_classes import Settings, Figure, Table, Citation
+
+_WORDS = (
+    "hệ thống mô hình dữ liệu phương pháp kết quả nghiên cứu thuật toán đánh giá "
+    "hiệu năng mạng tín hiệu điều khiển tối ưu phân tích thiết kế triển khai kiểm thử "
+    "ứng dụng giải pháp độ chính xác tham số thực nghiệm so sánh đề xuất cải tiến"
+).split()
+
+# Templates for equations; {i}, {j}, {k} are filled with small integers so that
+# every occurrence is a distinct formula (no accidental cache hits)
+_INLINE_EQUATIONS = (
+    r"x_{{{i}}} + y_{{{j}}}^2",
+    r"\alpha_{{{i}}} \ge {k}",
+    r"\frac{{a_{{{i}}}}}{{b_{{{j}}}}}",
+    r"\sum_{{n={i}}}^{{{k}}} n",
+    r"\sqrt{{x^{{{i}}} + {j}}}",
+    r"f({i}) = {k} t",
+)
+_DISPLAY_EQUATIONS = (
+    r"E_{{{i}}} = m c^2 + \frac{{{j}}}{{{k}}}",
+    r"\int_{{0}}^{{{k}}} x^{{{i}}} \, dx = \frac{{{k}^{{{i}}}}}{{{i}}}",
+    r"\sum_{{n=1}}^{{N}} \frac{{1}}{{n^{{{i}}}}} \le {j}",
+    r"y_{{{i}}} = \sigma\left(W_{{{j}}} x + b_{{{k}}}\right)",
+)
+
+
+@dataclass
+class ThesisSpec:
+    """Shape of a synthetic thesis. Counts are per chapter / section / paragraph as named."""
+    chapters: int = 3
+    sections_per_chapter: int = 3
+    paragraphs_per_section: int = 6
+    words_per_paragraph: int = 80
+    inline_equations_per_paragraph: int = 1
+    display_equations_per_section: int = 1
+    bullets_per_section: int = 3
+    tables_per_chapter: int = 1
+    table_rows: int = 12
+    table_cols: int = 4
+    figures_per_chapter: int = 2
+    figure_px: int = 1600
+    citations: int = 30
+    abbreviations: int = 20
+    seed: int = 1
+    # Settings fields that differ from the defaults
+    settings: dict = field(default_factory=dict)
+
+
+@dataclass
+class SyntheticThesis:
+    content: str
+    settings: Settings
+    figures: List[Figure] = field(default_factory=list)
+    tables: List[Table] = field(default_factory=list)
+    citations: List[Citation] = field(default_factory=list)
+    abbreviations: List[dict] = field(default_factory=list)
+
+    def export_args(self):
+        """Positional arguments of export_to_docx after the output path."""
+        return self.content, self.settings, self.figures, self.tables, self.citations, self.abbreviations
+
+
+# Named scenarios used by the benchmark runner and its baseline
+SCENARIOS: Dict[str, ThesisSpec] = {
+    "small": ThesisSpec(chapters=2, sections_per_chapter=2, paragraphs_per_section=4,
+                        figures_per_chapter=1, citations=10, abbreviations=10),
+    "medium": ThesisSpec(),
+    "large": ThesisSpec(chapters=6, sections_per_chapter=4, paragraphs_per_section=10,
+                        tables_per_chapter=2, table_rows=40, figures_per_chapter=3,
+                        citations=80, abbreviations=60),
+    # Mostly math: stresses LaTeX rendering and OMML conversion
+    "math": ThesisSpec(chapters=3, sections_per_chapter=3, paragraphs_per_section=6,
+                       words_per_paragraph=40, inline_equations_per_paragraph=4,
+                       display_equations_per_section=4, tables_per_chapter=0,
+                       figures_per_chapter=0),
+    # Locked line breaks (hard_wrap). DejaVu Serif ships with matplotlib, so the
+    # breaks are measured wherever this runs; Times New Roman often is not installed
+    "wrap": ThesisSpec(settings={"hard_wrap": True, "font_family": "DejaVu Serif"}),
+}
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    picked = [rng.choice(_WORDS) for _ in range(max(1, words))]
+    # Sprinkle inline formatting the way real drafts use it
+    if words >= 8:
+        picked[2] = f"**{picked[2]}**"
+        picked[5] = f"*{picked[5]}*"
+    text = " ".join(picked)
+    return text[0].upper() + text[1:] + "."
+
+
+def _equation(rng: random.Random, templates) -> str:
+    return rng.choice(templates).format(i=rng.randint(1, 9), j=rng.randint(1, 9), k=rng.randint(2, 20))
+
+
+def _write_image(path: str, px: int, rng: random.Random, photo: bool):
+    """A photo-like JPEG (noisy gradient) or a flat-colour PNG diagram."""
+    height = px * 2 // 3
+    if photo:
+        noise = Image.effect_noise((px, height), 60).convert("RGB")
+        tint = Image.new("RGB", (px, height), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        Image.blend(noise, tint, 0.5).save(path, format="JPEG", quality=95)
+    else:
+        img = Image.new("RGB", (px, height), "white")
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x0, y0 = rng.randint(0, px - 50), rng.randint(0, height - 50)
+            draw.rectangle([x0, y0, x0 + rng.randint(40, px // 3), y0 + rng.randint(30, height // 3)],
+                           outline="black", width=3)
+        img.save(path, format="PNG")
+
+
+def generate_thesis(spec: ThesisSpec, image_dir: str) -> SyntheticThesis:
+    """
+    Build a deterministic synthetic thesis (same spec -> same content and
+    images). Figure images are written into `image_dir`.
+    """
+    rng = random.Random(spec.seed)
+    os.makedirs(image_dir, exist_ok=True)
+    lines = []
+    figures = []
+    tables = []
+
+    for c in range(1, spec.chapters + 1):
+        lines.append(f"# Chương {c}: {_sentence(rng, 4)[:-1]}")
+        figure_slots = set(rng.sample(range(spec.sections_per_chapter * spec.paragraphs_per_section),
+                                      min(spec.figures_per_chapter, spec.sections_per_chapter * spec.paragraphs_per_section)))
+        table_sections = set(range(min(spec.tables_per_chapter, spec.sections_per_chapter)))
+        figure_no = 0
+        for s in range(spec.sections_per_chapter):
+            lines.append(f"## {_sentence(rng, 5)[:-1]}")
+            for p in range(spec.paragraphs_per_section):
+                parts = [_sentence(rng, 12) for _ in range(max(1, spec.words_per_paragraph // 12))]
+                for _ in range(spec.inline_equations_per_paragraph):
+                    parts.insert(rng.randint(0, len(parts)), f"với ${_equation(rng, _INLINE_EQUATIONS)}$")
+                lines.append(" ".join(parts))
+
+                if s * spec.paragraphs_per_section + p in figure_slots:
+                    figure_no += 1
+                    number = f"Hình {c}.{figure_no}"
+                    photo = figure_no % 2 == 1
+                    path = os.path.join(image_dir, f"fig_{c}_{figure_no}.{'jpg' if photo else 'png'}")
+                    if not os.path.exists(path):
+                        # Own generator: the content must not depend on whether the image already exists
+                        _write_image(path, spec.figure_px, random.Random(f"{spec.seed}-{c}-{figure_no}"), photo)
+                    caption = _sentence(rng, 6)[:-1]
+                    figures.append(Figure(id=len(figures) + 1, path=path, caption=caption, chapter=c,
+                                          number=number, width=rng.choice([None, 12, 14, 16])))
+                    lines.append(f"[{number}: {caption}]")
+
+            for _ in range(spec.display_equations_per_section):
+                lines.append(f"$${_equation(rng, _DISPLAY_EQUATIONS)}$$")
+            for b in range(spec.bullets_per_section):
+                lines.append(("- " if b % 2 == 0 else "-- ") + _sentence(rng, 10))
+
+            if s in table_sections:
+                number = f"Bảng {c}.{s + 1}"
+                caption = _sentence(rng, 5)[:-1]
+                tables.append(Table(id=len(tables) + 1, caption=caption, chapter=c, number=number))
+                lines.append(f"{number}: {caption}")
+                lines.append("| " + " | ".join(f"Cột {k + 1}" for k in range(spec.table_cols)) + " |")
+                lines.append("|" + "---|" * spec.table_cols)
+                for _ in range(spec.table_rows):
+                    cells = [f"{rng.uniform(0, 100):.2f}" if k else rng.choice(_WORDS) for k in range(spec.table_cols)]
+                    lines.append("| " + " | ".join(cells) + " |")
+
+    citations = [
+        Citation(id=i, author=f"Nguyễn Văn {chr(65 + i % 26)}", year=str(2000 + i % 24),
+                 title=_sentence(rng, 8)[:-1], publisher="NXB Khoa học và Kỹ thuật")
+        for i in range(1, spec.citations + 1)
+    ]
+    abbreviations = []
+    for i in range(spec.abbreviations):
+        kind = "symbol" if i % 4 == 3 else "abbreviation"
+        abbr = f"\\alpha_{i}" if kind == "symbol" else "".join(rng.choice("ABCDEFGHKLMNPQRSTUVXY") for _ in range(3))
+        abbreviations.append({"type": kind, "abbreviation": abbr, "fullForm": _sentence(rng, 4)[:-1]})
+
+    return SyntheticThesis("\n".join(lines), Settings(**spec.settings), figures, tables, citations, abbreviations)
+
+
+def edit_one_chapter(content: str, chapter: int = -1) -> str:
+    """Append a sentence to the first paragraph of one chapter (simulates a typical edit)."""
+    lines = content.split("\n")
+    starts = [i for i, line in enumerate(lines) if line.startswith("# ")]
+    start = starts[chapter]
+    for i in range(start + 1, len(lines)):
+        if lines[i] and not lines[i].startswith(("#", "$$", "-", "|", "[", "Bảng")):
+            lines[i] += " Câu bổ sung sau khi chỉnh sửa."
+            break
+    return "\n".join(lines)
@@ -0,0 +1,98 @@
+import os
+
+# Thư mục gốc của backend (chứa server.py)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to default."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"Warning: invalid value for {name}, using {default}")
+        return default
+
+
+# --- SERVER ---
+SERVER_HOST = os.environ.get("GRAD_HELPER_HOST", "0.0.0.0")
+SERVER_PORT = env_int("GRAD_HELPER_PORT", 8080)
+# Server processes; they share every directory and database below
+SERVER_WORKERS = max(1, env_int("GRAD_HELPER_SERVER_WORKERS", 1))
+
+
+# --- CACHE ---
+# Paths are made absolute so every process agrees on them whatever its working directory
+CACHE_DIR = os.path.abspath(os.environ.get("GRAD_HELPER_CACHE_DIR", os.path.join(BASE_DIR, "cache")))
+
+# Equation images (LaTeX -> PNG)
+EQUATION_DPI = env_int("GRAD_HELPER_EQUATION_DPI", 600)
+EQUATION_CACHE_MEMORY_ITEMS = env_int("GRAD_HELPER_EQUATION_CACHE_ITEMS", 4096)
+EQUATION_CACHE_DISK_BYTES = env_int("GRAD_HELPER_EQUATION_CACHE_BYTES", 512 * 1024 * 1024)
+# Parallel pre-render of equations before DOCX assembly
+EQUATION_WORKERS = env_int("GRAD_HELPER_EQUATION_WORKERS", os.cpu_count() or 1)
+# Below this many uncached equations the pool start-up cost is not worth it
+EQUATION_PARALLEL_THRESHOLD = env_int("GRAD_HELPER_EQUATION_PARALLEL_THRESHOLD", 16)
+
+# Verdicts of /api/math/validate (OMML / image / fallback) keyed by normalized LaTeX
+MATH_VERDICT_CACHE_ITEMS = env_int("GRAD_HELPER_MATH_VERDICT_CACHE_ITEMS", 16384)
+
+# MathML -> OMML
+# Optional explicit path to MML2OMML.XSL (otherwise the usual Office install paths are probed)
+MML2OMML_XSL_PATH = os.environ.get("GRAD_HELPER_MML2OMML_XSL", "")
+MML2OMML_XSL_PATH = os.path.abspath(MML2OMML_XSL_PATH) if MML2OMML_XSL_PATH else ""
+OMML_CACHE_ITEMS = env_int("GRAD_HELPER_OMML_CACHE_ITEMS", 4096)
+
+# Per-chapter DOCX fragments (incremental export) and the media they embed.
+# Bump the format version when the block renderers change so stale fragments
+# (and cached exports, whose keys include it) are not reused
+FRAGMENT_FORMAT_VERSION = 5
+FRAGMENT_CACHE_MEMORY_ITEMS = env_int("GRAD_HELPER_FRAGMENT_CACHE_ITEMS", 512)
+FRAGMENT_CACHE_DISK_BYTES = env_int("GRAD_HELPER_FRAGMENT_CACHE_BYTES", 512 * 1024 * 1024)
+MEDIA_CACHE_MEMORY_ITEMS = env_int("GRAD_HELPER_MEDIA_CACHE_ITEMS", 128)
+MEDIA_CACHE_DISK_BYTES = env_int("GRAD_HELPER_MEDIA_CACHE_BYTES", 1024 * 1024 * 1024)
+
+# Server-side preview: rendered HTML per block (keyed by block hash), parsed
+# chapters, and the block hashes of recent preview versions (for deltas)
+PREVIEW_BLOCK_CACHE_ITEMS = env_int("GRAD_HELPER_PREVIEW_BLOCK_CACHE_ITEMS", 50_000)
+PREVIEW_CHAPTER_CACHE_ITEMS = env_int("GRAD_HELPER_PREVIEW_CHAPTER_CACHE_ITEMS", 256)
+PREVIEW_VERSION_ITEMS = env_int("GRAD_HELPER_PREVIEW_VERSION_ITEMS", 64)
+
+# Export job queue. Export processes per server process; by default half the
+# cores are shared out between the server processes
+EXPORT_WORKERS = env_int("GRAD_HELPER_EXPORT_WORKERS", max(1, (os.cpu_count() or 1) // 2 // SERVER_WORKERS))
+EXPORT_QUEUE_SIZE = env_int("GRAD_HELPER_EXPORT_QUEUE_SIZE", 16)
+EXPORT_JOB_TTL = env_int("GRAD_HELPER_EXPORT_JOB_TTL", 3600)  # seconds
+EXPORT_JOB_DIR = os.path.join(CACHE_DIR, "jobs")
+# Finished exports keyed by a hash of the request (identical requests are served from here)
+EXPORT_CACHE_DIR = os.path.join(CACHE_DIR, "exports")
+EXPORT_CACHE_BYTES = env_int("GRAD_HELPER_EXPORT_CACHE_BYTES", 2 * 1024 * 1024 * 1024)
+# With several server processes, each writes its metrics here for /api/metrics to add up
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics")
+
+# Documents at least this long are written with the streaming DOCX writer
+DOCX_STREAMING_MIN_CHARS = env_int("GRAD_HELPER_DOCX_STREAMING_MIN_CHARS", 250_000)
+
+# PDF export: extra directory searched (before the system font folders) for the
+# .ttf files of settings.font_family; DejaVu Serif from matplotlib is the fallback
+PDF_FONT_DIR = os.environ.get("GRAD_HELPER_PDF_FONT_DIR", "")
+PDF_FONT_DIR = os.path.abspath(PDF_FONT_DIR) if PDF_FONT_DIR else ""
+
+# Figures: downsampled to this resolution at their displayed width before embedding
+FIGURE_TARGET_DPI = env_int("GRAD_HELPER_FIGURE_DPI", 220)  # 0 = embed originals
+FIGURE_JPEG_QUALITY = env_int("GRAD_HELPER_FIGURE_JPEG_QUALITY", 85)
+FIGURE_WORKERS = env_int("GRAD_HELPER_FIGURE_WORKERS", min(8, os.cpu_count() or 1))
+IMAGE_CACHE_MEMORY_ITEMS = env_int("GRAD_HELPER_IMAGE_CACHE_ITEMS", 64)
+IMAGE_CACHE_DISK_BYTES = env_int("GRAD_HELPER_IMAGE_CACHE_BYTES", 1024 * 1024 * 1024)
+
+# Uploaded images: content-addressed store served under /images (uploads in
+# progress go to the sibling UPLOAD_DIR + ".tmp", outside what is served)
+UPLOAD_DIR = os.path.abspath(os.environ.get("GRAD_HELPER_UPLOAD_DIR", os.path.join(BASE_DIR, "images")))
+UPLOAD_MAX_BYTES = env_int("GRAD_HELPER_UPLOAD_MAX_BYTES", 20 * 1024 * 1024)
+
+# Projects: SQLite store (snapshots + incremental patches)
+PROJECT_DB_PATH = os.path.abspath(os.environ.get("GRAD_HELPER_PROJECT_DB", os.path.join(BASE_DIR, "projects.db")))
+# Patches replayed on load are folded into a new snapshot after this many
+PROJECT_COMPACT_EVERY = env_int("GRAD_HELPER_PROJECT_COMPACT_EVERY", 200)
+# Single-project file used before the store existed; imported once as DEFAULT_PROJECT_ID
+LEGACY_PROJECT_FILE = os.path.join(BASE_DIR, "saved_project.json")
+DEFAULT_PROJECT_ID = "default"
@@ -51,3 +51,5 @@ class Settings:
     h1_split: bool = False
     hierarchical_numbering: bool = True
     h1_uppercase: bool = True
+    # Output: rely on document styles, write run formatting only where it differs
+    style_driven: bool = True
@@ -0,0 +1,309 @@
+"""
+Batch export: many projects exported across a process pool into one zip.
+
+    cd backend
+    python -m core.utils.batch_export -o cohort.zip --all             # every stored project
+    python -m core.utils.batch_export -o out.zip -p id1 -p id2 -f pdf
+    python -m core.utils.batch_export -o out.zip thesis1.json thesis2.json
+
+Each project becomes one file in the archive, written as soon as its export
+finishes, and manifest.json lists every project with its status. The worker
+processes share the on-disk equation, image and chapter caches.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zipfile
+import argparse
+import tempfile
+import contextlib
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+from core.config import EXPORT_WORKERS
+from core.models.data_classes import Settings, Figure, Table, Citation
+from core.utils.export_jobs import (
+    QueueFullError, EXPORT_KINDS, run_export, init_export_worker, equation_workers_per_export,
+)
+
+MANIFEST_NAME = "manifest.json"
+
+_UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+_RECORD_NAME_RE = re.compile(r"^batch-([0-9a-f]{32})\.json$")
+
+
+@dataclass
+class BatchProject:
+    name: str
+    # Returns the project document (content, settings, figures, ...); called just before it is exported
+    load: Callable[[], dict]
+
+
+def project_export_args(data: dict):
+    """A project document as the arguments of export_to_docx after the output path."""
+    settings = Settings(**(data.get("settings") or {}))
+    figures = [Figure(**f) for f in data.get("figures") or []]
+    tables = [Table(**t) for t in data.get("tables") or []]
+    citations = [Citation(**c) for c in data.get("citations") or []]
+    return data.get("content") or "", settings, figures, tables, citations, data.get("abbreviations") or []
+
+
+def _entry_name(name: str, kind: str, used: set) -> str:
+    base = _UNSAFE_NAME_RE.sub("_", name).strip(" .") or "project"
+    entry, n = f"{base}.{kind}", 1
+    while entry in used:
+        n += 1
+        entry = f"{base} ({n}).{kind}"
+    used.add(entry)
+    return entry
+
+
+def export_batch(projects: Iterable[BatchProject], zip_path: str, kind: str = "docx",
+                 workers: int = EXPORT_WORKERS, on_progress: Callable[[dict], None] = None,
+                 submit: Callable[..., Future] = None) -> dict:
+    """
+    Export every project to `kind` in a pool of `workers` processes and write
+    the results into the zip at `zip_path`, followed by the manifest. At most
+    two projects per worker are loaded at a time. A project that fails is
+    recorded in the manifest and does not stop the batch. on_progress gets
+    each finished manifest entry. Returns the manifest.
+
+    With `submit` (e.g. ExportJobQueue.submit_task) the exports run in that
+    existing pool of `workers` processes instead, one project per worker at a
+    time so other exports queued there are not held up for long.
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"Định dạng không hỗ trợ: {kind}")
+    workers = max(1, workers)
+    window = workers if submit is not None else 2 * workers
+    manifest = {"format": kind, "started_at": time.time(), "finished_at": None, "projects": []}
+    used_names = {MANIFEST_NAME}
+    tmp_dir = tempfile.mkdtemp(prefix="batch-", dir=os.path.dirname(os.path.abspath(zip_path)))
+    pending = {}  # future -> (manifest entry, output path, submit time)
+
+    def finish(entry, started):
+        entry["seconds"] = round(time.time() - started, 3)
+        manifest["projects"].append(entry)
+        if on_progress is not None:
+            on_progress(entry)
+
+    with contextlib.ExitStack() as stack:
+        if submit is None:
+            # Spawn so workers don't inherit the caller's threads
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_export_worker,
+                initargs=(equation_workers_per_export(workers),)))
+            submit = pool.submit
+        archive = stack.enter_context(zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED, allowZip64=True))
+
+        def collect(done):
+            for future in done:
+                entry, output_path, started = pending.pop(future)
+                try:
+                    success, msg, stats = future.result()
+                    if success:
+                        # docx and pdf are compressed already
+                        archive.write(output_path, entry["file"])
+                        entry.update(status="done", bytes=os.path.getsize(output_path))
+                    else:
+                        entry.update(status="failed", error=msg)
+                    entry["timings"] = stats.get("timings", {})
+                except Exception as e:
+                    entry.update(status="failed", error=str(e))
+                finally:
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                if entry["status"] != "done":
+                    entry["file"] = None
+                finish(entry, started)
+
+        for project in projects:
+            entry = {"name": project.name, "file": None, "status": "failed", "error": None}
+            started = time.time()
+            try:
+                args = project_export_args(project.load())
+            except Exception as e:
+                entry["error"] = f"Không đọc được dự án: {e}"
+                finish(entry, started)
+                continue
+            entry["file"] = _entry_name(project.name, kind, used_names)
+            output_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.{kind}")
+            pending[submit(run_export, output_path, *args, kind)] = (entry, output_path, started)
+            if len(pending) >= window:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        while pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+        manifest["finished_at"] = time.time()
+        statuses = [p["status"] for p in manifest["projects"]]
+        manifest["summary"] = {"total": len(statuses), "done": statuses.count("done"), "failed": statuses.count("failed")}
+        archive.writestr(zipfile.ZipInfo(MANIFEST_NAME, time.localtime()[:6]),
+                         json.dumps(manifest, ensure_ascii=False, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+    try:
+        os.rmdir(tmp_dir)
+    except OSError:
+        pass
+    return manifest
+
+
+class BatchExports:
+    """
+    Batch exports started by this server process, run one at a time in a
+    background thread. Progress is kept in a record file next to the zip in
+    output_dir, so any server process can report on any batch. With `submit`
+    the projects are exported in that pool of `workers` processes (the
+    server's export queue) rather than a pool of their own.
+    """
+
+    def __init__(self, output_dir: str, workers: int, submit: Callable[..., Future] = None, ttl: int = None):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.submit = submit
+        # Finished batches (record and zip) are deleted after this many seconds
+        self.ttl = ttl
+        self._running = None
+        self._lock = threading.Lock()
+
+    def _record_path(self, batch_id: str) -> str:
+        return os.path.join(self.output_dir, f"batch-{batch_id}.json")
+
+    def zip_path(self, batch_id: str) -> str:
+        return os.path.join(self.output_dir, f"batch-{batch_id}.zip")
+
+    def _write_record(self, record: dict):
+        path = self._record_path(record["batch_id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: cannot write batch export record {path}: {e}")
+
+    def start(self, projects: List[BatchProject], kind: str = "docx") -> dict:
+        """Start exporting `projects`; raises QueueFullError while another batch runs here."""
+        with self._lock:
+            if self._running is not None and self._running.is_alive():
+                raise QueueFullError("Đang có một đợt xuất hàng loạt khác, vui lòng thử lại sau.")
+            self._prune()
+            os.makedirs(self.output_dir, exist_ok=True)
+            record = {"batch_id": uuid.uuid4().hex, "status": "running", "format": kind, "error": None,
+                      "total": len(projects), "done": 0, "failed": 0, "created_at": time.time(),
+                      "finished_at": None, "manifest": None}
+            self._write_record(record)
+            self._running = threading.Thread(target=self._run, args=(record, projects, kind),
+                                             name="batch-export", daemon=True)
+            self._running.start()
+            return record
+
+    def _run(self, record: dict, projects: List[BatchProject], kind: str):
+        def progress(entry):
+            record[entry["status"]] += 1
+            self._write_record(record)
+
+        try:
+            record["manifest"] = export_batch(projects, self.zip_path(record["batch_id"]), kind,
+                                              self.workers, on_progress=progress, submit=self.submit)
+            record["status"] = "done"
+        except Exception as e:
+            record.update(status="failed", error=str(e))
+        record["finished_at"] = time.time()
+        self._write_record(record)
+        self._prune()
+
+    def _read_record(self, batch_id: str) -> Optional[dict]:
+        try:
+            with open(self._record_path(batch_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _expired(self, record: dict) -> bool:
+        finished_at = record.get("finished_at")
+        return self.ttl is not None and finished_at is not None and time.time() - finished_at > self.ttl
+
+    def _remove(self, batch_id: str):
+        for path in (self.zip_path(batch_id), self._record_path(batch_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Delete the record and zip of every batch (of any server process) finished more than ttl ago."""
+        if self.ttl is None or not os.path.isdir(self.output_dir):
+            return
+        for name in os.listdir(self.output_dir):
+            match = _RECORD_NAME_RE.match(name)
+            if match is None:
+                continue
+            record = self._read_record(match.group(1))
+            if record is not None and self._expired(record):
+                self._remove(match.group(1))
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        if not re.match(r"^[0-9a-f]{32}$", batch_id):
+            return None
+        record = self._read_record(batch_id)
+        if record is not None and self._expired(record):
+            self._remove(batch_id)
+            return None
+        return record
+
+
+def _file_project(path: str) -> BatchProject:
+    def load():
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return BatchProject(os.path.splitext(os.path.basename(path))[0], load)
+
+
+def _stored_projects(project_ids: Optional[List[str]]) -> List[BatchProject]:
+    from core.config import PROJECT_DB_PATH, PROJECT_COMPACT_EVERY
+    from core.utils.project_store import ProjectStore
+
+    store = ProjectStore(PROJECT_DB_PATH, PROJECT_COMPACT_EVERY)
+    names = {p["id"]: p["name"] for p in store.list()}
+    ids = project_ids if project_ids is not None else list(names)
+    return [BatchProject(names.get(pid) or pid, lambda pid=pid: store.get(pid)["data"]) for pid in ids]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export many projects into one zip archive with a manifest.")
+    parser.add_argument("files", nargs="*", help="project JSON files (content, settings, figures, ...)")
+    parser.add_argument("-o", "--output", required=True, help="zip file to write")
+    parser.add_argument("-p", "--project", action="append", default=[], help="id of a stored project (repeatable)")
+    parser.add_argument("--all", action="store_true", help="every project in the project database")
+    parser.add_argument("-f", "--format", default="docx", choices=EXPORT_KINDS)
+    parser.add_argument("-w", "--workers", type=int, default=EXPORT_WORKERS,
+                        help=f"export processes, each with its share of the cores for equations (default {EXPORT_WORKERS})")
+    args = parser.parse_args(argv)
+
+    projects = [_file_project(path) for path in args.files]
+    if args.all or args.project:
+        projects += _stored_projects(None if args.all else args.project)
+    if not projects:
+        parser.error("no projects given (files, --project or --all)")
+
+    total = len(projects)
+    count = [0]
+
+    def progress(entry):
+        count[0] += 1
+        detail = f"{entry['seconds']:.1f}s" if entry["status"] == "done" else entry["error"]
+        print(f"[{count[0]}/{total}] {entry['name']}: {entry['status']} ({detail})", flush=True)
+
+    manifest = export_batch(projects, args.output, args.format, args.workers, on_progress=progress)
+    summary = manifest["summary"]
+    print(f"{summary['done']}/{summary['total']} exported to {args.output} "
+          f"in {manifest['finished_at'] - manifest['started_at']:.1f}s")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
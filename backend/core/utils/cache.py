@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from core.utils.file_lock import FileLock
+
+# Other server processes write to the same directories, so each process
+# re-measures a store's size at least this often (seconds)
+SIZE_RESCAN_SECONDS = 60
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache bounded by item count."""
+
+    def __init__(self, max_items: int = 1024):
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    On-disk byte store keyed by hex digest, bounded by total size.
+    Each entry is one file: a JSON metadata line followed by the payload.
+    Least recently used entries (by mtime) are evicted once max_bytes is exceeded.
+    Safe to share between processes: entries are written atomically and
+    eviction runs under a file lock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None  # Computed lazily on first write
+        self._size_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        # Shard by prefix to keep directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        try:
+            header, _, payload = raw.partition(b"\n")
+            meta = json.loads(header.decode("utf-8"))
+        except ValueError:
+            # Corrupt entry - drop it
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, None)  # Mark as recently used
+        except OSError:
+            pass
+        return payload, meta
+
+    def put(self, key: str, payload: bytes, meta: dict = None):
+        path = self._path(key)
+        data = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8") + b"\n" + payload
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file then rename so readers never see partial entries
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: cannot write cache entry {path}: {e}")
+            return
+        self._account(len(data))
+
+    def _account(self, added: int):
+        """Track the store size after a write and evict when over budget."""
+        with self._lock:
+            now = time.time()
+            if self._size is None or now - self._size_checked_at > SIZE_RESCAN_SECONDS:
+                self._size = self._scan_size()
+                self._size_checked_at = now
+            else:
+                self._size += added
+            if self._size > self.max_bytes:
+                # One process evicts at a time; the others find the store already trimmed
+                with FileLock(os.path.join(self.directory, ".lock")):
+                    self._evict()
+                self._size_checked_at = now
+
+    def _scan_size(self) -> int:
+        total = 0
+        for entry in self._iter_entries():
+            total += entry[2]
+        return total
+
+    def _iter_entries(self):
+        """Yield (path, mtime, size) for every entry in the store."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for f in os.scandir(shard.path):
+                if f.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                yield f.path, st.st_mtime, st.st_size
+
+    def _evict(self):
+        # Remove oldest entries until we are back under 90% of the budget
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._iter_entries(), key=lambda e: e[1])
+        total = sum(e[2] for e in entries)
+        for path, _, size in entries:
+            if total <= target:
+                break
+            if self._remove(path):
+                total -= size
+        self._size = total
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def remove_stale_temp_files(self, max_age: float):
+        """Delete .tmp files older than max_age seconds (left behind by crashed writers)."""
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - max_age
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for f in os.scandir(shard.path):
+                try:
+                    if f.name.endswith(".tmp") and f.stat().st_mtime < cutoff:
+                        os.remove(f.path)
+                except OSError:
+                    pass
+
+
+class FileStore(DiskCache):
+    """
+    DiskCache variant whose entries are plain files (no metadata line), so they
+    can be served directly. Producers write to temp_path() and commit() it.
+    """
+
+    def get_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            os.utime(path, None)  # Mark as recently used
+        except OSError:
+            return None
+        return path
+
+    def temp_path(self, key: str) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{uuid.uuid4().hex}.tmp"
+
+    def commit(self, key: str, tmp_path: str) -> str:
+        """Move a finished temp file into place and return the entry's path."""
+        path = self._path(key)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self._account(size)
+        return path
+
+
+class TwoTierCache:
+    """In-process LRU in front of a size-bounded DiskCache."""
+
+    def __init__(self, directory: str, max_items: int, max_bytes: int):
+        self.memory = LRUCache(max_items)
+        self.disk = DiskCache(directory, max_bytes)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        entry = self.disk.get(key)
+        if entry is not None:
+            self.memory.put(key, entry)
+        return entry
+
+    def put(self, key: str, payload: bytes, meta: dict = None):
+        entry = (payload, meta or {})
+        self.memory.put(key, entry)
+        self.disk.put(key, payload, meta)
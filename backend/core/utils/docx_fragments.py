@@ -0,0 +1,115 @@
+import os
+import copy
+import json
+import hashlib
+from dataclasses import asdict
+from docx.oxml import parse_xml, OxmlElement
+from docx.oxml.ns import qn
+from lxml import etree
+from core.config import (
+    CACHE_DIR, FRAGMENT_FORMAT_VERSION, FRAGMENT_CACHE_MEMORY_ITEMS, FRAGMENT_CACHE_DISK_BYTES,
+    MEDIA_CACHE_MEMORY_ITEMS, MEDIA_CACHE_DISK_BYTES,
+)
+from core.utils.cache import TwoTierCache
+
+# Chapter body XML (WordprocessingML) keyed by chapter hash
+FRAGMENT_CACHE = TwoTierCache(
+    os.path.join(CACHE_DIR, "fragments"),
+    max_items=FRAGMENT_CACHE_MEMORY_ITEMS,
+    max_bytes=FRAGMENT_CACHE_DISK_BYTES,
+)
+# Embedded media blobs keyed by their sha256, shared by all fragments
+MEDIA_CACHE = TwoTierCache(
+    os.path.join(CACHE_DIR, "media"),
+    max_items=MEDIA_CACHE_MEMORY_ITEMS,
+    max_bytes=MEDIA_CACHE_DISK_BYTES,
+)
+
+_EMBED_ATTR = qn('r:embed')
+
+
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def chapter_cache_key(source: str, settings, counts, figures, extra=None) -> str:
+    """
+    Hash everything a chapter's output depends on: its markdown source, the
+    export settings, the heading counters it starts from, and the figures it
+    references (including the image files' mtime/size).
+    """
+    figure_info = [
+        [f.number, f.path, f.width, _file_signature(os.path.abspath(f.path)) if f.path else None]
+        for f in figures
+    ]
+    raw = json.dumps(
+        [FRAGMENT_FORMAT_VERSION, source, asdict(settings), list(counts), figure_info, extra],
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def store_fragment(key: str, media, elements, counts_after):
+    """
+    Serialize body elements produced for one chapter, plus the images they embed.
+    `media` resolves rIds to image bytes (PackageMedia or StreamingDocxWriter).
+    """
+    container = OxmlElement('w:body')
+    media_keys = {}
+    for el in elements:
+        for node in el.iter():
+            rId = node.get(_EMBED_ATTR)
+            if rId and rId not in media_keys:
+                blob = media.blob_for(rId)
+                media_key = hashlib.sha256(blob).hexdigest()
+                if MEDIA_CACHE.get(media_key) is None:
+                    MEDIA_CACHE.put(media_key, blob)
+                media_keys[rId] = media_key
+        container.append(copy.deepcopy(el))
+    payload = etree.tostring(container, encoding="utf-8")
+    FRAGMENT_CACHE.put(key, payload, {"media": media_keys, "counts": list(counts_after)})
+
+
+def restore_fragment(key: str, doc, media):
+    """
+    Append a cached chapter to the document body, relating its images through
+    `media`. Returns the heading counters after the chapter, or None when the
+    fragment (or one of its images) is missing.
+    """
+    entry = FRAGMENT_CACHE.get(key)
+    if entry is None:
+        return None
+    payload, meta = entry
+
+    # Resolve all media first so a partially evicted fragment is treated as a miss
+    blobs = {}
+    for rId, media_key in meta.get("media", {}).items():
+        media_entry = MEDIA_CACHE.get(media_key)
+        if media_entry is None:
+            return None
+        blobs[rId] = media_entry[0]
+
+    rId_map = {old: media.relate_blob(blob) for old, blob in blobs.items()}
+    container = parse_xml(payload)
+    sectPr = doc.element.body.find(qn('w:sectPr'))
+    for el in list(container):
+        for node in el.iter():
+            rId = node.get(_EMBED_ATTR)
+            if rId:
+                node.set(_EMBED_ATTR, rId_map[rId])
+        if sectPr is not None:
+            sectPr.addprevious(el)
+        else:
+            doc.element.body.append(el)
+    return meta["counts"]
+
+
+def renumber_drawing_ids(doc):
+    """Give every drawing a unique wp:docPr id (restored fragments may repeat ids)."""
+    for i, docPr in enumerate(doc.element.body.iter(qn('wp:docPr')), 1):
+        docPr.set('id', str(i))
+        docPr.set('name', f'Picture {i}')
@@ -0,0 +1,231 @@
+import io
+import re
+import hashlib
+import shutil
+import zipfile
+import tempfile
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.pkgwriter import PackageWriter
+from docx.opc.spec import default_content_types
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from lxml import etree
+
+_DOCPR_TAG = qn('wp:docPr')
+_SECTPR_TAG = qn('w:sectPr')
+_XMLNS_RE = re.compile(rb' xmlns:(\w+)="([^"]*)"')
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+
+# Zip entries get a fixed timestamp so identical documents are identical files
+FIXED_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def zip_entry(name: str) -> zipfile.ZipInfo:
+    """ZipInfo as ZipFile.writestr(name, ...) would create it, minus the current time."""
+    info = zipfile.ZipInfo(name, date_time=FIXED_ZIP_DATE)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o600 << 16
+    return info
+
+
+class _FixedDateZipWriter:
+    """python-docx physical package writer with deterministic zip metadata."""
+
+    def __init__(self, pkg_file):
+        self._zipf = zipfile.ZipFile(pkg_file, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, pack_uri, blob):
+        self._zipf.writestr(zip_entry(pack_uri.membername), blob)
+
+    def close(self):
+        self._zipf.close()
+
+
+def save_document(doc, file_path):
+    """doc.save(), but byte-for-byte reproducible for the same document."""
+    package = doc.part.package
+    for part in package.parts:
+        part.before_marshal()
+    writer = _FixedDateZipWriter(file_path)
+    PackageWriter._write_content_types_stream(writer, package.parts)
+    PackageWriter._write_pkg_rels(writer, package.rels)
+    PackageWriter._write_parts(writer, package.parts)
+    writer.close()
+
+
+class PackageMedia:
+    """Default media handling: images become python-docx image parts of the document."""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    def add_picture(self, run, image, width=None, height=None):
+        return run.add_picture(image, width=width, height=height)
+
+    def relate_blob(self, blob: bytes) -> str:
+        return self.doc.part.get_or_add_image(io.BytesIO(blob))[0]
+
+    def blob_for(self, rId: str) -> bytes:
+        return self.doc.part.related_parts[rId].blob
+
+
+class StreamingDocxWriter:
+    """
+    Writes a .docx incrementally. The python-docx Document only serves as a
+    scratch area (and as the source of styles, numbering, settings...): each
+    flush() serializes the body elements produced so far, spools them to a temp
+    file and removes them from the tree. Images are written into the zip as soon
+    as they are added. Memory therefore stays flat regardless of document length.
+    """
+
+    def __init__(self, file_path, doc):
+        self.doc = doc
+        self._zip = zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED)
+        self._body = tempfile.TemporaryFile()
+        self._root_ns = {prefix: uri for prefix, uri in doc.element.nsmap.items() if prefix}
+        # Continue numbering after the template's own relationships (styles, settings, ...)
+        existing = [int(rId[3:]) for rId in doc.part.rels if rId.startswith("rId") and rId[3:].isdigit()]
+        self._next_rid = max(existing, default=0) + 1
+        self._next_shape_id = 1
+        self._media_by_sha = {}  # sha1 -> rId
+        self._media_rels = []    # (rId, target)
+        self._media_types = {}   # partname -> content type
+        # Image bytes for blob_for(), spooled to disk for the lifetime of the save
+        self._media_spool = tempfile.TemporaryFile()
+        self._media_spans = {}   # rId -> (offset, length) in _media_spool
+
+    # --- media ---
+
+    def relate_blob(self, blob: bytes, image: Image = None) -> str:
+        """Write an image into the package (once per distinct content) and return its rId."""
+        sha1 = hashlib.sha1(blob).hexdigest()
+        rId = self._media_by_sha.get(sha1)
+        if rId is not None:
+            return rId
+        if image is None:
+            image = Image.from_blob(blob)
+        rId = f"rId{self._next_rid}"
+        self._next_rid += 1
+        target = f"media/image{len(self._media_rels) + 1}.{image.ext}"
+        self._zip.writestr(zip_entry(f"word/{target}"), blob)
+        self._media_by_sha[sha1] = rId
+        self._media_rels.append((rId, target))
+        self._media_types[f"/word/{target}"] = image.content_type
+        self._remember_blob(rId, blob)
+        return rId
+
+    def _remember_blob(self, rId, blob):
+        # Blobs are not kept in memory; the writer's own spool file hands them back
+        offset = self._media_spool.seek(0, io.SEEK_END)
+        self._media_spool.write(blob)
+        self._media_spans[rId] = (offset, len(blob))
+
+    def blob_for(self, rId: str) -> bytes:
+        offset, length = self._media_spans[rId]
+        self._media_spool.seek(offset)
+        return self._media_spool.read(length)
+
+    def add_picture(self, run, image, width=None, height=None):
+        """Same markup as Run.add_picture, without creating a package image part."""
+        img = Image.from_file(image)
+        rId = self.relate_blob(img.blob, img)
+        cx, cy = img.scaled_dimensions(width, height)
+        # Real shape ids are assigned in document order by flush()
+        inline = CT_Inline.new_pic_inline(0, rId, img.filename, cx, cy)
+        run._r.add_drawing(inline)
+        return inline
+
+    # --- body ---
+
+    def flush(self):
+        """Serialize and drop every body element produced since the last flush."""
+        body = self.doc.element.body
+        for el in list(body):
+            if el.tag == _SECTPR_TAG:
+                continue
+            for docPr in el.iter(_DOCPR_TAG):
+                docPr.set("id", str(self._next_shape_id))
+                docPr.set("name", f"Picture {self._next_shape_id}")
+                self._next_shape_id += 1
+            self._body.write(self._serialize(el))
+            body.remove(el)
+
+    def _serialize(self, el) -> bytes:
+        xml = etree.tostring(el, encoding="utf-8")
+        # Drop namespace declarations already made on <w:document>
+        end = xml.index(b">")
+        head = _XMLNS_RE.sub(
+            lambda m: b"" if self._root_ns.get(m.group(1).decode()) == m.group(2).decode() else m.group(0),
+            xml[:end],
+        )
+        return head + xml[end:]
+
+    def close(self):
+        """Write document.xml, its relationships and the remaining package parts."""
+        self.flush()
+
+        # Everything except the body comes from the (now empty) scratch document
+        scratch = io.BytesIO()
+        self.doc.save(scratch)
+        with zipfile.ZipFile(scratch) as template:
+            for info in template.infolist():
+                if info.filename in (DOCUMENT_PART, DOCUMENT_RELS, CONTENT_TYPES):
+                    continue
+                self._zip.writestr(zip_entry(info.filename), template.read(info.filename))
+            content_types = template.read(CONTENT_TYPES)
+            rels_xml = template.read(DOCUMENT_RELS)
+
+        self._zip.writestr(zip_entry(CONTENT_TYPES), self._content_types(content_types))
+        self._zip.writestr(zip_entry(DOCUMENT_RELS), self._rels(rels_xml))
+
+        # <w:document ...><w:body> + streamed blocks + <w:sectPr .../></w:body></w:document>
+        doc_xml = serialize_part_xml(self.doc.element)
+        split_at = doc_xml.index(b"<w:body>") + len(b"<w:body>")
+        with self._zip.open(zip_entry(DOCUMENT_PART), "w", force_zip64=True) as out:
+            out.write(doc_xml[:split_at])
+            self._body.seek(0)
+            shutil.copyfileobj(self._body, out)
+            out.write(doc_xml[split_at:])
+
+        self._body.close()
+        self._media_spool.close()
+        self._zip.close()
+
+    def abort(self):
+        self._body.close()
+        self._media_spool.close()
+        self._zip.close()
+
+    def _rels(self, rels_xml: bytes) -> bytes:
+        extra = "".join(
+            f'<Relationship Id="{rId}" Type="{RT.IMAGE}" Target="{target}"/>'
+            for rId, target in self._media_rels
+        ).encode("utf-8")
+        end = rels_xml.rindex(b"</Relationships>")
+        return rels_xml[:end] + extra + rels_xml[end:]
+
+    def _content_types(self, ct_xml: bytes) -> bytes:
+        root = etree.fromstring(ct_xml)
+        ns = root.nsmap[None]
+        defaults = {el.get("Extension").lower() for el in root.findall(f"{{{ns}}}Default")}
+        for partname, content_type in sorted(self._media_types.items()):
+            ext = partname.rsplit(".", 1)[-1]
+            if (ext.lower(), content_type) in default_content_types:
+                if ext.lower() not in defaults:
+                    el = etree.SubElement(root, f"{{{ns}}}Default")
+                    el.set("Extension", ext)
+                    el.set("ContentType", content_type)
+                    defaults.add(ext.lower())
+            else:
+                el = etree.SubElement(root, f"{{{ns}}}Override")
+                el.set("PartName", partname)
+                el.set("ContentType", content_type)
+        # Same order python-docx uses: Defaults by extension, then Overrides by part name
+        children = sorted(root, key=lambda el: (0, el.get("Extension")) if el.get("Extension") else (1, el.get("PartName")))
+        root[:] = children
+        return etree.tostring(root, encoding="UTF-8", standalone=True)
@@ -0,0 +1,90 @@
+import re
+from collections import namedtuple
+from typing import List, Sequence
+from xml.sax.saxutils import escape
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml, OxmlElement
+from docx.oxml.ns import nsdecls
+from docx.shared import Emu
+from docx.text.run import Run
+from lxml import etree
+
+# Paragraph/run properties shared by a group of cells, as ready-made XML
+CellFormat = namedtuple("CellFormat", "pPr rPr")
+
+_NSDECL_RE = re.compile(r' xmlns:\w+="[^"]*"')
+_RUN_CONTENT_RE = re.compile(r'(\t|\r|\n)')
+
+
+def cell_format(alignment=None, apply_font=None) -> CellFormat:
+    """
+    Build a CellFormat once per column/row kind. `apply_font(font)` is run on a
+    scratch run (e.g. format_run) and whatever rPr it produces is reused verbatim.
+    """
+    pPr = ""
+    if alignment is not None:
+        pPr = f'<w:pPr><w:jc w:val="{WD_ALIGN_PARAGRAPH.to_xml(alignment)}"/></w:pPr>'
+    rPr = ""
+    if apply_font is not None:
+        run = Run(OxmlElement('w:r'), None)
+        apply_font(run.font)
+        if run._r.rPr is not None:
+            rPr = _NSDECL_RE.sub("", etree.tostring(run._r.rPr, encoding="unicode"))
+    return CellFormat(pPr, rPr)
+
+
+def _run_content_xml(text: str) -> str:
+    """Same run content python-docx writes for run.text: w:t, with w:tab / w:br for tabs and newlines."""
+    parts = []
+    for piece in _RUN_CONTENT_RE.split(text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece in ("\r", "\n"):
+            parts.append("<w:br/>")
+        elif piece:
+            space = ' xml:space="preserve"' if len(piece.strip()) < len(piece) else ""
+            parts.append(f"<w:t{space}>{escape(piece)}</w:t>")
+    return "".join(parts)
+
+
+def build_table_xml(rows: Sequence[Sequence[str]], cols: int, col_width_twips: int, style_id: str,
+                    header: List[CellFormat], body: List[CellFormat]) -> str:
+    """
+    Serialize a whole table in one pass. The first row uses the `header`
+    formats, the others `body` (one CellFormat per column). Cells beyond the
+    end of a short row are left empty; extra cells are dropped.
+    """
+    tc_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{col_width_twips}"/></w:tcPr>'
+    out = [
+        f'<w:tbl {nsdecls("w")}>',
+        f'<w:tblPr><w:tblStyle w:val="{escape(style_id)}"/><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>',
+        "<w:tblGrid>", f'<w:gridCol w:w="{col_width_twips}"/>' * cols, "</w:tblGrid>",
+    ]
+    for r, row in enumerate(rows):
+        formats = header if r == 0 else body
+        out.append("<w:tr>")
+        for c in range(cols):
+            if c < len(row):
+                fmt = formats[c]
+                out.append(f"<w:tc>{tc_pr}<w:p>{fmt.pPr}<w:r>{fmt.rPr}{_run_content_xml(row[c])}</w:r></w:p></w:tc>")
+            else:
+                out.append(f"<w:tc>{tc_pr}<w:p/></w:tc>")
+        out.append("</w:tr>")
+    out.append("</w:tbl>")
+    return "".join(out)
+
+
+def add_table_fast(doc, rows: Sequence[Sequence[str]], cols: int, style_name: str,
+                   header: List[CellFormat], body: List[CellFormat]):
+    """
+    Append a table to the document body without going through python-docx's
+    per-cell API. Produces the same markup as doc.add_table() followed by
+    cell.text / paragraph.alignment / run formatting for every cell.
+    """
+    col_width = Emu(doc._block_width // cols) if cols > 0 else Emu(0)
+    style_id = doc.styles[style_name].style_id
+    tbl = parse_xml(build_table_xml(rows, cols, col_width.twips, style_id, header, body))
+    doc.element.body._insert_tbl(tbl)
+    return tbl
@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+from dataclasses import asdict
+from typing import List, Optional
+from core.config import (
+    EXPORT_CACHE_DIR, EXPORT_CACHE_BYTES, EQUATION_DPI, FIGURE_TARGET_DPI, FRAGMENT_FORMAT_VERSION,
+)
+from core.models.data_classes import Settings, Figure, Table, Citation
+from core.utils.cache import FileStore, LRUCache
+
+# Finished .docx files keyed by export_cache_key()
+EXPORT_CACHE = FileStore(EXPORT_CACHE_DIR, EXPORT_CACHE_BYTES)
+
+# (path, mtime_ns, size) -> sha256, so unchanged images are not re-read for every request
+_DIGEST_CACHE = LRUCache(4096)
+
+
+def file_digest(path: str) -> Optional[str]:
+    """sha256 of a file's content, or None when it cannot be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    memo_key = (path, st.st_mtime_ns, st.st_size)
+    digest = _DIGEST_CACHE.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+        except OSError:
+            return None
+        digest = sha.hexdigest()
+        _DIGEST_CACHE.put(memo_key, digest)
+    return digest
+
+
+def export_cache_key(content: str, settings: Settings, figures: List[Figure], tables: List[Table],
+                     citations: List[Citation], abbreviations: List[dict], extra=None) -> str:
+    """
+    Canonical hash of everything an export depends on: the request (after
+    defaults are filled in, key order ignored), the content of every figure
+    image, and the renderer versions/settings that shape the output.
+    """
+    raw = json.dumps(
+        [
+            FRAGMENT_FORMAT_VERSION, EQUATION_DPI, FIGURE_TARGET_DPI, extra,
+            content, asdict(settings),
+            [asdict(f) for f in figures],
+            [file_digest(os.path.abspath(f.path)) if f.path else None for f in figures],
+            [asdict(t) for t in tables], [asdict(c) for c in citations], abbreviations or [],
+        ],
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -1,66 +1,72 @@
 from docx import Document
 from docx.shared import Cm, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_TAB_ALIGNMENT, WD_TAB_LEADER
 from docx.enum.style import WD_STYLE_TYPE
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from dataclasses import asdict, replace
 from core.models.data_classes import Settings, Figure, Table, Citation
-from core.utils.helpers import format_citation_apa
+from core.utils.helpers import format_citation_apa, advance_heading_counts, heading_title
+from core.utils.markdown_ast import (
+    iter_blocks, split_chapters, iter_math, TextSpan, MathSpan,
+    Heading, Paragraph, BulletItem, TableBlock, TableCaption, FigureRef,
+)
+from core.utils.math_render import render_latex_to_image, prerender_equations, warm_up_math_rendering
+from core.utils.omml_xslt import load_mathml_to_omml_xslt, get_mathml_to_omml_xslt
+from core.utils.math_cache import normalize_latex
+from core.utils.cache import LRUCache
+from core.utils.metrics import PhaseTimer
+from core.utils.docx_stream import PackageMedia, StreamingDocxWriter, save_document
+from core.utils.docx_tables import cell_format, add_table_fast
+from core.utils.image_prep import figure_key, index_figures, figure_width_cm, prepare_figure_images
+from core.utils.pagination import (
+    TocEntry, estimate_layout, hard_wrap_lines, TOC_LEVELS, TOC_LEVEL_INDENT_CM, TOC_SPACE_AFTER,
+)
+from core.utils.pdf_fonts import resolve_font_files
+from core.utils.docx_fragments import (
+    FRAGMENT_CACHE, chapter_cache_key, store_fragment, restore_fragment, renumber_drawing_ids,
+)
+from core.config import OMML_CACHE_ITEMS, DOCX_STREAMING_MIN_CHARS, FIGURE_TARGET_DPI
 from typing import List
+import io
 import os
-import re
+import copy
+import json
+import time
+from collections import Counter
 import traceback
-import matplotlib.pyplot as plt
-import io
-import latex2mathml.converter
 from lxml import etree
 
-# XSLT to convert MathML to OMML (Word's equation format)
-MATHML_TO_OMML_XSLT = None
-
-def get_mathml_to_omml_xslt():
-    """Load the MathML to OMML XSLT stylesheet."""
-    global MATHML_TO_OMML_XSLT
-    if MATHML_TO_OMML_XSLT is None:
-        # This XSLT is bundled with Microsoft Office
-        # On Mac, it's typically at this location
-        xslt_paths = [
-            "/Applications/Microsoft Word.app/Contents/Resources/MML2OMML.XSL",
-            "/Applications/Microsoft Office/Microsoft Word.app/Contents/Resources/MML2OMML.XSL",
-            # Fallback for different Office versions
-            os.path.expanduser("~/Applications/Microsoft Word.app/Contents/Resources/MML2OMML.XSL"),
-        ]
-        
-        for xslt_path in xslt_paths:
-            if os.path.exists(xslt_path):
-                xslt_doc = etree.parse(xslt_path)
-                MATHML_TO_OMML_XSLT = etree.XSLT(xslt_doc)
-                print(f"Loaded MML2OMML.XSL from: {xslt_path}")
-                break
-        
-        if MATHML_TO_OMML_XSLT is None:
-            print("Warning: MML2OMML.XSL not found. LaTeX equations will use fallback image rendering.")
-    
-    return MATHML_TO_OMML_XSLT
+# LaTeX source (normalized) -> transformed oMath element, or False when conversion failed
+_OMML_CACHE = LRUCache(OMML_CACHE_ITEMS)
+
+# Settings (JSON) -> empty .docx with setup_styles applied, so exports skip rebuilding the styles
+_BASE_DOCUMENTS = LRUCache(8)
 
 def latex_to_omml(latex_str):
     """Convert LaTeX string to Word OMML (Office Math Markup Language)."""
+    # Get the XSLT transformer
+    xslt = get_mathml_to_omml_xslt()
+    if xslt is None:
+        return None
+    
+    clean_latex = normalize_latex(latex_str)
+    cached = _OMML_CACHE.get(clean_latex)
+    if cached is None:
+        cached = _convert_latex_to_omml(clean_latex, xslt)
+        _OMML_CACHE.put(clean_latex, cached if cached is not None else False)
+    if cached is False:
+        return None
+    # Each caller appends the element into its own run, so hand out a copy
+    return copy.deepcopy(cached)
+
+def _convert_latex_to_omml(clean_latex, xslt):
     try:
-        # Clean up the LaTeX string
-        clean_latex = latex_str.strip()
-        if clean_latex.startswith('$') and clean_latex.endswith('$'):
-            clean_latex = clean_latex[1:-1]
-        if clean_latex.startswith('$$') and clean_latex.endswith('$$'):
-            clean_latex = clean_latex[2:-2]
-        
+        # Imported on first use: exports with no equations never load it
+        import latex2mathml.converter
         # Convert LaTeX to MathML
         mathml_str = latex2mathml.converter.convert(clean_latex)
         
-        # Get the XSLT transformer
-        xslt = get_mathml_to_omml_xslt()
-        if xslt is None:
-            return None
-        
         # Parse MathML and transform to OMML
         mathml_tree = etree.fromstring(mathml_str.encode('utf-8'))
         omml_tree = xslt(mathml_tree)
@@ -75,102 +81,11 @@ def latex_to_omml(latex_str):
         traceback.print_exc()
         return None
 
-def insert_omml_equation(paragraph, latex_str):
-    """Insert a LaTeX equation as native Word OMML into a paragraph."""
-    omml = latex_to_omml(latex_str)
-    if omml is not None:
-        # Create a run and append the OMML
-        run = paragraph.add_run()
-        run._r.append(omml)
-        return True
-    return False
-
-def render_latex_to_image(latex_str, font_size_pt=12, is_display=False):
-    """Renders LaTeX string to an image stream using matplotlib."""
-    try:
-        # Configure Matplotlib to use STIX (Times-like) for Math
-        plt.rcParams['mathtext.fontset'] = 'stix'
-        plt.rcParams['font.family'] = 'Times New Roman'
-        
-        # High DPI for quality
-        dpi = 600
-        
-        # Create figure
-        fig = plt.figure(figsize=(8, 2), dpi=dpi)
-        fig.patch.set_alpha(0)
-        
-        # Clean up LaTeX
-        render_str = latex_str.strip()
-        if render_str.startswith('$$') and render_str.endswith('$$'):
-            render_str = render_str[2:-2]
-        elif render_str.startswith('$') and render_str.endswith('$'):
-            render_str = render_str[1:-1]
-        
-        # Check for unsupported LaTeX environments - return None to trigger fallback
-        unsupported_patterns = [
-            r'\\begin\{', r'\\end\{',  # environments like cases, matrix, etc.
-            r'\\underbrace', r'\\overbrace',  # braces
-            r'\\xrightarrow', r'\\xleftarrow',  # extensible arrows
-            r'\\substack',  # stacked subscripts
-            r'\\overset', r'\\underset',  # over/under set
-        ]
-        for pattern in unsupported_patterns:
-            if re.search(pattern, render_str):
-                print(f"Unsupported LaTeX pattern detected: {pattern} in '{render_str[:50]}...'")
-                plt.close(fig)
-                return None, 0, 0, 0
-            
-        # Fix common LaTeX commands
-        render_str = re.sub(r'\\displaystyle\s*', '', render_str)
-        render_str = re.sub(r'\\textstyle\s*', '', render_str)
-        render_str = re.sub(r'\\ge(?![a-zA-Z])', r'\\geq', render_str)
-        render_str = re.sub(r'\\le(?![a-zA-Z])', r'\\leq', render_str)
-        render_str = re.sub(r'\\text\{', r'\\mathrm{', render_str)
-        render_str = render_str.replace(r'\{', r'\lbrace ')
-        render_str = render_str.replace(r'\}', r'\rbrace ')
-        render_str = re.sub(r'\\arg(?![a-zA-Z])', r'\\mathrm{arg}', render_str)
-        render_str = re.sub(r'\\max(?![a-zA-Z])', r'\\mathrm{max}', render_str)
-        render_str = re.sub(r'\\min(?![a-zA-Z])', r'\\mathrm{min}', render_str)
-        
-        render_str = f"${render_str}$"
-            
-        # Adjust font size to match document text
-        effective_font_size = font_size_pt * 0.65  # Inline math smaller to match text height
-        if is_display:
-            effective_font_size = font_size_pt * 0.60  # Display math also smaller
-            
-        # Draw text with baseline alignment for accurate descent calculation
-        text = fig.text(0.5, 0.5, render_str, fontsize=effective_font_size, ha='center', va='baseline')
-        
-        # Get bounding box
-        renderer = fig.canvas.get_renderer()
-        bbox = text.get_window_extent(renderer=renderer)
-        
-        # Calculate dimensions
-        width_in = bbox.width / dpi
-        height_in = bbox.height / dpi
-        
-        # Calculate descent (distance from baseline to bottom)
-        # Baseline is at 0.5 * fig_height_in_pixels
-        fig_height_px = fig.get_window_extent().height
-        baseline_y = 0.5 * fig_height_px
-        descent_px = baseline_y - bbox.y0
-        descent_in = descent_px / dpi
-        
-        # Save with tight bounding box to eliminate whitespace
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', pad_inches=0.01, transparent=True)
-        buf.seek(0)
-        plt.close(fig)
-        
-        return buf, height_in, width_in, descent_in
-        
-    except Exception as e:
-        print(f"Error rendering LaTeX: {e}")
-        traceback.print_exc()
-        try: plt.close(fig)
-        except: pass
-        return None, 0, 0, 0
+def add_omml_equation(paragraph, omml):
+    """Append a native Word OMML equation (see latex_to_omml) to a paragraph."""
+    # Create a run and append the OMML
+    run = paragraph.add_run()
+    run._r.append(omml)
 
 def create_element(name):
     return OxmlElement(name)
@@ -178,28 +93,45 @@ def create_element(name):
 def create_attribute(element, name, value):
     element.set(qn(name), value)
 
-def add_toc_field(paragraph, field_code):
-    """Insert a Word field (like TOC) into a paragraph"""
+def _add_field_char(paragraph, char_type):
     run = paragraph.add_run()
     fldChar = create_element('w:fldChar')
-    create_attribute(fldChar, 'w:fldCharType', 'begin')
+    create_attribute(fldChar, 'w:fldCharType', char_type)
     run._element.append(fldChar)
 
+def _add_field_start(paragraph, field_code):
+    """Field begin, instruction and separator: what follows is the field's displayed result"""
+    _add_field_char(paragraph, 'begin')
+
     run = paragraph.add_run()
     instrText = create_element('w:instrText')
     create_attribute(instrText, 'xml:space', 'preserve')
     instrText.text = field_code
     run._element.append(instrText)
 
-    run = paragraph.add_run()
-    fldChar = create_element('w:fldChar')
-    create_attribute(fldChar, 'w:fldCharType', 'separate')
-    run._element.append(fldChar)
+    _add_field_char(paragraph, 'separate')
 
-    run = paragraph.add_run()
-    fldChar = create_element('w:fldChar')
-    create_attribute(fldChar, 'w:fldCharType', 'end')
-    run._element.append(fldChar)
+def add_toc_field(paragraph, field_code):
+    """Insert a Word field (like TOC) into a paragraph"""
+    _add_field_start(paragraph, field_code)
+    _add_field_char(paragraph, 'end')
+
+def add_prefilled_toc(doc, field_code, entries: List[TocEntry]):
+    """
+    Insert a TOC field whose result already lists `entries` with their
+    estimated page numbers, one 'toc N' paragraph each. Word can still
+    update it (F9) like an empty one.
+    """
+    if not entries:
+        add_toc_field(doc.add_paragraph(), field_code)
+        return
+    for i, entry in enumerate(entries):
+        p = doc.add_paragraph(style=f'toc {entry.level}')
+        if i == 0:
+            _add_field_start(p, field_code)
+        p.add_run(entry.text)
+        p.add_run(f"\t{entry.page}")
+    _add_field_char(p, 'end')
 
 def set_font_complex(font, font_name, font_size=None, bold=False, italic=False, color=None):
     """Set font properties comprehensively for all script types"""
@@ -217,8 +149,45 @@ def set_font_complex(font, font_name, font_size=None, bold=False, italic=False,
     rFonts.set(qn('w:ascii'), font_name)
     rFonts.set(qn('w:hAnsi'), font_name)
     rFonts.set(qn('w:eastAsia'), font_name)
-    rFonts.set(qn('w:eastAsia'), font_name)
     rFonts.set(qn('w:cs'), font_name)
+    # Theme fonts (e.g. in the built-in heading styles) would override the explicit ones
+    for attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+        rFonts.attrib.pop(qn(attr), None)
+
+BLACK = RGBColor(0, 0, 0)
+
+def style_run_defaults(settings: Settings):
+    """(size, bold, italic) each paragraph style gives its runs, as set up in setup_styles."""
+    return {
+        'Normal': (settings.font_size, False, False),
+        'Heading 1': (settings.h1_size, True, False),
+        'Heading 2': (settings.h2_size, True, False),
+        'Heading 3': (settings.h3_size, True, True),
+        'Heading 4': (settings.font_size, False, True),
+        'Heading 5': (settings.font_size, False, True),
+        'Front Heading': (settings.h1_size, True, False),
+        'Figure Caption': (settings.font_size, False, True),
+        'Table Caption': (settings.font_size, True, False),
+    }
+
+def format_run(font, settings: Settings, style_name='Normal', font_size=None, bold=False, italic=False, color=BLACK):
+    """
+    Apply run formatting. In style-driven mode only the properties that differ
+    from what the paragraph style already provides are written; otherwise the
+    full set_font_complex block is emitted on the run.
+    """
+    if not settings.style_driven:
+        set_font_complex(font, settings.font_family, font_size, bold=bold, italic=italic, color=color)
+        return
+    base_size, base_bold, base_italic = style_run_defaults(settings)[style_name]
+    if font_size and font_size != base_size:
+        font.size = Pt(font_size)
+    if bold != base_bold:
+        font.bold = bold
+    if italic != base_italic:
+        font.italic = italic
+    if color is not None and color != BLACK:
+        font.color.rgb = color
 
 def set_run_position(run, pt_val):
     """
@@ -243,6 +212,11 @@ def setup_styles(doc, settings: Settings):
     style = doc.styles['Normal']
     # Use set_font_complex to ensure font is applied to all script types (important for Vietnamese)
     set_font_complex(style.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
+    # Document defaults point at theme fonts; drop them so the Normal font applies to unformatted runs too
+    default_fonts = doc.styles.element.find(f"{qn('w:docDefaults')}/{qn('w:rPrDefault')}/{qn('w:rPr')}/{qn('w:rFonts')}")
+    if default_fonts is not None:
+        for attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+            default_fonts.attrib.pop(qn(attr), None)
 
     # Paragraph formatting for Normal style
     pf = style.paragraph_format
@@ -348,12 +322,515 @@ def setup_styles(doc, settings: Settings):
     except:
         pass
 
+    # --- Paragraph styles used by style-driven output ---
+    # Bullet 1-3: hanging indent so the bullet sits at the text indent and wrapped lines align
+    hanging = 0.5 # cm
+    for level in (1, 2, 3):
+        total_indent = settings.indent + (level - 1) * 0.75
+        style = _get_or_add_paragraph_style(styles, f'Bullet {level}')
+        pf = style.paragraph_format
+        pf.left_indent = Cm(total_indent + hanging)
+        pf.first_line_indent = Cm(-hanging)
+        pf.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        pf.tab_stops.clear_all()
+        pf.tab_stops.add_tab_stop(Cm(total_indent + hanging))
+
+    # Figure: centered image paragraph without indents
+    style = _get_or_add_paragraph_style(styles, 'Figure')
+    style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    style.paragraph_format.left_indent = Cm(0)
+    style.paragraph_format.right_indent = Cm(0)
+    style.paragraph_format.first_line_indent = Cm(0)
+
+    # Equation: centered display math
+    style = _get_or_add_paragraph_style(styles, 'Equation')
+    style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    style.paragraph_format.first_line_indent = Cm(0)
+    style.paragraph_format.space_before = Pt(6)
+    style.paragraph_format.space_after = Pt(6)
+
+    # Reference: bibliography entries
+    style = _get_or_add_paragraph_style(styles, 'Reference')
+    style.paragraph_format.first_line_indent = Cm(0)
+    style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+
+    # toc 1-3: Word's built-in names for table of contents entries (also used by the lists)
+    content_width = 21.0 - settings.margin_left - settings.margin_right
+    for level in range(1, TOC_LEVELS + 1):
+        style = _get_or_add_paragraph_style(styles, f'toc {level}')
+        # Not a custom style: Word fills these in when it updates the fields
+        style.element.attrib.pop(qn('w:customStyle'), None)
+        pf = style.paragraph_format
+        pf.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        pf.first_line_indent = Cm(0)
+        pf.left_indent = Cm((level - 1) * TOC_LEVEL_INDENT_CM)
+        pf.space_after = Pt(TOC_SPACE_AFTER)
+        # Page numbers right-aligned after a dot leader
+        pf.tab_stops.add_tab_stop(Cm(content_width), WD_TAB_ALIGNMENT.RIGHT, WD_TAB_LEADER.DOTS)
+
+def new_styled_document(settings: Settings):
+    """A fresh Document with the thesis styles for these settings (styles are built once per settings)."""
+    key = json.dumps(asdict(settings), sort_keys=True)
+    blob = _BASE_DOCUMENTS.get(key)
+    if blob is None:
+        doc = Document()
+        setup_styles(doc, settings)
+        buf = io.BytesIO()
+        doc.save(buf)
+        blob = buf.getvalue()
+        _BASE_DOCUMENTS.put(key, blob)
+    return Document(io.BytesIO(blob))
+
+def warm_up_export(settings: Settings = None) -> dict:
+    """
+    Load everything the first export would otherwise pay for: the MathML->OMML
+    XSLT and latex2mathml, matplotlib with its font cache, the glyph widths
+    used for page numbers and the styled base document for the default
+    settings. Returns what is available.
+    """
+    settings = settings or Settings()
+    state = {"xslt": get_mathml_to_omml_xslt() is not None}
+    if state["xslt"]:
+        latex_to_omml("x^2")
+    state["math_images"] = warm_up_math_rendering()
+    estimate_layout([], settings)
+    state["layout_fonts"] = resolve_font_files(settings.font_family) is not None
+    new_styled_document(settings)
+    state["base_document"] = True
+    return state
+
+def _get_or_add_paragraph_style(styles, name):
+    try:
+        style = styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+    except:
+        style = styles[name]
+    style.base_style = styles['Normal']
+    return style
+
+def collect_latex_fragments(blocks):
+    """
+    Pre-pass over the parsed content: return every (latex, is_display) fragment
+    that will need a raster image during assembly (bullets, and paragraphs whose
+    equations cannot be converted to native OMML).
+    """
+    fragments = []
+    omml_available = get_mathml_to_omml_xslt() is not None
+    for block, span in iter_math(blocks):
+        if isinstance(block, BulletItem):
+            # Bullets always use inline images
+            fragments.append((span.latex, False))
+        elif omml_available and latex_to_omml(span.latex) is not None:
+            continue
+        else:
+            fragments.append((span.latex, span.display))
+    return fragments
+
+class _ContentState:
+    """Document, settings and heading counters carried from block to block."""
+
+    def __init__(self, doc, settings: Settings, figures: List[Figure], media):
+        self.doc = doc
+        self.settings = settings
+        self.figures = figures
+        self.figure_index = index_figures(figures)
+        # figure_key -> preprocessed image bytes (None when the file is missing)
+        self.figure_images = {}
+        # PackageMedia or StreamingDocxWriter: how pictures get into the package
+        self.media = media
+        # h1..h5 counters
+        self.counts = [0, 0, 0, 0, 0]
+        # Export statistics (equations by outcome, images embedded, tables)
+        self.stats = Counter()
+        # Seconds per block type when the caller asked for timings, else None
+        self.block_timings = None
+        # id(block) -> line starts per text segment, when the line breaks are locked (hard_wrap)
+        self.line_breaks = {}
+
+def _add_text_run(p, span: TextSpan, settings: Settings):
+    run = p.add_run(span.text)
+    format_run(run.font, settings, 'Normal', settings.font_size, bold=span.bold, italic=span.italic)
+    if span.underline:
+        run.font.underline = True
+    return run
+
+class _LineBreaks:
+    """Line starts of one text segment (see hard_wrap_lines), consumed as its runs are added."""
+
+    def __init__(self, starts: List[int]):
+        self.starts = starts
+        self.next = 1  # the first line starts at 0
+        self.offset = 0
+
+    def take(self, length: int) -> List[int]:
+        """Offsets (relative to the next `length` characters) at which new lines start."""
+        end = self.offset + length
+        cuts = []
+        while self.next < len(self.starts) and self.starts[self.next] < end:
+            cuts.append(self.starts[self.next] - self.offset)
+            self.next += 1
+        self.offset = end
+        return cuts
+
+def _add_line_break(p):
+    """Explicit line break (w:br) after the runs so far, dropping the spaces the line would have wrapped at."""
+    runs = p.runs
+    if runs and runs[-1].text.endswith(" "):
+        runs[-1].text = runs[-1].text.rstrip(" ")
+    p.add_run().add_break()
+
+def _add_wrapped_text(p, span: TextSpan, settings: Settings, breaks: _LineBreaks):
+    """Add a text span with a line break wherever a precomputed line starts."""
+    pos = 0
+    for cut in breaks.take(len(span.text)):
+        if cut > pos:
+            _add_text_run(p, replace(span, text=span.text[pos:cut]), settings)
+        _add_line_break(p)
+        pos = cut
+    if pos < len(span.text):
+        _add_text_run(p, replace(span, text=span.text[pos:]), settings)
+
+def _add_heading(state: _ContentState, block: Heading):
+    settings = state.settings
+    doc = state.doc
+    counts = state.counts
+    level = block.level
+    advance_heading_counts(counts, level)
+    # A split chapter title keeps its "\n": python-docx writes it as a soft break
+    # (Shift+Enter), so the title stays one paragraph (good for the TOC) on two lines
+    full_title = heading_title(settings, counts, level, block.text)
+
+    # Heading 1: CHƯƠNG I
+    if level == 1:
+        heading = doc.add_paragraph(full_title, style='Heading 1')
+        for run in heading.runs:
+            format_run(run.font, settings, 'Heading 1', settings.h1_size, bold=True)
+        return
+
+    font_size, bold, italic = {
+        2: (settings.h2_size, True, False),
+        3: (settings.h3_size, True, True),
+        4: (settings.font_size, True, True),
+        5: (settings.font_size, False, True),
+    }[level]
+    
+    # Word usually doesn't have Heading 4/5 by default or it's small. Fall back to Normal
+    style_name = f'Heading {level}'
+    try:
+        heading = doc.add_paragraph(full_title, style=style_name)
+    except:
+        style_name = 'Normal'
+        heading = doc.add_paragraph(full_title, style=style_name)
+    
+    for run in heading.runs:
+        format_run(run.font, settings, style_name, font_size, bold=bold, italic=italic)
+
+def _add_bullet(state: _ContentState, block: BulletItem):
+    settings = state.settings
+    level = block.level
+    
+    # Chuẩn đồ án Việt Nam: dùng gạch đầu dòng (–) và dấu cộng (+)
+    # Sử dụng En Dash (–) thay vì Hyphen (-) cho đẹp hơn
+    bullet_char = "\u2013" # En Dash
+    if level == 2:
+        bullet_char = "+"
+    
+    if settings.style_driven:
+        # Indents and tab stop come from the 'Bullet N' style (see setup_styles)
+        p = state.doc.add_paragraph(style=f'Bullet {min(level, 3)}')
+    else:
+        p = _add_manual_bullet_paragraph(state.doc, settings, level)
+    
+    # Add bullet char and tab
+    run = p.add_run(f"{bullet_char}\t")
+    format_run(run.font, settings)
+    
+    segments = state.line_breaks.get(id(block))
+    breaks = _LineBreaks(segments[0]) if segments else None
+    for span in block.inlines:
+        # LaTeX handling: bullets always use inline images
+        if isinstance(span, MathSpan):
+            if breaks is not None and breaks.take(1):
+                _add_line_break(p)
+            image_stream, h_in, w_in, descent_in = render_latex_to_image(span.latex, font_size_pt=settings.font_size)
+            if image_stream:
+                run = p.add_run()
+                # Convert inches to docx Length (Cm or Inches)
+                state.media.add_picture(run, image_stream, height=Cm(h_in * 2.54))
+                # Lower the image by descent amount to align baseline
+                # descent_in is in inches. 1 inch = 72 points.
+                set_run_position(run, -descent_in * 72)
+                state.stats["equations_image"] += 1
+            else:
+                run = p.add_run(f"${span.latex}$")
+                format_run(run.font, settings)
+                state.stats["equations_fallback"] += 1
+            continue
+        if breaks is not None:
+            _add_wrapped_text(p, span, settings, breaks)
+        else:
+            _add_text_run(p, span, settings)
+
+def _add_manual_bullet_paragraph(doc, settings: Settings, level):
+    """Bullet paragraph with direct indent formatting (legacy output)."""
+    p = doc.add_paragraph(style='Normal')
+    
+    # Calculate indent
+    # Base indent (e.g. 1.27cm) + Level indent
+    base_indent = settings.indent # cm
+    level_indent = (level - 1) * 0.75 # cm
+    total_indent = base_indent + level_indent
+    
+    # Hanging indent logic:
+    # Left Indent = Total Indent + Hanging Amount
+    # First Line Indent = -Hanging Amount
+    # This makes the bullet sit at Total Indent, and text wrap nicely.
+    hanging = 0.5 # cm (reduced from 0.63 for tighter look)
+    
+    p_fmt = p.paragraph_format
+    p_fmt.left_indent = Cm(total_indent + hanging)
+    p_fmt.first_line_indent = Cm(-hanging)
+    p_fmt.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    p_fmt.tab_stops.add_tab_stop(Cm(total_indent + hanging))
+    return p
+
+def _add_display_paragraph(doc, settings: Settings):
+    """Centered paragraph holding a display equation."""
+    if settings.style_driven:
+        return doc.add_paragraph(style='Equation')
+    math_p = doc.add_paragraph()
+    math_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    math_p.paragraph_format.first_line_indent = Cm(0)
+    math_p.paragraph_format.space_before = Pt(6)
+    math_p.paragraph_format.space_after = Pt(6)
+    return math_p
+
+def _add_paragraph(state: _ContentState, block: Paragraph):
+    settings = state.settings
+    doc = state.doc
+    # Normal paragraph with formatting support
+    p = doc.add_paragraph(style='Normal')
+    # Display equations split the text into several paragraphs, all formatted alike
+    text_paragraphs = [p]
+    
+    # Locked line breaks: one list of line starts per text segment (display equations split them)
+    segments = state.line_breaks.get(id(block))
+    breaks = _LineBreaks(segments[0]) if segments else None
+    segment = 0
+    for span in block.inlines:
+        if isinstance(span, TextSpan):
+            if breaks is not None:
+                _add_wrapped_text(p, span, settings, breaks)
+            else:
+                _add_text_run(p, span, settings)
+            continue
+        
+        # LaTeX handling: display math $$...$$ vs inline $...$
+        is_display = span.display
+        latex_content = span.latex
+        if breaks is not None:
+            if is_display:
+                segment += 1
+                breaks = _LineBreaks(segments[segment])
+            elif breaks.take(1):
+                _add_line_break(p)
+        
+        # Try native OMML first (best quality)
+        omml = latex_to_omml(latex_content)
+        if omml is not None:
+            state.stats["equations_omml"] += 1
+            if is_display:
+                # Display math gets its own centered paragraph, as the image below,
+                # so the text after it starts on a new line
+                add_omml_equation(_add_display_paragraph(doc, settings), omml)
+                p = doc.add_paragraph(style='Normal')
+                text_paragraphs.append(p)
+            else:
+                add_omml_equation(p, omml)
+            continue
+        
+        # Fallback to image rendering
+        image_stream, h_in, w_in, descent_in = render_latex_to_image(latex_content, font_size_pt=settings.font_size, is_display=is_display)
+        state.stats["equations_image" if image_stream else "equations_fallback"] += 1
+        if image_stream:
+            scaled_height = h_in * 2.54
+            if is_display:
+                # Display math: create new centered paragraph
+                run = _add_display_paragraph(doc, settings).add_run()
+                state.media.add_picture(run, image_stream, height=Cm(scaled_height))
+                # Create new paragraph for remaining text
+                p = doc.add_paragraph(style='Normal')
+                text_paragraphs.append(p)
+            else:
+                run = p.add_run()
+                state.media.add_picture(run, image_stream, height=Cm(scaled_height))
+                # Adjust baseline shift proportionally
+                set_run_position(run, -descent_in * 72)
+        else:
+            # Fallback: Show placeholder for complex formulas
+            if is_display:
+                # Create centered paragraph with placeholder
+                run = _add_display_paragraph(doc, settings).add_run(f"[Công thức phức tạp - cần chèn thủ công]")
+                format_run(run.font, settings, italic=True, color=RGBColor(128, 128, 128))
+                # Create new paragraph for remaining text
+                p = doc.add_paragraph(style='Normal')
+                text_paragraphs.append(p)
+            else:
+                # Inline: just show simple placeholder
+                run = p.add_run("[công thức]")
+                format_run(run.font, settings, italic=True, color=RGBColor(128, 128, 128))
+    
+    if settings.style_driven:
+        # Indent and justification already come from the Normal style
+        return
+    for p in text_paragraphs:
+        p.paragraph_format.first_line_indent = Cm(settings.indent)
+        p.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        for run in p.runs:
+            set_font_complex(run.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
+
+def _add_table(state: _ContentState, block: TableBlock):
+    settings = state.settings
+    doc = state.doc
+    rows_data = block.rows
+    
+    # Add spacing before table
+    doc.add_paragraph() 
+
+    # Header row bold and centered, other rows left-aligned
+    cols = len(rows_data[0])
+    header = cell_format(WD_ALIGN_PARAGRAPH.CENTER, lambda font: format_run(font, settings, bold=True))
+    body = cell_format(WD_ALIGN_PARAGRAPH.LEFT, lambda font: format_run(font, settings))
+    add_table_fast(doc, rows_data, cols, 'Table Grid', [header] * cols, [body] * cols)
+    state.stats["tables"] += 1
+    
+    # Render Caption BELOW Table
+    if block.caption:
+        # Use Table Caption Style
+        doc.add_paragraph(block.caption, style='Table Caption')
+    
+    # Add spacing after table group
+    doc.add_paragraph()
+
+def _add_figure(state: _ContentState, block: FigureRef):
+    doc = state.doc
+    fig_num = block.number
+    caption = block.caption
+    print(f"DEBUG: Found placeholder for {fig_num}")
+    
+    # Find figure data (index keys ignore spaces)
+    fig_data = state.figure_index.get(figure_key(fig_num))
+    
+    if not fig_data:
+        print(f"DEBUG: Figure data not found for {fig_num}")
+        doc.add_paragraph(f"[Hình ảnh không tìm thấy dữ liệu: {fig_num}]", style='Normal')
+        return
+    
+    print(f"DEBUG: Found figure data: {fig_data.path}")
+    if not fig_data.path:
+        print("DEBUG: Figure path is empty")
+        return
+    
+    # Resolve path if relative
+    img_path = os.path.abspath(fig_data.path)
+    try:
+        # Image was checked and downsampled up front (see prepare_figure_images)
+        image = state.figure_images.get(figure_key(fig_num))
+        if image is not None:
+            # Add image
+            # Use width from figure data if available, else default to 16cm
+            width = Cm(figure_width_cm(fig_data))
+            
+            # Create a new paragraph for the image
+            if state.settings.style_driven:
+                p = doc.add_paragraph(style='Figure')
+            else:
+                p = doc.add_paragraph()
+                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                
+                # Reset indentation to ensure true center
+                p.paragraph_format.left_indent = Cm(0)
+                p.paragraph_format.right_indent = Cm(0)
+                p.paragraph_format.first_line_indent = Cm(0)
+            
+            run = p.add_run()
+            state.media.add_picture(run, io.BytesIO(image), width=width)
+            state.stats["images_embedded"] += 1
+            print(f"DEBUG: Inserted image {img_path}")
+            
+            # Add caption
+            caption_text = f"{fig_num}: {caption}"
+            # Use 'Figure Caption' style which is defined as Black/Italic
+            caption_p = doc.add_paragraph(caption_text, style='Figure Caption')
+            if not state.settings.style_driven:
+                caption_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            
+        else:
+            print(f"DEBUG: Image path not found: {img_path}")
+            doc.add_paragraph(f"[Hình ảnh không tìm thấy: {img_path}]", style='Normal')
+    except Exception as e:
+        print(f"Error adding image {img_path}: {e}")
+        doc.add_paragraph(f"[Lỗi chèn hình: {fig_num}]", style='Normal')
+
+def _add_table_caption(state: _ContentState, block: TableCaption):
+    state.doc.add_paragraph(block.text, style='Table Caption')
+
+_BLOCK_HANDLERS = {
+    Heading: _add_heading,
+    Paragraph: _add_paragraph,
+    BulletItem: _add_bullet,
+    TableBlock: _add_table,
+    TableCaption: _add_table_caption,
+    FigureRef: _add_figure,
+}
+
+# Timing names for the share of the "body" phase spent in each block type
+_BLOCK_PHASES = {
+    Heading: "body_headings",
+    Paragraph: "body_paragraphs",
+    BulletItem: "body_bullets",
+    TableBlock: "body_tables",
+    TableCaption: "body_tables",
+    FigureRef: "body_figures",
+}
+
+def add_content_blocks(state: _ContentState, blocks):
+    """Append parsed content blocks to the document."""
+    timings = state.block_timings
+    if timings is None:
+        for block in blocks:
+            _BLOCK_HANDLERS[type(block)](state, block)
+        return
+    for block in blocks:
+        start = time.perf_counter()
+        _BLOCK_HANDLERS[type(block)](state, block)
+        phase = _BLOCK_PHASES[type(block)]
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
 def export_to_docx(file_path: str, text: str, settings: Settings, 
                    figures: List[Figure], tables: List[Table], citations: List[Citation],
-                   abbreviations: List[dict] = None):
+                   abbreviations: List[dict] = None, streaming: bool = None, timings: dict = None,
+                   counters: dict = None):
+    """
+    Export markdown content to a .docx file. With streaming=True the body is
+    written into the zip chapter by chapter (constant memory); by default it is
+    used for documents of at least DOCX_STREAMING_MIN_CHARS characters.
+    Pass a dict as `timings` to get the seconds spent in each phase (parse,
+    styles, pagination, front_matter, plan, equations, figures, hard_wrap,
+    body, references, save; body_* entries break "body" down by block type), and one as `counters`
+    for equations by outcome, chapters rendered/cached, images, tables and
+    bytes written.
+    """
+    if streaming is None:
+        streaming = len(text) >= DOCX_STREAMING_MIN_CHARS
+    writer = None
+    timer = PhaseTimer(timings)
     try:
-        doc = Document()
-        setup_styles(doc, settings)
+        # Parse the markdown once; everything below works on the block list
+        chapters = [(source, list(iter_blocks(source.split("\n")))) for source in split_chapters(text)]
+        blocks = [b for _, chapter_blocks in chapters for b in chapter_blocks]
+        timer.mark("parse")
+        doc = new_styled_document(settings)
+        timer.mark("styles")
         
         # Set margins
         for section in doc.sections:
@@ -362,37 +839,33 @@ def export_to_docx(file_path: str, text: str, settings: Settings,
             section.left_margin = Cm(settings.margin_left)
             section.right_margin = Cm(settings.margin_right)
         
+        # Page numbers for the table of contents and the lists, estimated from the font metrics
+        layout = estimate_layout(blocks, settings, figures, abbreviations)
+        timer.mark("pagination")
+        
         # --- FRONT MATTER ---
         
         # 1. MỤC LỤC
-        # Add instruction to update fields
-        instr_p = doc.add_paragraph("Lưu ý: Nhấn Ctrl+A rồi nhấn F9 (hoặc chuột phải chọn 'Update Field') để cập nhật Mục lục và Danh mục.")
-        instr_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        set_font_complex(instr_p.runs[0].font, settings.font_family, 11, italic=True, color=RGBColor(255, 0, 0))
-
         toc_p = doc.add_paragraph("MỤC LỤC", style='Front Heading')
         # Insert TOC Field: \o "1-3" includes Heading 1-3, \h hyperlinks, \z hide page numbers in web, \u outline levels
-        p = doc.add_paragraph()
-        add_toc_field(p, r'TOC \o "1-3" \h \z \u')
+        add_prefilled_toc(doc, r'TOC \o "1-3" \h \z \u', layout.headings)
         doc.add_page_break()
         
         # 2. DANH MỤC HÌNH ẢNH
         if figures:
             doc.add_paragraph("DANH MỤC HÌNH ẢNH", style='Front Heading')
             # Insert TOC for Figure Caption style
-            p = doc.add_paragraph()
-            add_toc_field(p, r'TOC \h \z \t "Figure Caption,1"')
+            add_prefilled_toc(doc, r'TOC \h \z \t "Figure Caption,1"', layout.figures)
             doc.add_page_break()
             
         # 3. DANH MỤC BẢNG BIỂU
         # Note: We don't have a tables list passed in explicitly with captions usually, 
         # but we detect them in text. However, for the TOC to work, we just need the captions in text to use the style.
         # We'll assume if there are tables in text, we want this list. 
-        # Since we don't track tables list perfectly in backend yet, we'll just add it if text contains "Bảng"
-        if "Bảng" in text:
+        # Add it if any table caption ("Bảng x.y: ...") was found while parsing the content
+        if layout.tables:
             doc.add_paragraph("DANH MỤC BẢNG BIỂU", style='Front Heading')
-            p = doc.add_paragraph()
-            add_toc_field(p, r'TOC \h \z \t "Table Caption,1"')
+            add_prefilled_toc(doc, r'TOC \h \z \t "Table Caption,1"', layout.tables)
             doc.add_page_break()
         
         # 4. DANH MỤC CÁC CHỮ VIẾT TẮT VÀ KÝ HIỆU (Chuẩn VN: 2 cột)
@@ -407,44 +880,23 @@ def export_to_docx(file_path: str, text: str, settings: Settings,
             abbr_list.sort(key=lambda x: x.get('abbreviation', ''))
             symbol_list.sort(key=lambda x: x.get('abbreviation', ''))
             
+            # Cell formatting shared by both tables
+            header_fmt = cell_format(WD_ALIGN_PARAGRAPH.CENTER, lambda font: format_run(font, settings, bold=True, color=None))
+            plain_font = lambda font: format_run(font, settings, color=None)
+            
             # Create table for abbreviations (2 columns - VN standard)
             if abbr_list:
                 # Sub-heading for abbreviations
                 p = doc.add_paragraph()
                 run = p.add_run("Chữ viết tắt")
-                set_font_complex(run.font, settings.font_family, settings.font_size, bold=True)
+                format_run(run.font, settings, bold=True, color=None)
                 
                 # Table with header row - 2 columns
-                abbr_table = doc.add_table(rows=len(abbr_list) + 1, cols=2)
-                abbr_table.style = 'Table Grid'
-                
-                # Header row
-                header_row = abbr_table.rows[0]
-                headers = ["Chữ viết tắt", "Diễn giải đầy đủ"]
-                for col_idx, header_text in enumerate(headers):
-                    cell = header_row.cells[col_idx]
-                    cell.text = header_text
-                    for para in cell.paragraphs:
-                        para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size, bold=True)
-                
-                # Data rows
-                for idx, item in enumerate(abbr_list):
-                    row = abbr_table.rows[idx + 1]  # +1 to skip header
-                    # Abbreviation column (center)
-                    cell0 = row.cells[0]
-                    cell0.text = item.get('abbreviation', '')
-                    for para in cell0.paragraphs:
-                        para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size)
-                    # Full form column (left)
-                    cell1 = row.cells[1]
-                    cell1.text = item.get('fullForm', '')
-                    for para in cell1.paragraphs:
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size)
+                # Abbreviation column centered, full form column left as is
+                rows = [["Chữ viết tắt", "Diễn giải đầy đủ"]]
+                rows += [[item.get('abbreviation', ''), item.get('fullForm', '')] for item in abbr_list]
+                add_table_fast(doc, rows, 2, 'Table Grid', [header_fmt, header_fmt],
+                               [cell_format(WD_ALIGN_PARAGRAPH.CENTER, plain_font), cell_format(None, plain_font)])
                 
                 doc.add_paragraph()  # Spacing
             
@@ -453,473 +905,118 @@ def export_to_docx(file_path: str, text: str, settings: Settings,
                 # Sub-heading for symbols
                 p = doc.add_paragraph()
                 run = p.add_run("Ký hiệu")
-                set_font_complex(run.font, settings.font_family, settings.font_size, bold=True)
+                format_run(run.font, settings, bold=True, color=None)
                 
                 # Table with header row - 2 columns
-                symbol_table = doc.add_table(rows=len(symbol_list) + 1, cols=2)
-                symbol_table.style = 'Table Grid'
-                
-                # Header row
-                header_row = symbol_table.rows[0]
-                headers = ["Ký hiệu", "Diễn giải đầy đủ"]
-                for col_idx, header_text in enumerate(headers):
-                    cell = header_row.cells[col_idx]
-                    cell.text = header_text
-                    for para in cell.paragraphs:
-                        para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size, bold=True)
-                
-                # Data rows
-                for idx, item in enumerate(symbol_list):
-                    row = symbol_table.rows[idx + 1]  # +1 to skip header
-                    # Symbol column (center, italic)
-                    cell0 = row.cells[0]
-                    cell0.text = item.get('abbreviation', '')
-                    for para in cell0.paragraphs:
-                        para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size, italic=True)
-                    # Full form column (left)
-                    cell1 = row.cells[1]
-                    cell1.text = item.get('fullForm', '')
-                    for para in cell1.paragraphs:
-                        for run in para.runs:
-                            set_font_complex(run.font, settings.font_family, settings.font_size)
+                # Symbol column centered and italic, full form column left as is
+                rows = [["Ký hiệu", "Diễn giải đầy đủ"]]
+                rows += [[item.get('abbreviation', ''), item.get('fullForm', '')] for item in symbol_list]
+                italic_font = lambda font: format_run(font, settings, italic=True, color=None)
+                add_table_fast(doc, rows, 2, 'Table Grid', [header_fmt, header_fmt],
+                               [cell_format(WD_ALIGN_PARAGRAPH.CENTER, italic_font), cell_format(None, plain_font)])
             
             doc.add_page_break()
         
+        if streaming:
+            writer = StreamingDocxWriter(file_path, doc)
+            writer.flush()
+        media = writer or PackageMedia(doc)
+        timer.mark("front_matter")
+        
         # --- CONTENT ---
-        h1_count = 0
-        h2_count = 0
-        h3_count = 0
-        h4_count = 0
-        h5_count = 0
+        # Each "# " chapter is hashed; unchanged chapters are restored from the fragment cache
+        omml_enabled = get_mathml_to_omml_xslt() is not None
+        # Locked line breaks depend on the fonts they were measured with. Only the
+        # family itself or a metric-compatible substitute gives Word's line breaks;
+        # breaks measured with the fallback font would be wrong, so they are not locked
+        wrap_fonts = resolve_font_files(settings.font_family, fallback=False) if settings.hard_wrap else None
+        hard_wrap = wrap_fonts is not None
+        if settings.hard_wrap and not hard_wrap:
+            print(f"Warning: no font metric-compatible with '{settings.font_family}' installed, line breaks are not locked")
+        plan = []
+        counts = [0, 0, 0, 0, 0]
+        figure_index = index_figures(figures)
+        for source, chapter_blocks in chapters:
+            refs = {figure_key(b.number) for b in chapter_blocks if isinstance(b, FigureRef)}
+            chapter_figures = [figure_index[r] for r in sorted(refs) if r in figure_index]
+            key = chapter_cache_key(source, settings, counts, chapter_figures, extra=[omml_enabled, FIGURE_TARGET_DPI, wrap_fonts])
+            plan.append((key, chapter_blocks, list(counts)))
+            for block in chapter_blocks:
+                if isinstance(block, Heading):
+                    advance_heading_counts(counts, block.level)
+        cached_keys = {key for key, _, _ in plan if FRAGMENT_CACHE.get(key) is not None}
+        timer.mark("plan")
         
-        lines = text.split("\n")
-        i = 0
-        pending_table_caption = None
-
-        while i < len(lines):
-            line = lines[i]
-            stripped_line = line.strip()
-            
-            # Table detection
-            if stripped_line.startswith("|"):
-                table_lines = []
-                while i < len(lines) and lines[i].strip().startswith("|"):
-                    table_lines.append(lines[i])
-                    i += 1
-                
-                # Process table
-                if len(table_lines) >= 2:
-                    rows_data = []
-                    for tl in table_lines:
-                        if "---" in tl: continue
-                        cells = [c.strip() for c in tl.split("|")[1:-1]]
-                        rows_data.append(cells)
-                    
-                    if rows_data:
-                        # Add spacing before table
-                        doc.add_paragraph() 
-
-                        rows = len(rows_data)
-                        cols = len(rows_data[0])
-                        table = doc.add_table(rows=rows, cols=cols)
-                        table.style = 'Table Grid'
-                        
-                        for r in range(rows):
-                            row_cells = table.rows[r].cells
-                            for c in range(min(cols, len(rows_data[r]))):
-                                cell = row_cells[c]
-                                cell.text = rows_data[r][c]
-                                for paragraph in cell.paragraphs:
-                                    set_font_complex(paragraph.runs[0].font, settings.font_family, settings.font_size, 
-                                                     bold=(r==0), color=RGBColor(0, 0, 0))
-                                    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER if r == 0 else WD_ALIGN_PARAGRAPH.LEFT
-                        
-                        # Render Pending Caption BELOW Table
-                        if pending_table_caption:
-                            # Use Table Caption Style
-                            doc.add_paragraph(pending_table_caption, style='Table Caption')
-                            pending_table_caption = None
-                        
-                        # Add spacing after table group
-                        doc.add_paragraph()
-
-                continue 
-            
-            # Flush pending caption if not followed by a table immediately
-            if pending_table_caption:
-                doc.add_paragraph(pending_table_caption, style='Table Caption')
-                pending_table_caption = None
-
-            # Check for Table Captions: Bảng 1.1: Caption
-            if stripped_line.startswith("Bảng") and ":" in stripped_line:
-                pending_table_caption = stripped_line
-                i += 1
-                continue
-
-            # Heading 1: CHƯƠNG I
-            if line.startswith("# "):
-                h1_count += 1
-                h2_count = 0
-                h3_count = 0
-                h4_count = 0
-                from core.utils.helpers import to_roman
-                roman = to_roman(h1_count)
-                raw_title = line[2:].strip()
-                
-                if settings.auto_numbering:
-                    # Logic tách dòng tiêu đề chương
-                    if settings.h1_split:
-                        # Sử dụng \n để tạo soft break (Shift+Enter) trong Word
-                        # Điều này giúp tiêu đề vẫn là 1 paragraph (tốt cho TOC) nhưng hiển thị 2 dòng
-                        prefix = f"{settings.h1_prefix} {roman}" if settings.h1_prefix else f"{roman}"
-                        full_title = f"{prefix}\n{raw_title.upper()}"
-                    else:
-                        prefix = f"{settings.h1_prefix} {roman}: " if settings.h1_prefix else f"{roman}. "
-                        full_title = f"{prefix}{raw_title.upper()}"
-                else:
-                    full_title = raw_title.upper()
-                
-                heading = doc.add_paragraph(full_title, style='Heading 1')
-                for run in heading.runs:
-                    set_font_complex(run.font, settings.font_family, settings.h1_size, bold=True, color=RGBColor(0, 0, 0))
-            
-            # Heading 2: 1.1
-            elif line.startswith("## "):
-                h2_count += 1
-                h3_count = 0
-                h4_count = 0
-                raw_title = line[3:].strip()
-                if settings.auto_numbering:
-                    # Nếu hierarchical_numbering = True -> 1.1, ngược lại -> 1
-                    prefix = f"{h1_count}.{h2_count}." if settings.hierarchical_numbering else f"{h2_count}."
-                    full_title = f"{prefix} {raw_title}"
-                else:
-                    full_title = raw_title
-                
-                heading = doc.add_paragraph(full_title, style='Heading 2')
-                for run in heading.runs:
-                    set_font_complex(run.font, settings.font_family, settings.h2_size, bold=True, color=RGBColor(0, 0, 0))
-            
-            # Heading 3: 1.1.1
-            elif line.startswith("### "):
-                h3_count += 1
-                h4_count = 0
-                raw_title = line[4:].strip()
-                if settings.auto_numbering:
-                    prefix = f"{h1_count}.{h2_count}.{h3_count}." if settings.hierarchical_numbering else f"{h2_count}.{h3_count}."
-                    full_title = f"{prefix} {raw_title}"
-                else:
-                    full_title = raw_title
-                
-                heading = doc.add_paragraph(full_title, style='Heading 3')
-                for run in heading.runs:
-                    set_font_complex(run.font, settings.font_family, settings.h3_size, bold=True, italic=True, color=RGBColor(0, 0, 0))
-
-            # Heading 4
-            elif line.startswith("#### "):
-                h4_count += 1
-                h5_count = 0 # Reset h5_count
-                raw_title = line[5:].strip()
-                
-                if settings.auto_numbering:
-                    prefix = f"{h1_count}.{h2_count}.{h3_count}.{h4_count}." if settings.hierarchical_numbering else f"{h2_count}.{h3_count}.{h4_count}."
-                    full_title = f"{prefix} {raw_title}"
-                else:
-                    full_title = raw_title
-                
-                # Word usually doesn't have Heading 4 by default or it's small. We'll use Heading 4 style if exists or Normal bold italic
-                try:
-                    heading = doc.add_paragraph(full_title, style='Heading 4')
-                except:
-                    heading = doc.add_paragraph(full_title, style='Normal')
-                
-                for run in heading.runs:
-                    set_font_complex(run.font, settings.font_family, settings.font_size, bold=True, italic=True, color=RGBColor(0, 0, 0))
-                    set_font_complex(run.font, settings.font_family, settings.font_size, bold=True, italic=True, color=RGBColor(0, 0, 0))
-            
-            # Heading 5
-            elif line.startswith("##### "):
-                h5_count += 1
-                raw_title = line[6:].strip()
-                
-                if settings.auto_numbering:
-                    prefix = f"{h1_count}.{h2_count}.{h3_count}.{h4_count}.{h5_count}." if settings.hierarchical_numbering else f"{h2_count}.{h3_count}.{h4_count}.{h5_count}."
-                    full_title = f"{prefix} {raw_title}"
-                else:
-                    full_title = raw_title
-                
-                try:
-                    heading = doc.add_paragraph(full_title, style='Heading 5')
-                except:
-                    heading = doc.add_paragraph(full_title, style='Normal')
-                
-                for run in heading.runs:
-                    set_font_complex(run.font, settings.font_family, settings.font_size, italic=True, color=RGBColor(0, 0, 0))
-
-            # Bullet points: - , -- , ---, or •, ●
-            elif re.match(r'^(\-{1,3}|\*{1,3}|•|●)\s', line):
-                match = re.match(r'^(\-{1,3}|\*{1,3}|•|●)\s', line)
-                prefix = match.group(1)
-                level = len(prefix)
-                content = line[len(prefix)+1:].strip()
-                
-                # Chuẩn đồ án Việt Nam: dùng gạch đầu dòng (–) và dấu cộng (+)
-                # Sử dụng En Dash (–) thay vì Hyphen (-) cho đẹp hơn
-                bullet_char = "\u2013" # En Dash
-                print(f"DEBUG: Processing bullet level {level}, char: {bullet_char}")
-                
-                if level == 2:
-                    bullet_char = "+"
-                elif level == 3:
-                    bullet_char = "\u2013"
-                
-                # Manual bullet implementation using Normal style + Indent
-                p = doc.add_paragraph(style='Normal')
-                
-                # Calculate indent
-                # Base indent (e.g. 1.27cm) + Level indent
-                base_indent = settings.indent # cm
-                level_indent = (level - 1) * 0.75 # cm
-                total_indent = base_indent + level_indent
-                
-                # Hanging indent logic:
-                # Left Indent = Total Indent + Hanging Amount
-                # First Line Indent = -Hanging Amount
-                # This makes the bullet sit at Total Indent, and text wrap nicely.
-                hanging = 0.5 # cm (reduced from 0.63 for tighter look)
-                
-                p_fmt = p.paragraph_format
-                p_fmt.left_indent = Cm(total_indent + hanging)
-                p_fmt.first_line_indent = Cm(-hanging)
-                p_fmt.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                p_fmt.tab_stops.add_tab_stop(Cm(total_indent + hanging))
-                
-                # Add bullet char and tab
-                run = p.add_run(f"{bullet_char}\t")
-                set_font_complex(run.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
-                
-                # Add content
-                # We need to process formatting in content as well (bold, italic, latex)
-                # Reuse the logic? Or just simple add for now?
-                # Let's reuse the simple formatting logic by splitting
-                parts = re.split(r'(\*\*.*?\*\*|\*.*?\*|<u>.*?</u>|\$.*?\$)', content)
-                for part in parts:
-                    if not part: continue
-                     # LaTeX handling
-                    if part.startswith('$') and part.endswith('$'):
-                        latex_content = part
-                        # Handle display math inside bullet? usually inline
-                        inner_tex = part
-                        if part.startswith('$$'): inner_tex = part[2:-2]
-                        elif part.startswith('$'): inner_tex = part[1:-1]
-                        
-                        image_stream, h_in, w_in, descent_in = render_latex_to_image(inner_tex, font_size_pt=settings.font_size)
-                        if image_stream:
-                            run = p.add_run()
-                            # Convert inches to docx Length (Cm or Inches)
-                            run.add_picture(image_stream, height=Cm(h_in * 2.54))
-                            # Lower the image by descent amount to align baseline
-                            # descent_in is in inches. 1 inch = 72 points.
-                            set_run_position(run, -descent_in * 72)
-                        else:
-                            run = p.add_run(part)
-                            set_font_complex(run.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
-                        continue
-
-                    run = p.add_run()
-                    text_content = part
-                    is_bold = False
-                    is_italic = False
-                    is_underline = False
-                    
-                    if part.startswith('**') and part.endswith('**'):
-                        text_content = part[2:-2]
-                        is_bold = True
-                    elif part.startswith('*') and part.endswith('*'):
-                        text_content = part[1:-1]
-                        is_italic = True
-                    elif part.startswith('<u>') and part.endswith('</u>'):
-                        text_content = part[3:-4]
-                        is_underline = True
-                        
-                    run.text = text_content
-                    set_font_complex(run.font, settings.font_family, settings.font_size, 
-                                     bold=is_bold, italic=is_italic, color=RGBColor(0, 0, 0))
-                    if is_underline:
-                        run.font.underline = True
-            
-            elif line.strip():
-                stripped_line = line.strip()
-                print(f"DEBUG LINE: '{stripped_line}'")
-                
-                # Check for Figure placeholders: [Hình 1.1: Caption]
-                # Relaxed regex to handle potential spaces
-                match = re.match(r'\[\s*(Hình \d+\.\d+)\s*:\s*(.*)\s*\]', stripped_line)
-                if match:
-                    fig_num = match.group(1)
-                    caption = match.group(2)
-                    print(f"DEBUG: Found placeholder for {fig_num}")
-                    
-                    # Find figure data
-                    # Normalize spaces for comparison
-                    fig_data = next((f for f in figures if f.number.replace(" ", "") == fig_num.replace(" ", "")), None)
-                    
-                    if fig_data:
-                        print(f"DEBUG: Found figure data: {fig_data.path}")
-                        if fig_data.path:
-                            try:
-                                # Resolve path if relative
-                                img_path = fig_data.path
-                                if not os.path.isabs(img_path):
-                                    img_path = os.path.abspath(img_path)
-                                
-                                print(f"DEBUG: Checking image path: {img_path}")
-                                if os.path.exists(img_path):
-                                    # Add image
-                                    # Use width from figure data if available, else default to 16cm
-                                    width = Cm(fig_data.width) if hasattr(fig_data, 'width') and fig_data.width else Cm(16)
-                                    
-                                    # Create a new paragraph for the image
-                                    p = doc.add_paragraph()
-                                    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                    
-                                    # Reset indentation to ensure true center
-                                    p.paragraph_format.left_indent = Cm(0)
-                                    p.paragraph_format.right_indent = Cm(0)
-                                    p.paragraph_format.first_line_indent = Cm(0)
-                                    
-                                    run = p.add_run()
-                                    run.add_picture(img_path, width=width)
-                                    print(f"DEBUG: Inserted image {img_path}")
-                                    
-                                    # Add caption
-                                    caption_text = f"{fig_num}: {caption}"
-                                    # Use 'Figure Caption' style which is defined as Black/Italic
-                                    caption_p = doc.add_paragraph(caption_text, style='Figure Caption')
-                                    caption_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                    
-                                else:
-                                    print(f"DEBUG: Image path not found: {img_path}")
-                                    doc.add_paragraph(f"[Hình ảnh không tìm thấy: {img_path}]", style='Normal')
-                            except Exception as e:
-                                print(f"Error adding image {img_path}: {e}")
-                                doc.add_paragraph(f"[Lỗi chèn hình: {fig_num}]", style='Normal')
-                        else:
-                             print("DEBUG: Figure path is empty")
-                    else:
-                        print(f"DEBUG: Figure data not found for {fig_num}")
-                        doc.add_paragraph(f"[Hình ảnh không tìm thấy dữ liệu: {fig_num}]", style='Normal')
-                
-                else:
-                    # Normal paragraph with formatting support
-                    p = doc.add_paragraph(style='Normal')
-                    
-                    # Regex to split by formatting tokens: **bold**, *italic*, <u>underline</u>, $$display$$, $inline$
-                    # Priority: $$ first
-                    parts = re.split(r'(\$\$.*?\$\$|\$.*?\$|\*\*.*?\*\*|\*.*?\*|<u>.*?</u>)', stripped_line)
-                    
-                    for part in parts:
-                        if not part: continue
-                        
-                        # LaTeX handling
-                        if part.startswith('$') and part.endswith('$'):
-                            # Handle display math $$...$$ vs inline $...$
-                            is_display = part.startswith('$$')
-                            if is_display:
-                                latex_content = part[2:-2]
-                            else:
-                                latex_content = part[1:-1]
-                            
-                            # Try native OMML first (best quality)
-                            if insert_omml_equation(p, latex_content):
-                                continue
-                            
-                            # Fallback to image rendering
-                            image_stream, h_in, w_in, descent_in = render_latex_to_image(latex_content, font_size_pt=settings.font_size, is_display=is_display)
-                            if image_stream:
-                                scaled_height = h_in * 2.54
-                                if is_display:
-                                    # Display math: create new centered paragraph
-                                    math_p = doc.add_paragraph()
-                                    math_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                    math_p.paragraph_format.first_line_indent = Cm(0)
-                                    math_p.paragraph_format.space_before = Pt(6)
-                                    math_p.paragraph_format.space_after = Pt(6)
-                                    run = math_p.add_run()
-                                    run.add_picture(image_stream, height=Cm(scaled_height))
-                                    # Create new paragraph for remaining text
-                                    p = doc.add_paragraph(style='Normal')
-                                else:
-                                    run = p.add_run()
-                                    run.add_picture(image_stream, height=Cm(scaled_height))
-                                    # Adjust baseline shift proportionally
-                                    set_run_position(run, -descent_in * 72)
-                            else:
-                                # Fallback: Show placeholder for complex formulas
-                                if is_display:
-                                    # Create centered paragraph with placeholder
-                                    math_p = doc.add_paragraph()
-                                    math_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                    math_p.paragraph_format.first_line_indent = Cm(0)
-                                    math_p.paragraph_format.space_before = Pt(6)
-                                    math_p.paragraph_format.space_after = Pt(6)
-                                    run = math_p.add_run(f"[Công thức phức tạp - cần chèn thủ công]")
-                                    set_font_complex(run.font, settings.font_family, settings.font_size, italic=True, color=RGBColor(128, 128, 128))
-                                    # Create new paragraph for remaining text
-                                    p = doc.add_paragraph(style='Normal')
-                                else:
-                                    # Inline: just show simple placeholder
-                                    run = p.add_run("[công thức]")
-                                    set_font_complex(run.font, settings.font_family, settings.font_size, italic=True, color=RGBColor(128, 128, 128))
-                            continue
-
-                        run = p.add_run()
-                        text_content = part
-                        is_bold = False
-                        is_italic = False
-                        is_underline = False
-                        
-                        if part.startswith('**') and part.endswith('**'):
-                            text_content = part[2:-2]
-                            is_bold = True
-                        elif part.startswith('*') and part.endswith('*'):
-                            text_content = part[1:-1]
-                            is_italic = True
-                        elif part.startswith('<u>') and part.endswith('</u>'):
-                            text_content = part[3:-4]
-                            is_underline = True
-                            
-                        run.text = text_content
-                        set_font_complex(run.font, settings.font_family, settings.font_size, 
-                                         bold=is_bold, italic=is_italic, color=RGBColor(0, 0, 0))
-                        if is_underline:
-                            run.font.underline = True
-                    
-                    p.paragraph_format.first_line_indent = Cm(settings.indent)
-                    p.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    for run in p.runs:
-                        set_font_complex(run.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
-            
-            i += 1
+        # Render equations of changed chapters up front (in parallel) so assembly only hits the cache
+        changed_blocks = [b for key, chapter_blocks, _ in plan if key not in cached_keys for b in chapter_blocks]
+        fragments = collect_latex_fragments(changed_blocks)
+        rendered = prerender_equations(fragments, font_size_pt=settings.font_size)
+        timer.mark("equations")
+        
+        state = _ContentState(doc, settings, figures, media)
+        state.stats["equations_rendered"] = rendered
+        state.stats["equations_cached"] = len({(normalize_latex(l), bool(d)) for l, d in fragments}) - rendered
+        if settings.hard_wrap and not hard_wrap:
+            state.stats["hard_wrap_skipped"] = 1
+        if timings is not None:
+            state.block_timings = timings
+        # Likewise check and downsample their figures' images, concurrently
+        changed_refs = {figure_key(b.number) for b in changed_blocks if isinstance(b, FigureRef)}
+        state.figure_images = prepare_figure_images([state.figure_index[r] for r in changed_refs if r in state.figure_index])
+        timer.mark("figures")
+        if hard_wrap:
+            # "Khóa ngắt dòng": break the lines here, with the font's glyph widths, and write them as explicit breaks
+            state.line_breaks = hard_wrap_lines(changed_blocks, settings)
+            timer.mark("hard_wrap")
+        body = doc.element.body
+        restored_any = False
+        for key, chapter_blocks, counts_before in plan:
+            if key in cached_keys and restore_fragment(key, doc, media) is not None:
+                restored_any = True
+                state.stats["chapters_cached"] += 1
+            else:
+                state.stats["chapters_rendered"] += 1
+                state.counts = list(counts_before)
+                start = len(body)
+                add_content_blocks(state, chapter_blocks)
+                new_elements = [el for el in list(body)[start - 1:] if el.tag != qn('w:sectPr')]
+                store_fragment(key, media, new_elements, state.counts)
+            if writer:
+                writer.flush()
+        if restored_any and not writer:
+            renumber_drawing_ids(doc)
+        timer.mark("body")
                 
         # --- REFERENCES ---
         if citations:
             doc.add_page_break()
             ref_p = doc.add_paragraph("TÀI LIỆU THAM KHẢO", style='Front Heading')
             for i, c in enumerate(citations, 1):
+                if settings.style_driven:
+                    doc.add_paragraph(f"[{i}] {format_citation_apa(c)}", style='Reference')
+                    continue
                 p = doc.add_paragraph(f"[{i}] {format_citation_apa(c)}")
                 p.paragraph_format.first_line_indent = Cm(0)
                 p.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
                 for run in p.runs:
                      set_font_complex(run.font, settings.font_family, settings.font_size, color=RGBColor(0, 0, 0))
+        timer.mark("references")
         
-        doc.save(file_path)
-        return True, f"Đã xuất file Word:\n{file_path}"
+        if writer:
+            writer.close()
+        else:
+            save_document(doc, file_path)
+        timer.mark("save")
+        if counters is not None:
+            counters.update(state.stats)
+            counters["bytes_written"] = os.path.getsize(file_path)
+        msg = f"Đã xuất file Word:\n{file_path}"
+        if state.stats["hard_wrap_skipped"]:
+            msg += f"\nKhông khóa ngắt dòng: máy chủ không có font {settings.font_family} (hoặc font tương thích)."
+        return True, msg
         
     except Exception as e:
         traceback.print_exc()
+        if writer:
+            writer.abort()
         return False, f"Không thể xuất file Word:\n{str(e)}"
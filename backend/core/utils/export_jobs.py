@@ -0,0 +1,377 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Optional
+from core.config import SERVER_WORKERS
+from core.utils.metrics import record_export
+
+
+class QueueFullError(Exception):
+    """Raised when the export queue has no room for another job."""
+
+
+@dataclass
+class ExportJob:
+    id: str
+    output_path: str
+    future: object = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # Set when the request is cacheable; the output then lives in the export cache
+    cache_key: Optional[str] = None
+    cached: bool = False
+    # Answered straight from the export cache, without running an export
+    cache_hit: bool = False
+    # Output format: "docx" or "pdf"
+    kind: str = "docx"
+
+    @property
+    def status(self) -> str:
+        if self.future is None or not self.future.done():
+            return "running" if self.future is not None and self.future.running() else "queued"
+        if self.finished_at is None:
+            # Result is in, output is still being moved into the cache
+            return "running"
+        if self.future.cancelled() or self.future.exception() is not None:
+            return "failed"
+        return "done" if self.future.result()[0] else "failed"
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.future is None or not self.future.done():
+            return None
+        if self.future.cancelled():
+            return "Cancelled"
+        exc = self.future.exception()
+        if exc is not None:
+            return str(exc)
+        success, msg = self.future.result()[:2]
+        return None if success else msg
+
+    @property
+    def stats(self) -> dict:
+        """Phase timings and counters reported by the worker ({} until finished or on cache hits)."""
+        if self.future is None or not self.future.done() or self.future.cancelled() or self.future.exception():
+            return {}
+        return self.future.result()[2]
+
+    @property
+    def timings(self) -> dict:
+        """Seconds per phase, starting with the wait in the queue."""
+        stats = self.stats
+        timings = {}
+        if "started_at" in stats:
+            timings["queue"] = max(0.0, stats["started_at"] - self.created_at)
+        timings.update(stats.get("timings", {}))
+        return timings
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cached": self.cached,
+            "timings": self.timings,
+        }
+
+    def to_record(self) -> dict:
+        return {**self.to_dict(), "output_path": self.output_path, "cache_key": self.cache_key,
+                "cache_hit": self.cache_hit, "kind": self.kind}
+
+
+@dataclass
+class ExportJobRecord:
+    """A job submitted to another server process, as last written to its record file."""
+    id: str
+    output_path: str
+    status: str
+    error: Optional[str]
+    created_at: float
+    finished_at: Optional[float]
+    cache_key: Optional[str]
+    cached: bool
+    cache_hit: bool
+    timings: dict
+    kind: str = "docx"
+
+    @classmethod
+    def from_record(cls, data: dict) -> "ExportJobRecord":
+        return cls(data["job_id"], data["output_path"], data["status"], data["error"], data["created_at"],
+                   data["finished_at"], data["cache_key"], data["cached"], data["cache_hit"], data["timings"],
+                   data.get("kind", "docx"))
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cached": self.cached,
+            "timings": self.timings,
+        }
+
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+EXPORT_KINDS = ("docx", "pdf")
+
+_CACHED_MESSAGES = {
+    "docx": "Đã xuất file Word (bộ nhớ đệm).",
+    "pdf": "Đã xuất file PDF (bộ nhớ đệm).",
+}
+
+
+def run_export(output_path, content, settings, figures, tables, citations, abbreviations, kind="docx"):
+    """Runs in a worker process. Returns (success, message, stats)."""
+    if kind == "pdf":
+        from core.utils.export_pdf import export_to_pdf as exporter
+    else:
+        from core.utils.export_docx import export_to_docx as exporter
+    stats = {"started_at": time.time(), "timings": {}, "counters": {}}
+    success, msg = exporter(output_path, content, settings, figures, tables, citations, abbreviations,
+                            timings=stats["timings"], counters=stats["counters"])
+    return success, msg, stats
+
+
+def _warm_up():
+    from core.utils.export_docx import warm_up_export
+    from core.utils.export_pdf import warm_up_pdf_export
+    return {**warm_up_export(), "pdf_fonts": warm_up_pdf_export()}
+
+
+def equation_workers_per_export(export_workers: int, server_workers: int = SERVER_WORKERS) -> int:
+    """
+    Equation render processes each export process may start: the cores shared
+    out between the `export_workers` export processes of every server process.
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, server_workers * export_workers))
+
+
+def init_export_worker(equation_workers: int = 1):
+    """
+    Pool initializer: cap the worker's equation pool to its share of the cores
+    (otherwise every export process would start one process per core), then load
+    the export stack before the first job reaches this worker.
+    """
+    from core.utils.math_render import limit_render_workers
+    limit_render_workers(equation_workers)
+    try:
+        _warm_up()
+    except Exception as e:
+        # A failing initializer would break the whole pool; exports can still try
+        print(f"Warning: export worker warm-up failed: {e}")
+
+
+def _worker_state():
+    """Runs in a worker process (after init_export_worker): what the export stack has available."""
+    return _warm_up()
+
+
+class ExportJobQueue:
+    """
+    Bounded pool of export worker processes. At most max_workers exports run at
+    once and at most max_queued more may wait; further submissions are rejected.
+    Finished jobs (and their files) are dropped after job_ttl seconds.
+
+    Each job also has a record file in output_dir, so when several server
+    processes share the directory any of them can report on any job.
+
+    With a `cache` (FileStore), submissions carrying a cache_key are answered
+    from it when possible, identical in-flight requests share one job, and
+    successful outputs are committed to it (the cache then owns the file).
+    """
+
+    def __init__(self, output_dir: str, max_workers: int, max_queued: int, job_ttl: int, cache=None):
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.job_ttl = job_ttl
+        self.cache = cache
+        self._executor = None
+        self._jobs = {}
+        self._inflight = {}  # cache_key -> unfinished job
+        self._lock = threading.Lock()
+        # Set by warm_up() once every worker has loaded the export stack
+        self.warm_state = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Spawn so workers don't inherit the server's threads and sockets
+            ctx = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx,
+                                                 initializer=init_export_worker,
+                                                 initargs=(equation_workers_per_export(self.max_workers),))
+        return self._executor
+
+    def warm_up(self) -> dict:
+        """
+        Start every worker process and wait until each has imported and primed
+        the export stack (blocking; run it in a background thread).
+        """
+        with self._lock:
+            executor = self._get_executor()
+            # No worker is idle yet, so each submission starts a new process
+            futures = [executor.submit(_worker_state) for _ in range(self.max_workers)]
+        states = [f.result() for f in futures]
+        self.warm_state = {"workers": len(states)}
+        for key in states[0]:
+            self.warm_state[key] = all(state[key] for state in states)
+        return self.warm_state
+
+    def submit_task(self, fn, *args) -> Future:
+        """
+        Run fn(*args) in the export worker pool, outside the job bookkeeping
+        (batch exports), so it shares the pool's processes and cores.
+        """
+        with self._lock:
+            try:
+                return self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                self._executor = None
+                return self._get_executor().submit(fn, *args)
+
+    def pending_count(self) -> int:
+        # A snapshot: the metrics endpoint calls this while other threads submit and prune
+        return sum(1 for job in list(self._jobs.values()) if not job.future.done())
+
+    def submit(self, content, settings, figures, tables, citations, abbreviations, cache_key=None,
+               kind: str = "docx") -> ExportJob:
+        """Queue an export to `kind` (docx or pdf). The cache key must already cover the kind."""
+        if self.cache is None:
+            cache_key = None
+        with self._lock:
+            self._prune()
+            if cache_key is not None:
+                cached_path = self.cache.get_path(cache_key)
+                if cached_path is not None:
+                    return self._add_cached_job(cache_key, cached_path, kind)
+                inflight = self._inflight.get(cache_key)
+                if inflight is not None:
+                    return inflight
+
+            if self.pending_count() >= self.max_workers + self.max_queued:
+                raise QueueFullError("Hàng đợi xuất file đang đầy, vui lòng thử lại sau.")
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            job_id = uuid.uuid4().hex
+            if cache_key is not None:
+                output_path = self.cache.temp_path(cache_key)
+            else:
+                output_path = os.path.join(self.output_dir, f"{job_id}.{kind}")
+            job = ExportJob(id=job_id, output_path=output_path, cache_key=cache_key, kind=kind)
+            args = (job.output_path, content, settings, figures, tables, citations, abbreviations, kind)
+            try:
+                job.future = self._get_executor().submit(run_export, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); start a fresh pool
+                self._executor = None
+                job.future = self._get_executor().submit(run_export, *args)
+            self._jobs[job_id] = job
+            if cache_key is not None:
+                self._inflight[cache_key] = job
+            self._write_record(job)
+        # Outside the lock: a future that is already done runs the callback inline, and _finish takes the lock
+        job.future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def _add_cached_job(self, cache_key, path, kind) -> ExportJob:
+        job = ExportJob(id=uuid.uuid4().hex, output_path=path, cache_key=cache_key, cached=True, cache_hit=True,
+                        kind=kind)
+        job.future = Future()
+        job.future.set_result((True, _CACHED_MESSAGES[kind], {}))
+        job.finished_at = time.time()
+        self._jobs[job.id] = job
+        self._write_record(job)
+        record_export("cache_hit", job.finished_at - job.created_at)
+        return job
+
+    def _finish(self, job: ExportJob):
+        """Runs when the worker is done: move a cacheable result into the cache."""
+        if job.cache_key is not None:
+            try:
+                ok = not job.future.cancelled() and job.future.exception() is None and job.future.result()[0]
+                if ok:
+                    job.output_path = self.cache.commit(job.cache_key, job.output_path)
+                    job.cached = True
+                else:
+                    os.remove(job.output_path)
+            except OSError:
+                pass
+            with self._lock:
+                if self._inflight.get(job.cache_key) is job:
+                    del self._inflight[job.cache_key]
+        job.finished_at = time.time()
+        self._write_record(job)
+        record_export("ok" if job.status == "done" else "failed", job.finished_at - job.created_at,
+                      job.timings, job.stats.get("counters"))
+
+    def _record_path(self, job_id: str) -> str:
+        return os.path.join(self.output_dir, f"{job_id}.json")
+
+    def _write_record(self, job: ExportJob):
+        path = self._record_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job.to_record(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: cannot write export job record {path}: {e}")
+
+    def get(self, job_id: str):
+        """This process's ExportJob, else the ExportJobRecord another process left on disk, else None."""
+        job = self._jobs.get(job_id)
+        if job is not None or not _JOB_ID_RE.match(job_id):
+            return job
+        try:
+            with open(self._record_path(job_id), encoding="utf-8") as f:
+                return ExportJobRecord.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _prune(self):
+        """Forget expired jobs and delete their output files."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.job_ttl:
+                del self._jobs[job_id]
+                try:
+                    os.remove(self._record_path(job_id))
+                except OSError:
+                    pass
+                if job.cached:
+                    continue  # The export cache owns (and evicts) the file
+                try:
+                    os.remove(job.output_path)
+                except OSError:
+                    pass
+
+    def remove_stale_files(self):
+        """Delete outputs left in output_dir (and cache temp files) by an earlier server process."""
+        cutoff = time.time() - self.job_ttl
+        if os.path.isdir(self.output_dir):
+            for f in os.scandir(self.output_dir):
+                try:
+                    if f.is_file() and f.stat().st_mtime < cutoff:
+                        os.remove(f.path)
+                except OSError:
+                    pass
+        if self.cache is not None:
+            self.cache.remove_stale_temp_files(self.job_ttl)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
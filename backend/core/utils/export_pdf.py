@@ -1,75 +1,509 @@
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from ThesisFormatter.models.data_classes import Settings, Citation
-from ThesisFormatter.utils.helpers import format_citation_apa
+from reportlab import rl_config
+from reportlab.lib import colors, pagesizes
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import cm, inch
+from reportlab.lib.utils import ImageReader
+from reportlab import platypus
+from reportlab.platypus import (
+    BaseDocTemplate, PageTemplate, Frame, Flowable, Paragraph, Spacer, PageBreak,
+    NextPageTemplate, Image, KeepTogether, TableStyle,
+)
+from xml.sax.saxutils import escape
+from core.models.data_classes import Settings, Figure, Table, Citation
+from core.utils.helpers import format_citation_apa, to_roman, advance_heading_counts, heading_title
+from core.utils import markdown_ast as md
+from core.utils.math_render import get_equation_image, prerender_equations
+from core.utils.math_cache import normalize_latex
+from core.utils.image_prep import figure_key, index_figures, figure_width_cm, prepare_figure_images
+from core.utils.pdf_fonts import register_font_family, BUILTIN_FONTS
+from core.utils.metrics import PhaseTimer
+from collections import Counter
 from typing import List
+import io
+import os
+import hashlib
+import tempfile
+import traceback
 
-def export_to_pdf(file_path: str, text: str, settings: Settings, citations: List[Citation]):
+# Write streams as raw binary: ASCII85 makes them 25% larger and, without
+# reportlab's C accelerator, encoding the images dominated PDF export time
+rl_config.useA85 = 0
+
+# Headings down to this level go into the table of contents and the PDF outline
+TOC_LEVELS = 3
+
+
+def inlines_to_markup(inlines) -> str:
+    """Convert parsed text spans to reportlab paragraph markup (math spans are left as $...$)."""
+    out = []
+    for span in inlines:
+        if isinstance(span, md.TextSpan):
+            text = escape(span.text)
+            if span.bold: text = f"<b>{text}</b>"
+            if span.italic: text = f"<i>{text}</i>"
+            if span.underline: text = f"<u>{text}</u>"
+        else:
+            text = escape(f"${span.latex}$")
+        out.append(text)
+    return "".join(out)
+
+
+def _placeholder(text: str) -> str:
+    return f'<i><font color="#808080">{escape(text)}</font></i>'
+
+
+def build_styles(settings: Settings, fonts) -> dict:
+    """Paragraph styles matching the .docx export's styles (see export_docx.setup_styles)."""
+    regular, bold, italic, bold_italic = fonts
+    # Word's "multiple" line spacing scales a single line, which reportlab puts at 1.2x the font size
+    line = 1.2 * settings.line_spacing
+
+    def style(name, font, size, **kw):
+        kw.setdefault("leading", size * line)
+        return ParagraphStyle(name, fontName=font, fontSize=size, textColor=colors.black, **kw)
+
+    styles = {
+        "body": style("Body", regular, settings.font_size, alignment=TA_JUSTIFY,
+                      firstLineIndent=settings.indent * cm, spaceAfter=8.5),
+        "h1": style("Heading1", bold, settings.h1_size, alignment=TA_CENTER, spaceBefore=24, spaceAfter=18,
+                    keepWithNext=1),
+        "h2": style("Heading2", bold, settings.h2_size, alignment=TA_LEFT, spaceBefore=18, spaceAfter=12,
+                    keepWithNext=1),
+        "h3": style("Heading3", bold_italic, settings.h3_size, alignment=TA_LEFT, spaceBefore=12, spaceAfter=6,
+                    keepWithNext=1),
+        "h4": style("Heading4", bold_italic, settings.font_size, alignment=TA_LEFT, spaceBefore=6, spaceAfter=6,
+                    keepWithNext=1),
+        "h5": style("Heading5", italic, settings.font_size, alignment=TA_LEFT, spaceBefore=6, spaceAfter=6,
+                    leftIndent=0.63 * cm, keepWithNext=1),
+        "front": style("FrontHeading", bold, settings.h1_size, alignment=TA_CENTER, spaceBefore=24, spaceAfter=18),
+        "figure_caption": style("FigureCaption", italic, settings.font_size, alignment=TA_CENTER,
+                                spaceBefore=6, spaceAfter=12),
+        "table_caption": style("TableCaption", bold, settings.font_size, alignment=TA_CENTER,
+                               spaceBefore=12, spaceAfter=6),
+        "reference": style("Reference", regular, settings.font_size, alignment=TA_JUSTIFY, spaceAfter=8.5),
+        "subheading": style("SubHeading", bold, settings.font_size, spaceBefore=6, spaceAfter=6),
+        "placeholder": style("Placeholder", regular, settings.font_size, alignment=TA_LEFT, spaceAfter=8.5),
+        "equation": style("Equation", regular, settings.font_size, alignment=TA_CENTER, spaceBefore=6,
+                          spaceAfter=6),
+        # Table cells are single-spaced
+        "cell": style("Cell", regular, settings.font_size, leading=settings.font_size * 1.2),
+        "cell_center": style("CellCenter", regular, settings.font_size, leading=settings.font_size * 1.2,
+                             alignment=TA_CENTER),
+        "cell_symbol": style("CellSymbol", italic, settings.font_size, leading=settings.font_size * 1.2,
+                             alignment=TA_CENTER),
+        "cell_header": style("CellHeader", bold, settings.font_size, leading=settings.font_size * 1.2,
+                             alignment=TA_CENTER),
+    }
+    # Bullets: the bullet sits at the text indent, wrapped lines align after it
+    hanging = 0.5
+    for level in (1, 2, 3):
+        total_indent = settings.indent + (level - 1) * 0.75
+        styles[f"bullet{level}"] = style(f"Bullet{level}", regular, settings.font_size, alignment=TA_JUSTIFY,
+                                         leftIndent=(total_indent + hanging) * cm, bulletIndent=total_indent * cm,
+                                         bulletFontName=regular, spaceAfter=8.5)
+    for level in range(1, TOC_LEVELS + 1):
+        styles[f"toc{level}"] = style(f"TOC{level}", bold if level == 1 else regular, settings.font_size,
+                                      leftIndent=(level - 1) * 0.75 * cm, rightIndent=1.5 * cm, spaceAfter=3)
+    return styles
+
+
+_TABLE_STYLE = TableStyle([
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+])
+
+
+def page_form_name(key: str) -> str:
+    return f"pg_{key}"
+
+
+class _ListEntry(Flowable):
+    """
+    A line of the table of contents (or list of figures/tables): the linked
+    title, plus the page number drawn from a PDF form that is only defined
+    once layout has placed the target (see ThesisDocTemplate.build).
+    """
+
+    def __init__(self, key: str, markup: str, style: ParagraphStyle):
+        super().__init__()
+        self.key = key
+        self.style = style
+        self.paragraph = Paragraph(f'<a href="#{key}">{markup}</a>', style)
+
+    def wrap(self, availWidth, availHeight):
+        _, self.height = self.paragraph.wrap(availWidth, availHeight)
+        self.width = availWidth
+        return self.width, self.height
+
+    def getSpaceAfter(self):
+        return self.paragraph.getSpaceAfter()
+
+    def draw(self):
+        self.paragraph.drawOn(self.canv, 0, 0)
+        lines = len(self.paragraph.blPara.lines)
+        baseline = self.height - self.style.fontSize - (lines - 1) * self.style.leading
+        self.canv.saveState()
+        self.canv.translate(self.width, baseline)
+        self.canv.doForm(page_form_name(self.key))
+        self.canv.restoreState()
+
+
+class ThesisDocTemplate(BaseDocTemplate):
+    """
+    Two page templates: "front" (roman page numbers) and "body" (arabic, from 1).
+    Flowables carrying a `_list_entry` (key, outline level or None, title) get
+    a named destination, an outline entry and their page number recorded.
+    """
+
+    def __init__(self, filename, settings: Settings, fonts, **kw):
+        pagesize = getattr(pagesizes, settings.paper_size.upper(), pagesizes.A4)
+        super().__init__(filename, pagesize=pagesize,
+                         topMargin=settings.margin_top * cm, bottomMargin=settings.margin_bottom * cm,
+                         leftMargin=settings.margin_left * cm, rightMargin=settings.margin_right * cm,
+                         # Same input -> same bytes (export cache, ETags)
+                         invariant=1, **kw)
+        self.settings = settings
+        self.fonts = fonts
+        self.body_start = None
+        self.entry_pages = {}
+        self._outline_level = -1
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height,
+                      leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0, id="content")
+        self.addPageTemplates([
+            PageTemplate("front", [frame], onPage=self._front_page),
+            PageTemplate("body", [frame], onPage=self._body_page),
+        ])
+
+    def _draw_page_number(self, canv, text):
+        canv.saveState()
+        canv.setFont(self.fonts[0], self.settings.font_size - 1)
+        canv.drawCentredString(self.leftMargin + self.width / 2, self.bottomMargin / 2, text)
+        canv.restoreState()
+
+    def _front_page(self, canv, doc):
+        self._draw_page_number(canv, to_roman(self.page).lower())
+
+    def _body_page(self, canv, doc):
+        if self.body_start is None:
+            self.body_start = self.page
+        self._draw_page_number(canv, str(self.page - self.body_start + 1))
+
+    def afterFlowable(self, flowable):
+        entry = getattr(flowable, "_list_entry", None)
+        if entry is None:
+            return
+        key, outline_level, title = entry
+        self.canv.bookmarkHorizontal(key, 0, self.frame._y + flowable.height)
+        self.entry_pages[key] = self.page - self.body_start + 1 if self.body_start else self.page
+        if outline_level is not None:
+            # Outline levels may only go one deeper at a time
+            outline_level = min(outline_level, self._outline_level + 1)
+            self.canv.addOutlineEntry(title, key, outline_level)
+            self._outline_level = outline_level
+
+    def build(self, flowables, page_keys=()):
+        """Lay out the story once, then fill in the page numbers of the `page_keys` list entries."""
+        self._doSave = 0
+        super().build(flowables)
+        canv = self.canv
+        size = self.settings.font_size
+        for key in page_keys:
+            canv.beginForm(page_form_name(key), lowerx=-4 * cm, lowery=-size, upperx=0, uppery=2 * size)
+            canv.setFont(self.fonts[0], size)
+            canv.drawRightString(0, 0, str(self.entry_pages.get(key, "")))
+            canv.endForm()
+        canv.save()
+
+
+class _PdfState:
+    """Story, counters and list entries carried from block to block."""
+
+    def __init__(self, doc: ThesisDocTemplate, settings: Settings, styles: dict, figures: List[Figure],
+                 figure_images: dict, equation_dir: str):
+        self.doc = doc
+        self.settings = settings
+        self.styles = styles
+        self.figure_index = index_figures(figures)
+        # figure_key -> preprocessed image bytes (None when the file is missing)
+        self.figure_images = figure_images
+        # Inline equation PNGs are written here once each: <img> in paragraph markup needs a file
+        self.equation_dir = equation_dir
+        self.equation_files = {}
+        self.story = []
+        # h1..h5 counters
+        self.counts = [0, 0, 0, 0, 0]
+        # (key, level, markup) for the table of contents; (key, markup) for figures and tables
+        self.toc = []
+        self.figure_list = []
+        self.table_list = []
+        self.stats = Counter()
+        self._entries = 0
+
+    def entry(self, flowable, prefix: str, outline_level, title: str) -> str:
+        """Mark `flowable` as a list entry target and return its key."""
+        self._entries += 1
+        key = f"{prefix}{self._entries}"
+        flowable._list_entry = (key, outline_level, title)
+        return key
+
+
+def _equation_file(state: _PdfState, png_bytes: bytes) -> str:
+    digest = hashlib.sha1(png_bytes).hexdigest()
+    path = state.equation_files.get(digest)
+    if path is None:
+        path = os.path.join(state.equation_dir, f"{digest}.png")
+        with open(path, "wb") as f:
+            f.write(png_bytes)
+        state.equation_files[digest] = path
+    return path
+
+
+def _inline_math(state: _PdfState, latex: str, fallback: str) -> str:
+    """<img> markup for an inline equation, lowered by its descent to sit on the baseline."""
+    png_bytes, h_in, w_in, descent_in = get_equation_image(latex, font_size_pt=state.settings.font_size)
+    if png_bytes is None:
+        state.stats["equations_fallback"] += 1
+        return fallback
+    state.stats["equations_image"] += 1
+    path = escape(_equation_file(state, png_bytes), {'"': "&quot;"})
+    return f'<img src="{path}" width="{w_in * 72:.2f}" height="{h_in * 72:.2f}" valign="{-descent_in * 72:.2f}"/>'
+
+
+def _add_display_math(state: _PdfState, latex: str):
+    png_bytes, h_in, w_in, _ = get_equation_image(latex, font_size_pt=state.settings.font_size, is_display=True)
+    if png_bytes is None:
+        state.stats["equations_fallback"] += 1
+        state.story.append(Paragraph(_placeholder("[Công thức phức tạp - cần chèn thủ công]"),
+                                     state.styles["equation"]))
+        return
+    state.stats["equations_image"] += 1
+    width, height = w_in * inch, h_in * inch
+    if width > state.doc.width:
+        width, height = state.doc.width, height * state.doc.width / width
+    image = Image(io.BytesIO(png_bytes), width=width, height=height, hAlign="CENTER")
+    state.story += [Spacer(1, 6), image, Spacer(1, 6)]
+
+
+def _add_heading(state: _PdfState, block: md.Heading):
+    advance_heading_counts(state.counts, block.level)
+    title = heading_title(state.settings, state.counts, block.level, block.text)
+    p = Paragraph(escape(title).replace("\n", "<br/>"), state.styles[f"h{block.level}"])
+    if block.level <= TOC_LEVELS:
+        plain = title.replace("\n", " ")
+        key = state.entry(p, "h", block.level - 1, plain)
+        state.toc.append((key, block.level, escape(plain)))
+    state.story.append(p)
+
+
+def _add_paragraph(state: _PdfState, block: md.Paragraph):
+    parts = []
+
+    def flush():
+        if "".join(parts).strip():
+            state.story.append(Paragraph("".join(parts), state.styles["body"]))
+        parts.clear()
+
+    for span in block.inlines:
+        if isinstance(span, md.TextSpan):
+            parts.append(inlines_to_markup([span]))
+        elif span.display:
+            # Display math: centered on its own, the text continues in a new paragraph
+            flush()
+            _add_display_math(state, span.latex)
+        else:
+            parts.append(_inline_math(state, span.latex, _placeholder("[công thức]")))
+    flush()
+
+
+def _add_bullet(state: _PdfState, block: md.BulletItem):
+    # Chuẩn đồ án Việt Nam: gạch đầu dòng (–) và dấu cộng (+)
+    bullet_char = "+" if block.level == 2 else "–"
+    markup = "".join(
+        _inline_math(state, span.latex, escape(f"${span.latex}$")) if isinstance(span, md.MathSpan)
+        else inlines_to_markup([span])
+        for span in block.inlines
+    )
+    state.story.append(Paragraph(markup, state.styles[f"bullet{min(block.level, 3)}"], bulletText=bullet_char))
+
+
+def _caption(state: _PdfState, text: str, style: str, prefix: str, entries: list):
+    p = Paragraph(escape(text), state.styles[style])
+    entries.append((state.entry(p, prefix, None, text), escape(text)))
+    return p
+
+
+def _grid_table(rows, col_widths, header_style, body_styles):
+    data = [[Paragraph(escape(cell), header_style) for cell in rows[0]]]
+    data += [[Paragraph(escape(cell), body_styles[i]) for i, cell in enumerate(row)] for row in rows[1:]]
+    # The header row repeats on every page the table spans
+    table = platypus.Table(data, colWidths=col_widths, repeatRows=1)
+    table.setStyle(_TABLE_STYLE)
+    return table
+
+
+def _add_table(state: _PdfState, block: md.TableBlock):
+    cols = max(len(row) for row in block.rows)
+    rows = [row + [""] * (cols - len(row)) for row in block.rows]
+    state.story.append(Spacer(1, 6))
+    state.story.append(_grid_table(rows, [state.doc.width / cols] * cols, state.styles["cell_header"],
+                                   [state.styles["cell"]] * cols))
+    state.stats["tables"] += 1
+    # Caption below the table
+    if block.caption:
+        state.story.append(_caption(state, block.caption, "table_caption", "tbl", state.table_list))
+    state.story.append(Spacer(1, 6))
+
+
+def _add_table_caption(state: _PdfState, block: md.TableCaption):
+    state.story.append(_caption(state, block.text, "table_caption", "tbl", state.table_list))
+
+
+def _add_figure(state: _PdfState, block: md.FigureRef):
+    fig_num = block.number
+    fig_data = state.figure_index.get(figure_key(fig_num))
+    if not fig_data:
+        state.story.append(Paragraph(escape(f"[Hình ảnh không tìm thấy dữ liệu: {fig_num}]"),
+                                     state.styles["placeholder"]))
+        return
+    if not fig_data.path:
+        return
+
+    image = state.figure_images.get(figure_key(fig_num))
+    if image is None:
+        img_path = os.path.abspath(fig_data.path)
+        state.story.append(Paragraph(escape(f"[Hình ảnh không tìm thấy: {img_path}]"), state.styles["placeholder"]))
+        return
     try:
-        doc = SimpleDocTemplate(
-            file_path,
-            pagesize=A4,
-            topMargin=settings.margin_top * cm,
-            bottomMargin=settings.margin_bottom * cm,
-            leftMargin=settings.margin_left * cm,
-            rightMargin=settings.margin_right * cm
-        )
-        
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        heading1 = ParagraphStyle(
-            'Heading1Custom',
-            parent=styles['Heading1'],
-            fontSize=settings.h1_size,
-            alignment=1,  # Center
-            spaceAfter=20
-        )
-        
-        normal = ParagraphStyle(
-            'NormalCustom',
-            parent=styles['Normal'],
-            fontSize=settings.font_size,
-            firstLineIndent=settings.indent * cm,
-            alignment=4  # Justify
-        )
-        
-        story = []
-        
-        # TOC
-        story.append(Paragraph("MỤC LỤC", heading1))
-        story.append(Spacer(1, 20))
-        for line in text.split("\n"):
-            if line.startswith("# "):
-                title = line[2:].upper() if settings.h1_uppercase else line[2:]
-                story.append(Paragraph(f"<b>{title}</b>", styles['Normal']))
-            elif line.startswith("## "):
-                story.append(Paragraph(f"    {line[3:]}", styles['Normal']))
-        story.append(PageBreak())
-        
-        # Content
-        for line in text.split("\n"):
-            if line.startswith("# "):
-                title = line[2:].upper() if settings.h1_uppercase else line[2:]
-                story.append(Paragraph(title, heading1))
-            elif line.startswith("## "):
-                story.append(Paragraph(line[3:], styles['Heading2']))
-            elif line.startswith("### "):
-                story.append(Paragraph(f"<i>{line[4:]}</i>", styles['Heading3']))
-            elif line.strip():
-                story.append(Paragraph(line, normal))
-                
-        # References
-        if citations:
+        px_width, px_height = ImageReader(io.BytesIO(image)).getSize()
+        width = min(figure_width_cm(fig_data) * cm, state.doc.width)
+        height = width * px_height / px_width
+        # Leave room for the caption on the page
+        max_height = state.doc.height * 0.8
+        if height > max_height:
+            width, height = width * max_height / height, max_height
+        picture = Image(io.BytesIO(image), width=width, height=height, hAlign="CENTER")
+    except Exception as e:
+        print(f"Error adding image {fig_data.path}: {e}")
+        state.story.append(Paragraph(escape(f"[Lỗi chèn hình: {fig_num}]"), state.styles["placeholder"]))
+        return
+    caption = _caption(state, f"{fig_num}: {block.caption}", "figure_caption", "fig", state.figure_list)
+    state.story.append(KeepTogether([picture, caption]))
+    state.stats["images_embedded"] += 1
+
+
+_BLOCK_HANDLERS = {
+    md.Heading: _add_heading,
+    md.Paragraph: _add_paragraph,
+    md.BulletItem: _add_bullet,
+    md.TableBlock: _add_table,
+    md.TableCaption: _add_table_caption,
+    md.FigureRef: _add_figure,
+}
+
+
+def _abbreviation_tables(state: _PdfState, abbreviations: List[dict]):
+    """DANH MỤC CÁC CHỮ VIẾT TẮT VÀ KÝ HIỆU (Chuẩn VN: 2 cột)."""
+    styles = state.styles
+    story = [Paragraph("DANH MỤC CÁC CHỮ VIẾT TẮT VÀ KÝ HIỆU", styles["front"])]
+    widths = [state.doc.width / 2] * 2
+    for kind, label, first_col in (("abbreviation", "Chữ viết tắt", "cell_center"),
+                                   ("symbol", "Ký hiệu", "cell_symbol")):
+        items = sorted((a for a in abbreviations if a.get("type") == kind), key=lambda x: x.get("abbreviation", ""))
+        if not items:
+            continue
+        rows = [[label, "Diễn giải đầy đủ"]]
+        rows += [[item.get("abbreviation", ""), item.get("fullForm", "")] for item in items]
+        story += [Paragraph(label, styles["subheading"]),
+                  _grid_table(rows, widths, styles["cell_header"], [styles[first_col], styles["cell"]]),
+                  Spacer(1, 12)]
+    return story
+
+
+def _front_matter(state: _PdfState, abbreviations: List[dict]):
+    """
+    Table of contents and lists, built from the entries collected while walking
+    the body, each on its own pages; the body starts on a fresh "body" page.
+    """
+    styles = state.styles
+    sections = [[Paragraph("MỤC LỤC", styles["front"])] +
+                [_ListEntry(key, markup, styles[f"toc{level}"]) for key, level, markup in state.toc]]
+    if state.figure_list:
+        sections.append([Paragraph("DANH MỤC HÌNH ẢNH", styles["front"])] +
+                        [_ListEntry(key, markup, styles["toc2"]) for key, markup in state.figure_list])
+    if state.table_list:
+        sections.append([Paragraph("DANH MỤC BẢNG BIỂU", styles["front"])] +
+                        [_ListEntry(key, markup, styles["toc2"]) for key, markup in state.table_list])
+    if abbreviations:
+        sections.append(_abbreviation_tables(state, abbreviations))
+    story = []
+    for section in sections:
+        if story:
             story.append(PageBreak())
-            story.append(Paragraph("TÀI LIỆU THAM KHẢO", heading1))
-            for i, c in enumerate(citations, 1):
-                story.append(Paragraph(f"[{i}] {format_citation_apa(c)}", styles['Normal']))
-        
-        doc.build(story)
+        story += section
+    return story + [NextPageTemplate("body"), PageBreak()]
+
+
+def warm_up_pdf_export(settings: Settings = None) -> bool:
+    """Register the default font family. Returns False if only the built-in (non-Vietnamese) fonts are available."""
+    settings = settings or Settings()
+    return register_font_family(settings.font_family) != BUILTIN_FONTS
+
+
+def export_to_pdf(file_path: str, text: str, settings: Settings,
+                  figures: List[Figure], tables: List[Table], citations: List[Citation],
+                  abbreviations: List[dict] = None, timings: dict = None, counters: dict = None):
+    """
+    Export markdown content to a PDF, in the thesis layout of the .docx export.
+    The content is walked once; the table of contents and the lists of figures
+    and tables are collected on the way and get their page numbers after the
+    single layout pass. `timings` and `counters` work as in export_to_docx
+    (phases parse, fonts, equations, figures, body, references, layout).
+    """
+    timer = PhaseTimer(timings)
+    try:
+        blocks = md.parse_document(text)
+        timer.mark("parse")
+        fonts = register_font_family(settings.font_family)
+        styles = build_styles(settings, fonts)
+        timer.mark("fonts")
+
+        # Render equations up front (in parallel), sharing the equation cache with the Word export
+        fragments = [(span.latex, span.display and not isinstance(block, md.BulletItem))
+                     for block, span in md.iter_math(blocks)]
+        rendered = prerender_equations(fragments, font_size_pt=settings.font_size)
+        timer.mark("equations")
+        figure_index = index_figures(figures)
+        refs = {figure_key(b.number) for b in blocks if isinstance(b, md.FigureRef)}
+        figure_images = prepare_figure_images([figure_index[r] for r in refs if r in figure_index])
+        timer.mark("figures")
+
+        doc = ThesisDocTemplate(file_path, settings, fonts, title="Thesis")
+        with tempfile.TemporaryDirectory(prefix="pdf-equations-") as equation_dir:
+            state = _PdfState(doc, settings, styles, figures, figure_images, equation_dir)
+            state.stats["equations_rendered"] = rendered
+            state.stats["equations_cached"] = len({(normalize_latex(l), bool(d)) for l, d in fragments}) - rendered
+            for block in blocks:
+                _BLOCK_HANDLERS[type(block)](state, block)
+            timer.mark("body")
+
+            # --- REFERENCES ---
+            if citations:
+                state.story.append(PageBreak())
+                state.story.append(Paragraph("TÀI LIỆU THAM KHẢO", styles["front"]))
+                for i, c in enumerate(citations, 1):
+                    state.story.append(Paragraph(escape(f"[{i}] {format_citation_apa(c)}"), styles["reference"]))
+            timer.mark("references")
+
+            story = _front_matter(state, abbreviations) + state.story
+            keys = [e[0] for e in state.toc + state.figure_list + state.table_list]
+            doc.build(story, page_keys=keys)
+        timer.mark("layout")
+        if counters is not None:
+            counters.update(state.stats)
+            counters["bytes_written"] = os.path.getsize(file_path)
         return True, f"Đã xuất file PDF:\n{file_path}"
-        
+
     except Exception as e:
+        traceback.print_exc()
         return False, f"Không thể xuất file PDF:\n{str(e)}"
@@ -0,0 +1,84 @@
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Dict
+import numpy as np
+from core.utils.pdf_fonts import resolve_font_files
+
+# Code points with their own slot in a width table: Latin, Vietnamese
+# (U+1EA0-U+1EF9) and general punctuation. Anything above uses the last slot.
+TABLE_SIZE = 0x2070
+
+# Used when no TrueType font is installed at all (average Times-like advance)
+DEFAULT_ADVANCE = 0.5
+DEFAULT_LINE_HEIGHT = 1.15
+
+_TABLES: Dict[str, "FontMetrics"] = {}
+_lock = threading.Lock()
+
+
+@dataclass
+class FontMetrics:
+    # Advance widths in em, indexed by code point; widths[TABLE_SIZE] is the default
+    widths: np.ndarray
+    # Single line height in em, the way Word computes it (win ascent + descent + external leading)
+    line_height: float
+
+
+def _line_height(ttf) -> float:
+    """Word's single line height for a face: usWinAscent + usWinDescent plus the hhea line gap it doesn't cover."""
+    upem = ttf.unitsPerEm
+    try:
+        os2 = ttf.get_table("OS/2")
+        hhea = ttf.get_table("hhea")
+        win_ascent, win_descent = struct.unpack(">HH", os2[74:78])
+        ascender, descender, line_gap = struct.unpack(">hhh", hhea[4:10])
+    except Exception:
+        return (ttf.ascent - ttf.descent) / 1000
+    external = max(0, line_gap - ((win_ascent + win_descent) - (ascender - descender)))
+    return (win_ascent + win_descent + external) / upem
+
+
+def _load(path: str) -> FontMetrics:
+    from reportlab.pdfbase.ttfonts import TTFontFile
+
+    ttf = TTFontFile(path)
+    widths = np.full(TABLE_SIZE + 1, ttf.defaultWidth / 1000, dtype=np.float64)
+    for code, width in ttf.charWidths.items():
+        if code < TABLE_SIZE:
+            widths[code] = width / 1000
+    # Line breaks and tabs take no room of their own
+    widths[[9, 10, 13]] = 0.0
+    widths.setflags(write=False)
+    return FontMetrics(widths, _line_height(ttf))
+
+
+def font_metrics(path: str) -> FontMetrics:
+    """Glyph advance table of one .ttf file, parsed once per process."""
+    with _lock:
+        metrics = _TABLES.get(path)
+    if metrics is None:
+        metrics = _load(path)
+        with _lock:
+            _TABLES[path] = metrics
+    return metrics
+
+
+def face_metrics(family: str, bold: bool = False, italic: bool = False) -> FontMetrics:
+    """Metrics of one style of `family`, using the same font files as the PDF export."""
+    files = resolve_font_files(family)
+    if files is None:
+        key = "\x00builtin"
+        with _lock:
+            metrics = _TABLES.get(key)
+        if metrics is None:
+            widths = np.full(TABLE_SIZE + 1, DEFAULT_ADVANCE)
+            widths[[9, 10, 13]] = 0.0
+            widths.setflags(write=False)
+            metrics = FontMetrics(widths, DEFAULT_LINE_HEIGHT)
+            with _lock:
+                _TABLES[key] = metrics
+        return metrics
+    style = ("bold" if bold else "") + ("italic" if italic else "") or "regular"
+    return font_metrics(files[style])
+
@@ -48,3 +48,38 @@ def to_roman(n: int) -> str:
             n -= val[i]
         i += 1
     return roman_num
+
+def advance_heading_counts(counts, level):
+    """Update h1..h5 counters for a new heading of the given level."""
+    counts[level - 1] += 1
+    # H1-H3 reset the levels below them down to H4, H4 resets H5
+    if level <= 3:
+        for idx in range(level, 4):
+            counts[idx] = 0
+    elif level == 4:
+        counts[4] = 0
+
+def heading_title(settings, counts, level: int, title: str) -> str:
+    """
+    Numbered heading text ("CHƯƠNG I: ...", "1.1. ...") for counters already
+    advanced to this heading. A split chapter title contains a "\\n".
+    """
+    # Heading 1: CHƯƠNG I
+    if level == 1:
+        roman = to_roman(counts[0])
+        if not settings.auto_numbering:
+            return title.upper()
+        # Logic tách dòng tiêu đề chương
+        if settings.h1_split:
+            prefix = f"{settings.h1_prefix} {roman}" if settings.h1_prefix else f"{roman}"
+            return f"{prefix}\n{title.upper()}"
+        prefix = f"{settings.h1_prefix} {roman}: " if settings.h1_prefix else f"{roman}. "
+        return f"{prefix}{title.upper()}"
+
+    # Heading 2-5: 1.1 / 1.1.1 / ...
+    if not settings.auto_numbering:
+        return title
+    # Nếu hierarchical_numbering = True -> 1.1, ngược lại -> 1
+    numbers = counts[0:level] if settings.hierarchical_numbering else counts[1:level]
+    prefix = ".".join(str(n) for n in numbers) + "."
+    return f"{prefix} {title}"
@@ -0,0 +1,125 @@
+import io
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from PIL import Image
+from core.config import (
+    CACHE_DIR, FIGURE_TARGET_DPI, FIGURE_JPEG_QUALITY, FIGURE_WORKERS,
+    IMAGE_CACHE_MEMORY_ITEMS, IMAGE_CACHE_DISK_BYTES,
+)
+from core.models.data_classes import Figure
+from core.utils.cache import TwoTierCache
+
+# Width used when a figure has none set (cm)
+DEFAULT_FIGURE_WIDTH_CM = 16
+
+# Downsampled figure images keyed by (content hash, width, dpi, quality)
+IMAGE_CACHE = TwoTierCache(
+    os.path.join(CACHE_DIR, "images"),
+    max_items=IMAGE_CACHE_MEMORY_ITEMS,
+    max_bytes=IMAGE_CACHE_DISK_BYTES,
+)
+
+# Formats that are kept lossless (diagrams, screenshots, transparency)
+_LOSSLESS_FORMATS = ("PNG", "GIF")
+
+
+def figure_key(number: str) -> str:
+    """'Hình 1.1' and 'Hình1.1' refer to the same figure."""
+    return number.replace(" ", "")
+
+
+def index_figures(figures: List[Figure]) -> Dict[str, Figure]:
+    """Figure lookup by number. The first figure wins when numbers repeat."""
+    index = {}
+    for f in figures:
+        index.setdefault(figure_key(f.number), f)
+    return index
+
+
+def figure_width_cm(figure: Figure) -> float:
+    return figure.width or DEFAULT_FIGURE_WIDTH_CM
+
+
+def _downsample(data: bytes, width_cm: float, dpi: int, quality: int) -> Optional[bytes]:
+    """
+    Re-encode an image for its displayed size. Returns None when the original
+    should be embedded as is (already smaller, or not something Pillow reads).
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    source_format = img.format
+
+    target_px = max(1, round(width_cm / 2.54 * dpi))
+    if img.width > target_px:
+        height_px = max(1, round(img.height * target_px / img.width))
+        if img.mode not in ("1", "L", "LA", "RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("P", "PA") else "RGB")
+        img = img.resize((target_px, height_px), Image.LANCZOS)
+
+    out = io.BytesIO()
+    try:
+        if source_format in _LOSSLESS_FORMATS or img.mode in ("1", "LA", "RGBA", "P", "PA"):
+            img.save(out, format="PNG", optimize=True, dpi=(dpi, dpi))
+        else:
+            if img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            img.save(out, format="JPEG", quality=quality, optimize=True, dpi=(dpi, dpi))
+    except Exception as e:
+        print(f"Warning: could not re-encode figure image: {e}")
+        return None
+
+    result = out.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def prepare_figure_image(path: str, width_cm: float, dpi: int = FIGURE_TARGET_DPI,
+                         quality: int = FIGURE_JPEG_QUALITY) -> Optional[bytes]:
+    """
+    Image bytes to embed for a figure shown `width_cm` wide, or None when the
+    file cannot be read. Results are cached by content hash, so renaming or
+    re-uploading the same image does not re-encode it.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if dpi <= 0:
+        return data
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    key = hashlib.sha256(f"{content_hash}\x00{width_cm}\x00{dpi}\x00{quality}".encode()).hexdigest()
+    entry = IMAGE_CACHE.get(key)
+    if entry is not None:
+        payload, meta = entry
+        return data if meta.get("original") else payload
+
+    result = _downsample(data, width_cm, dpi, quality)
+    if result is None:
+        IMAGE_CACHE.put(key, b"", {"original": True})
+        return data
+    IMAGE_CACHE.put(key, result, {"original": False})
+    return result
+
+
+def prepare_figure_images(figures: List[Figure], dpi: int = FIGURE_TARGET_DPI) -> Dict[str, Optional[bytes]]:
+    """
+    Check and preprocess the images of several figures concurrently (file I/O
+    and Pillow's codecs release the GIL). Returns figure_key -> bytes, or None
+    when the image file is missing.
+    """
+    figures = [f for f in figures if f.path]
+    if not figures:
+        return {}
+
+    def work(f):
+        return prepare_figure_image(os.path.abspath(f.path), figure_width_cm(f), dpi)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FIGURE_WORKERS, len(figures)))) as pool:
+        results = list(pool.map(work, figures))
+    return {figure_key(f.number): data for f, data in zip(figures, results)}
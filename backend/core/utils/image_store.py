@@ -0,0 +1,105 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+from dataclasses import dataclass
+
+CHUNK_SIZE = 1024 * 1024
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the store's size limit."""
+
+
+def too_large_message(max_bytes: int) -> str:
+    return f"File vượt quá giới hạn {max_bytes / (1024 * 1024):g} MB."
+
+
+@dataclass
+class StoredImage:
+    digest: str     # sha256 of the content
+    relpath: str    # path relative to the store root, with "/" separators
+    size: int
+    created: bool   # False when identical content was already stored
+
+
+class ImageStore:
+    """
+    Content-addressed image store. Each distinct content is kept once, at
+    ab/cd/<sha256><ext>, so no directory grows beyond a few files even with
+    hundreds of thousands of images. Writes go to a temp file first and are
+    renamed into place, so readers never see partial files. The temp files sit
+    in a sibling of the root (same filesystem, so the rename stays atomic):
+    the root is served as is, and partial uploads must not be.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._tmp_dir = os.path.normpath(root) + ".tmp"
+        os.makedirs(root, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        # Temp files of older versions, inside the served root
+        shutil.rmtree(os.path.join(root, ".tmp"), ignore_errors=True)
+
+    @staticmethod
+    def normalize_ext(filename: str) -> str:
+        ext = os.path.splitext(filename or "")[1].lower()
+        return ext if _EXT_RE.match(ext) else ""
+
+    def _shard(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def find(self, digest: str):
+        """Relative path of the stored object with this digest, or None."""
+        shard = self._shard(digest)
+        try:
+            names = os.listdir(shard)
+        except OSError:
+            return None
+        for name in names:
+            if name.startswith(digest):
+                return f"{digest[:2]}/{digest[2:4]}/{name}"
+        return None
+
+    def path_for(self, relpath: str) -> str:
+        return os.path.join(self.root, *relpath.split("/"))
+
+    def save(self, fileobj, filename: str) -> StoredImage:
+        """
+        Copy `fileobj` into the store in chunks while hashing it. Blocking;
+        call it from a worker thread. Raises UploadTooLargeError past max_bytes.
+        """
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(too_large_message(self.max_bytes))
+                    sha.update(chunk)
+                    out.write(chunk)
+
+            digest = sha.hexdigest()
+            existing = self.find(digest)
+            if existing is not None:
+                os.remove(tmp_path)
+                return StoredImage(digest, existing, size, created=False)
+
+            relpath = f"{digest[:2]}/{digest[2:4]}/{digest}{self.normalize_ext(filename)}"
+            os.makedirs(self._shard(digest), exist_ok=True)
+            os.replace(tmp_path, self.path_for(relpath))
+            return StoredImage(digest, relpath, size, created=True)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
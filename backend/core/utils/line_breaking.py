@@ -0,0 +1,128 @@
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Sequence
+import numpy as np
+from core.utils.font_metrics import TABLE_SIZE, face_metrics
+
+# Faces of a family, in the order their width tables are stacked
+_STYLES = ((False, False), (True, False), (False, True), (True, True))
+
+_EPS = 1e-6
+
+
+class TextRun(NamedTuple):
+    """A piece of paragraph text in one face. `width` (points) fixes the width of an object such as an equation."""
+    text: str
+    size: float
+    bold: bool = False
+    italic: bool = False
+    width: Optional[float] = None
+
+
+class LineBreaker:
+    """
+    Greedy (Word-style) line breaking for many paragraphs at once.
+
+    Paragraphs are queued with add(); run() measures every character of all of
+    them with a single lookup into the stacked glyph-width tables, finds the
+    words and their widths with prefix sums, and then only loops once per
+    output line (a bisect over the running word totals).
+
+    Spaces are break opportunities, "\\n" forces a break, and words wider than
+    a line are cut where they overflow.
+    """
+
+    def __init__(self, family: str, density: float = 1.0):
+        self.density = density
+        self._table = np.stack([face_metrics(family, bold, italic).widths for bold, italic in _STYLES])
+        self._texts: List[str] = []
+        self._lengths: List[int] = []
+        self._faces: List[int] = []
+        self._sizes: List[float] = []
+        self._fixed = {}  # char offset -> width of an object
+        self._jobs = []  # (start offset, first line width, other lines width)
+        self._offset = 0
+
+    def add(self, runs: Sequence[TextRun], first_width: float, width: float) -> int:
+        """Queue a paragraph; returns its index in run()'s result."""
+        self._jobs.append((self._offset, first_width, width))
+        for run in runs:
+            if not run.text:
+                continue
+            if run.width is not None:
+                self._fixed[self._offset] = run.width
+            self._texts.append(run.text)
+            self._lengths.append(len(run.text))
+            self._faces.append(int(bool(run.bold)) + 2 * int(bool(run.italic)))
+            self._sizes.append(run.size)
+            self._offset += len(run.text)
+        # Paragraphs are separated by a forced break
+        self._texts.append("\n")
+        self._lengths.append(1)
+        self._faces.append(0)
+        self._sizes.append(0.0)
+        self._offset += 1
+        return len(self._jobs) - 1
+
+    def _measure(self):
+        codes = np.frombuffer("".join(self._texts).encode("utf-32-le"), dtype=np.uint32)
+        lengths = np.array(self._lengths)
+        faces = np.repeat(np.array(self._faces, dtype=np.intp), lengths)
+        sizes = np.repeat(np.array(self._sizes), lengths)
+        widths = self._table[faces, np.minimum(codes, TABLE_SIZE)] * sizes * self.density
+        if self._fixed:
+            widths[list(self._fixed)] = list(self._fixed.values())
+        return codes, widths
+
+    def run(self) -> List[List[int]]:
+        """For every queued paragraph, the offsets (into its text) at which its lines start."""
+        if not self._jobs:
+            return []
+        codes, widths = self._measure()
+        forced = codes == 10
+        solid = ~(forced | (codes == 32))
+        starts = np.flatnonzero(solid & ~np.r_[False, solid[:-1]])
+        ends = np.flatnonzero(solid & ~np.r_[solid[1:], False]) + 1
+        csum = np.r_[0.0, np.cumsum(widths)]
+
+        # Segments run between forced breaks; a word belongs to the segment its start is in
+        break_pos = np.flatnonzero(forced)
+        segment_starts = np.r_[0, break_pos + 1][:-1]
+        seg_first_word = np.searchsorted(starts, segment_starts)
+        seg_last_word = np.r_[seg_first_word[1:], len(starts)]
+        job_starts = np.array([job[0] for job in self._jobs])
+        segment_job = (np.searchsorted(job_starts, segment_starts, side="right") - 1).tolist()
+
+        # Width from the start of the text to the start / end of each word: a line
+        # from position p holds words up to the last end within csum[p] + width
+        start_x = csum[starts].tolist()
+        end_x = csum[ends].tolist()
+        segment_x = csum[segment_starts].tolist()
+        starts = starts.tolist()
+        ends = ends.tolist()
+
+        result = [[] for _ in self._jobs]
+        for seg, (p, w0, w1) in enumerate(zip(segment_starts.tolist(), seg_first_word.tolist(),
+                                              seg_last_word.tolist())):
+            job = segment_job[seg]
+            origin, first_width, width = self._jobs[job]
+            lines = result[job]
+            lines.append(p - origin)
+            available = first_width if p == origin else width
+            # Leading spaces count on a segment's first line
+            x = segment_x[seg]
+            k = w0
+            while k < w1:
+                j = bisect_right(end_x, x + available + _EPS, k, w1) - 1
+                if j >= k:
+                    k = j + 1
+                    if k == w1:
+                        break
+                    p, x = starts[k], start_x[k]
+                else:
+                    # Word k alone is wider than the line: cut it where it overflows
+                    cut = int(np.searchsorted(csum, x + available + _EPS, side="right")) - 1
+                    p = min(max(cut, p + 1, starts[k] + 1), ends[k] - 1)
+                    x = float(csum[p])
+                lines.append(p - origin)
+                available = width
+        return result
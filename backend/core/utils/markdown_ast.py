@@ -0,0 +1,229 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+# --- INLINE NODES ---
+
+@dataclass
+class TextSpan:
+    text: str
+    bold: bool = False
+    italic: bool = False
+    underline: bool = False
+
+@dataclass
+class MathSpan:
+    latex: str
+    display: bool = False
+
+Inline = Union[TextSpan, MathSpan]
+
+# --- BLOCK NODES ---
+
+@dataclass
+class Heading:
+    level: int
+    text: str
+
+@dataclass
+class Paragraph:
+    inlines: List[Inline]
+
+@dataclass
+class BulletItem:
+    level: int
+    inlines: List[Inline]
+
+@dataclass
+class TableBlock:
+    rows: List[List[str]]
+    caption: Optional[str] = None  # "Bảng x.y: ..." line directly above the table
+
+@dataclass
+class TableCaption:
+    """A table caption that is not immediately followed by a table."""
+    text: str
+
+@dataclass
+class FigureRef:
+    number: str   # e.g. "Hình 1.1"
+    caption: str
+
+Block = Union[Heading, Paragraph, BulletItem, TableBlock, TableCaption, FigureRef]
+
+# Precompiled patterns
+BULLET_RE = re.compile(r'^(\-{1,3}|\*{1,3}|•|●)\s')
+FIGURE_RE = re.compile(r'\[\s*(Hình \d+\.\d+)\s*:\s*(.*)\s*\]')
+HEADING_PREFIXES = ("##### ", "#### ", "### ", "## ", "# ")
+
+
+class _DelimiterFinder:
+    """
+    str.find with memoized results. Searches for the same delimiter always start
+    at non-decreasing offsets, so remembering the last hit keeps the whole inline
+    scan linear even when openers are never closed.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._last = {}
+
+    def find(self, delim: str, start: int) -> int:
+        last = self._last.get(delim)
+        if last is not None and (last == -1 or last >= start):
+            return last
+        pos = self.text.find(delim, start)
+        self._last[delim] = pos
+        return pos
+
+
+def parse_inlines(text: str) -> List[Inline]:
+    """
+    Split a line into formatted spans: $$display$$, $inline$, **bold**, *italic*,
+    <u>underline</u> (tried in that order at each position, shortest match wins).
+    """
+    spans = []
+    finder = _DelimiterFinder(text)
+    n = len(text)
+    plain_start = 0
+    i = 0
+
+    def flush_plain(end):
+        if end > plain_start:
+            spans.append(TextSpan(text[plain_start:end]))
+
+    while i < n:
+        c = text[i]
+        span = None
+        end = -1
+        if c == '$':
+            if text.startswith('$$', i):
+                j = finder.find('$$', i + 2)
+                if j != -1:
+                    span, end = MathSpan(text[i + 2:j], display=True), j + 2
+            if span is None:
+                j = finder.find('$', i + 1)
+                if j != -1:
+                    span, end = MathSpan(text[i + 1:j]), j + 1
+        elif c == '*':
+            if text.startswith('**', i):
+                j = finder.find('**', i + 2)
+                if j != -1:
+                    span, end = TextSpan(text[i + 2:j], bold=True), j + 2
+            if span is None:
+                j = finder.find('*', i + 1)
+                if j != -1:
+                    span, end = TextSpan(text[i + 1:j], italic=True), j + 1
+        elif c == '<' and text.startswith('<u>', i):
+            j = finder.find('</u>', i + 3)
+            if j != -1:
+                span, end = TextSpan(text[i + 3:j], underline=True), j + 4
+
+        if span is None:
+            i += 1
+            continue
+        flush_plain(i)
+        if isinstance(span, MathSpan) and not span.latex.strip():
+            # "$$" with nothing inside is just dollar signs
+            spans.append(TextSpan(text[i:end]))
+        elif not (isinstance(span, TextSpan) and not span.text):
+            spans.append(span)
+        i = plain_start = end
+
+    flush_plain(n)
+    return spans
+
+
+def _is_table_caption(stripped_line: str) -> bool:
+    return stripped_line.startswith("Bảng") and ":" in stripped_line
+
+
+def iter_located_blocks(lines: Iterable[str]) -> Iterator[Tuple[int, Block]]:
+    """Tokenize markdown lines into (index of the block's first line, block) in a single pass."""
+    pending_caption = None  # (line index, caption)
+    lines = enumerate(lines)
+    index, line = next(lines, (-1, None))
+
+    while line is not None:
+        stripped_line = line.strip()
+
+        # Table: consecutive lines starting with "|"
+        if stripped_line.startswith("|"):
+            table_start = index
+            table_lines = []
+            while line is not None and line.strip().startswith("|"):
+                table_lines.append(line)
+                index, line = next(lines, (-1, None))
+            if len(table_lines) >= 2:
+                rows = [[c.strip() for c in tl.split("|")[1:-1]] for tl in table_lines if "---" not in tl]
+                if rows:
+                    if pending_caption:
+                        yield pending_caption[0], TableBlock(rows, caption=pending_caption[1])
+                    else:
+                        yield table_start, TableBlock(rows)
+                    pending_caption = None
+            continue
+
+        # A caption not followed immediately by a table stands on its own
+        if pending_caption:
+            yield pending_caption[0], TableCaption(pending_caption[1])
+            pending_caption = None
+
+        if _is_table_caption(stripped_line):
+            pending_caption = (index, stripped_line)
+        elif line.startswith(HEADING_PREFIXES):
+            level = line.index(" ")
+            yield index, Heading(level, line[level + 1:].strip())
+        else:
+            match = BULLET_RE.match(line)
+            if match:
+                prefix = match.group(1)
+                yield index, BulletItem(len(prefix), parse_inlines(line[len(prefix) + 1:].strip()))
+            elif stripped_line:
+                match = FIGURE_RE.match(stripped_line)
+                if match:
+                    yield index, FigureRef(match.group(1), match.group(2))
+                else:
+                    yield index, Paragraph(parse_inlines(stripped_line))
+
+        index, line = next(lines, (-1, None))
+
+    if pending_caption:
+        yield pending_caption[0], TableCaption(pending_caption[1])
+
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[Block]:
+    """Tokenize markdown lines into blocks in a single pass."""
+    for _, block in iter_located_blocks(lines):
+        yield block
+
+
+def parse_document(text: str) -> List[Block]:
+    """Parse the whole content into a list of blocks."""
+    return list(iter_blocks(text.split("\n")))
+
+
+def split_chapters(text: str) -> List[str]:
+    """
+    Split content at "# " chapter headings. The first chunk holds anything
+    before the first chapter (possibly empty); each following chunk starts
+    with its heading line.
+    """
+    chunks = []
+    current = []
+    for line in text.split("\n"):
+        if line.startswith("# ") and (current or chunks):
+            chunks.append("\n".join(current))
+            current = []
+        current.append(line)
+    chunks.append("\n".join(current))
+    return chunks
+
+
+def iter_math(blocks: Iterable[Block]) -> Iterator[tuple]:
+    """Yield (block, MathSpan) for every equation in paragraphs and bullets."""
+    for block in blocks:
+        if isinstance(block, (Paragraph, BulletItem)):
+            for span in block.inlines:
+                if isinstance(span, MathSpan):
+                    yield block, span
@@ -0,0 +1,30 @@
+import os
+import re
+import hashlib
+from core.config import CACHE_DIR, EQUATION_CACHE_MEMORY_ITEMS, EQUATION_CACHE_DISK_BYTES
+from core.utils.cache import TwoTierCache
+
+# Cache ảnh công thức: LRU trong tiến trình + kho trên đĩa
+EQUATION_CACHE = TwoTierCache(
+    os.path.join(CACHE_DIR, "equations"),
+    max_items=EQUATION_CACHE_MEMORY_ITEMS,
+    max_bytes=EQUATION_CACHE_DISK_BYTES,
+)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_latex(latex_str: str) -> str:
+    """Strip $ delimiters and collapse whitespace so equivalent sources share a cache entry."""
+    s = latex_str.strip()
+    if s.startswith('$$') and s.endswith('$$') and len(s) >= 4:
+        s = s[2:-2]
+    elif s.startswith('$') and s.endswith('$') and len(s) >= 2:
+        s = s[1:-1]
+    return _WHITESPACE_RE.sub(" ", s).strip()
+
+
+def equation_key(latex_str: str, font_size_pt, is_display: bool, dpi: int) -> str:
+    """Content-addressed key for a rendered equation."""
+    raw = f"{normalize_latex(latex_str)}\x00{font_size_pt}\x00{int(bool(is_display))}\x00{dpi}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
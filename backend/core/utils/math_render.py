@@ -0,0 +1,210 @@
+import io
+import re
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from core.config import EQUATION_DPI, EQUATION_WORKERS, EQUATION_PARALLEL_THRESHOLD
+from core.utils.math_cache import EQUATION_CACHE, equation_key, normalize_latex
+
+# Process pool for rasterizing equations (created on first use, shared across exports)
+_RENDER_POOL = None
+
+# LaTeX that mathtext cannot draw: such equations fall back to a placeholder.
+# (regex, name shown to the user)
+UNSUPPORTED_LATEX_PATTERNS = [
+    (r'\\begin\{', r'\begin{...}'), (r'\\end\{', r'\end{...}'),  # environments like cases, matrix, etc.
+    (r'\\underbrace', r'\underbrace'), (r'\\overbrace', r'\overbrace'),  # braces
+    (r'\\xrightarrow', r'\xrightarrow'), (r'\\xleftarrow', r'\xleftarrow'),  # extensible arrows
+    (r'\\substack', r'\substack'),  # stacked subscripts
+    (r'\\overset', r'\overset'), (r'\\underset', r'\underset'),  # over/under set
+]
+_UNSUPPORTED_RES = [(re.compile(pattern), name) for pattern, name in UNSUPPORTED_LATEX_PATTERNS]
+
+def find_unsupported_pattern(latex_str):
+    """Name of the first unsupported construct in a LaTeX fragment, or None."""
+    for regex, name in _UNSUPPORTED_RES:
+        if regex.search(latex_str):
+            return name
+    return None
+
+def _pyplot():
+    """Import pyplot on first use (it dominates import time; cached equations never need it)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def warm_up_math_rendering() -> bool:
+    """
+    Load matplotlib and build its font cache, then draw one throwaway equation
+    so the mathtext fonts are loaded. Returns False if rendering does not work.
+    """
+    png_bytes, _, _, _ = _render_latex_png("x^2", 12, False, 72)
+    return png_bytes is not None
+
+def render_latex_to_image(latex_str, font_size_pt=12, is_display=False, dpi=EQUATION_DPI):
+    """Renders LaTeX string to an image stream, reusing cached renders when possible."""
+    png_bytes, height_in, width_in, descent_in = get_equation_image(latex_str, font_size_pt, is_display, dpi)
+    if png_bytes is None:
+        return None, 0, 0, 0
+    return io.BytesIO(png_bytes), height_in, width_in, descent_in
+
+def get_equation_image(latex_str, font_size_pt=12, is_display=False, dpi=EQUATION_DPI):
+    """
+    Return (png_bytes, height_in, width_in, descent_in) for a LaTeX fragment.
+    Results (including failures) are stored in EQUATION_CACHE keyed by the
+    normalized source, font size, display mode and DPI.
+    """
+    key = equation_key(latex_str, font_size_pt, is_display, dpi)
+    cached = EQUATION_CACHE.get(key)
+    if cached is not None:
+        payload, meta = cached
+        if not meta.get("ok"):
+            return None, 0, 0, 0
+        return payload, meta["height"], meta["width"], meta["descent"]
+
+    png_bytes, height_in, width_in, descent_in = _render_latex_png(normalize_latex(latex_str), font_size_pt, is_display, dpi)
+    if png_bytes is None:
+        EQUATION_CACHE.put(key, b"", {"ok": False})
+    else:
+        EQUATION_CACHE.put(key, png_bytes, {"ok": True, "height": height_in, "width": width_in, "descent": descent_in})
+    return png_bytes, height_in, width_in, descent_in
+
+def _render_latex_png(latex_str, font_size_pt, is_display, dpi):
+    """Renders LaTeX string to PNG bytes using matplotlib."""
+    plt = _pyplot()
+    try:
+        # Configure Matplotlib to use STIX (Times-like) for Math
+        plt.rcParams['mathtext.fontset'] = 'stix'
+        plt.rcParams['font.family'] = 'Times New Roman'
+        
+        # Create figure
+        fig = plt.figure(figsize=(8, 2), dpi=dpi)
+        fig.patch.set_alpha(0)
+        
+        # Clean up LaTeX
+        render_str = latex_str.strip()
+        if render_str.startswith('$$') and render_str.endswith('$$'):
+            render_str = render_str[2:-2]
+        elif render_str.startswith('$') and render_str.endswith('$'):
+            render_str = render_str[1:-1]
+        
+        # Check for unsupported LaTeX environments - return None to trigger fallback
+        pattern = find_unsupported_pattern(render_str)
+        if pattern is not None:
+            print(f"Unsupported LaTeX pattern detected: {pattern} in '{render_str[:50]}...'")
+            plt.close(fig)
+            return None, 0, 0, 0
+            
+        # Fix common LaTeX commands
+        render_str = re.sub(r'\\displaystyle\s*', '', render_str)
+        render_str = re.sub(r'\\textstyle\s*', '', render_str)
+        render_str = re.sub(r'\\ge(?![a-zA-Z])', r'\\geq', render_str)
+        render_str = re.sub(r'\\le(?![a-zA-Z])', r'\\leq', render_str)
+        render_str = re.sub(r'\\text\{', r'\\mathrm{', render_str)
+        render_str = render_str.replace(r'\{', r'\lbrace ')
+        render_str = render_str.replace(r'\}', r'\rbrace ')
+        render_str = re.sub(r'\\arg(?![a-zA-Z])', r'\\mathrm{arg}', render_str)
+        render_str = re.sub(r'\\max(?![a-zA-Z])', r'\\mathrm{max}', render_str)
+        render_str = re.sub(r'\\min(?![a-zA-Z])', r'\\mathrm{min}', render_str)
+        
+        render_str = f"${render_str}$"
+            
+        # Adjust font size to match document text
+        effective_font_size = font_size_pt * 0.65  # Inline math smaller to match text height
+        if is_display:
+            effective_font_size = font_size_pt * 0.60  # Display math also smaller
+            
+        # Draw text with baseline alignment for accurate descent calculation
+        text = fig.text(0.5, 0.5, render_str, fontsize=effective_font_size, ha='center', va='baseline')
+        
+        # Get bounding box
+        renderer = fig.canvas.get_renderer()
+        bbox = text.get_window_extent(renderer=renderer)
+        
+        # Calculate dimensions
+        width_in = bbox.width / dpi
+        height_in = bbox.height / dpi
+        
+        # Calculate descent (distance from baseline to bottom)
+        # Baseline is at 0.5 * fig_height_in_pixels
+        fig_height_px = fig.get_window_extent().height
+        baseline_y = 0.5 * fig_height_px
+        descent_px = baseline_y - bbox.y0
+        descent_in = descent_px / dpi
+        
+        # Save with tight bounding box to eliminate whitespace
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', pad_inches=0.01, transparent=True)
+        plt.close(fig)
+        
+        # Plain floats (matplotlib's are numpy.float64): fresh and cached renders must match exactly
+        return buf.getvalue(), float(height_in), float(width_in), float(descent_in)
+        
+    except Exception as e:
+        print(f"Error rendering LaTeX: {e}")
+        traceback.print_exc()
+        try: plt.close(fig)
+        except: pass
+        return None, 0, 0, 0
+
+def limit_render_workers(workers: int):
+    """Cap this process's equation pool (export workers share the cores between their pools)."""
+    global EQUATION_WORKERS
+    EQUATION_WORKERS = max(1, min(EQUATION_WORKERS, workers))
+
+def _get_render_pool():
+    global _RENDER_POOL
+    if _RENDER_POOL is None:
+        # Spawn instead of fork: the server process may already run threads
+        ctx = multiprocessing.get_context("spawn")
+        _RENDER_POOL = ProcessPoolExecutor(max_workers=EQUATION_WORKERS, mp_context=ctx)
+    return _RENDER_POOL
+
+def _render_worker(item):
+    """Runs in a pool process: render one equation (filling the shared disk cache)."""
+    latex_str, font_size_pt, is_display, dpi = item
+    return get_equation_image(latex_str, font_size_pt, is_display, dpi)
+
+def prerender_equations(fragments, font_size_pt=12, dpi=EQUATION_DPI):
+    """
+    Render every unique (latex, is_display) fragment that is not cached yet.
+    Large batches are spread across a process pool; afterwards each
+    render_latex_to_image call during assembly is a cache lookup.
+    Returns the number of equations actually rendered (cache hits not counted).
+    """
+    pending = {}
+    for latex_str, is_display in fragments:
+        key = equation_key(latex_str, font_size_pt, is_display, dpi)
+        # Both tiers: equations already on disk (rendered by another process) need no pool
+        if key not in pending and EQUATION_CACHE.get(key) is None:
+            pending[key] = (latex_str, font_size_pt, is_display, dpi)
+    if not pending:
+        return 0
+
+    items = list(pending.items())
+    results = map_in_render_pool(_render_worker, [item for _, item in items])
+    for (key, _), (png_bytes, height_in, width_in, descent_in) in zip(items, results):
+        # Workers already wrote the disk cache; only warm our in-process LRU
+        if png_bytes is None:
+            EQUATION_CACHE.memory.put(key, (b"", {"ok": False}))
+        else:
+            EQUATION_CACHE.memory.put(key, (png_bytes, {"ok": True, "height": height_in, "width": width_in, "descent": descent_in}))
+    return len(items)
+
+def map_in_render_pool(fn, items):
+    """
+    [fn(item) for item in items], spread across the equation render pool.
+    Small batches (and a broken pool) run in this process instead.
+    """
+    global _RENDER_POOL
+    if len(items) < EQUATION_PARALLEL_THRESHOLD or EQUATION_WORKERS <= 1:
+        return [fn(item) for item in items]
+    try:
+        chunksize = max(1, len(items) // (EQUATION_WORKERS * 4))
+        return list(_get_render_pool().map(fn, items, chunksize=chunksize))
+    except (BrokenProcessPool, OSError) as e:
+        print(f"Warning: equation render pool failed ({e}), rendering sequentially")
+        _RENDER_POOL = None
+        return [fn(item) for item in items]
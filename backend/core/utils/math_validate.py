@@ -0,0 +1,81 @@
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+from core.config import EQUATION_DPI, MATH_VERDICT_CACHE_ITEMS
+from core.utils.cache import LRUCache
+from core.utils.markdown_ast import MathSpan, Paragraph, BulletItem, iter_located_blocks
+from core.utils.math_cache import normalize_latex
+from core.utils.math_render import find_unsupported_pattern, get_equation_image, map_in_render_pool
+from core.utils.omml_xslt import get_mathml_to_omml_xslt
+
+# (normalized LaTeX, rendered as display image) -> verdict dict
+VERDICT_CACHE = LRUCache(MATH_VERDICT_CACHE_ITEMS)
+
+
+@dataclass
+class EquationRef:
+    latex: str
+    display: bool = False
+    # Equations in bullets are always drawn as inline images
+    in_bullet: bool = False
+    line: Optional[int] = None
+
+
+def find_equations(text: str) -> List[EquationRef]:
+    """Every equation the export will render, with the index of its source line."""
+    equations = []
+    for line, block in iter_located_blocks(text.split("\n")):
+        if isinstance(block, (Paragraph, BulletItem)):
+            in_bullet = isinstance(block, BulletItem)
+            equations.extend(EquationRef(span.latex, span.display, in_bullet, line)
+                             for span in block.inlines if isinstance(span, MathSpan))
+    return equations
+
+
+def _validate_worker(item):
+    """Runs in a render pool process: try the OMML conversion and the raster render of one equation."""
+    latex, display, font_size_pt, dpi, check_omml = item
+    omml = None
+    if check_omml:
+        # Imported here: only the pool processes need the Word stack
+        from core.utils.export_docx import latex_to_omml
+        omml = latex_to_omml(latex) is not None
+    # Renders at the export's size and resolution, so the export finds it cached
+    image = get_equation_image(latex, font_size_pt, display, dpi)[0] is not None
+    return omml, image
+
+
+def _status(verdict: dict, in_bullet: bool) -> str:
+    """What the Word export does with the equation: native equation, image, or "[công thức]"."""
+    if verdict["omml"] and not in_bullet:
+        return "omml"
+    return "image" if verdict["image"] else "fallback"
+
+
+def validate_equations(equations: List[EquationRef], font_size_pt: int = 13, dpi: int = EQUATION_DPI) -> dict:
+    """
+    Run every equation through the export's pipeline (MathML -> OMML, and the
+    matplotlib raster render used for bullets, PDF and as the Word fallback),
+    unseen sources in parallel in the equation render pool. Verdicts are cached
+    by normalized source. Returns {"equations": [...], "summary": {status: count}}.
+    """
+    check_omml = get_mathml_to_omml_xslt() is not None
+    keys = [(normalize_latex(eq.latex), eq.display and not eq.in_bullet) for eq in equations]
+    pending = {}
+    for key in keys:
+        if key not in pending and VERDICT_CACHE.get(key) is None:
+            pending[key] = (key[0], key[1], font_size_pt, dpi, check_omml)
+    results = map_in_render_pool(_validate_worker, list(pending.values()))
+    for key, (omml, image) in zip(pending, results):
+        VERDICT_CACHE.put(key, {"omml": omml, "image": image, "pattern": find_unsupported_pattern(key[0])})
+
+    report = []
+    for eq, key in zip(equations, keys):
+        verdict = VERDICT_CACHE.get(key)
+        if verdict is None:
+            # Evicted by a large batch; check it again here
+            omml, image = _validate_worker((key[0], key[1], font_size_pt, dpi, check_omml))
+            verdict = {"omml": omml, "image": image, "pattern": find_unsupported_pattern(key[0])}
+        report.append({"latex": eq.latex, "display": eq.display, "line": eq.line,
+                       "status": _status(verdict, eq.in_bullet), **verdict})
+    return {"equations": report, "summary": dict(Counter(item["status"] for item in report))}
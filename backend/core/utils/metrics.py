@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Latency buckets (seconds): sub-millisecond phases up to multi-minute exports
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Seconds between writes of a server process's metrics to the shared directory
+FLUSH_INTERVAL = 1.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+    # Whether the values of a server process that has exited still count (see MetricsRegistry)
+    keep_dead = True
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def collect(self):
+        """A copy of the current values."""
+        with self._lock:
+            return self._collect()
+
+    def render(self, others=()):
+        """Exposition lines, adding the values of other processes (as returned by dump) to this one's."""
+        values = self.collect()
+        for state in others:
+            values = self._merge(values, self.load(state))
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples(values)
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _collect(self):
+        return dict(self._values)
+
+    def dump(self, values):
+        return [[list(k), v] for k, v in values.items()]
+
+    def load(self, state):
+        return {tuple(k): v for k, v in state}
+
+    def _merge(self, values, other):
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+        return values
+
+    def _samples(self, values):
+        return [f"{self.name}{_label_str(self.label_names, k)} {_fmt(v)}" for k, v in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """Value read at scrape time from a callback."""
+    kind = "gauge"
+    keep_dead = False
+
+    def __init__(self, name, help_text, read):
+        super().__init__(name, help_text)
+        self._read = read
+
+    def _collect(self):
+        return self._read()
+
+    def dump(self, value):
+        return value
+
+    def load(self, state):
+        return state
+
+    def _merge(self, value, other):
+        return value + other
+
+    def _samples(self, value):
+        return [f"{self.name} {_fmt(value)}"]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram (Prometheus semantics), optionally split by labels."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count], sum
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _collect(self):
+        return {key: [list(counts), total] for key, (counts, total) in self._series.items()}
+
+    def dump(self, series):
+        return [[list(k), counts, total] for k, (counts, total) in series.items()]
+
+    def load(self, state):
+        return {tuple(k): [counts, total] for k, counts, total in state if len(counts) == len(self.buckets) + 1}
+
+    def _merge(self, series, other):
+        for key, (counts, total) in other.items():
+            mine = series.get(key)
+            if mine is None:
+                series[key] = [list(counts), total]
+            else:
+                mine[0] = [a + b for a, b in zip(mine[0], counts)]
+                mine[1] += total
+        return series
+
+    def _samples(self, series):
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_str(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.label_names, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process. With several server processes (--workers N),
+    each one sharing a directory (enable_multiprocess) writes its values there
+    every FLUSH_INTERVAL seconds, and whichever process answers the scrape adds
+    up all of them, like prometheus_client's multiprocess mode. Counters and
+    histograms of exited processes keep counting; gauges only of live ones.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._dir = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def enable_multiprocess(self, directory: str):
+        """Share this process's values through `directory` (cleared by the parent before workers start)."""
+        os.makedirs(directory, exist_ok=True)
+        self._dir = directory
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to the shared directory (no-op without one)."""
+        if self._dir is None:
+            return
+        state = {m.name: m.dump(m.collect()) for m in self._metrics}
+        path = os.path.join(self._dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as e:
+            print(f"Warning: cannot write metrics to {path}: {e}")
+
+    def _other_processes(self):
+        """(pid alive, values by metric name) for every other process in the shared directory."""
+        try:
+            names = os.listdir(self._dir)
+        except OSError:
+            return []
+        others = []
+        for name in names:
+            pid, ext = os.path.splitext(name)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self._dir, name), encoding="utf-8") as f:
+                    others.append((_pid_alive(int(pid)), json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return others
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        others = self._other_processes() if self._dir is not None else []
+        lines = []
+        for metric in self._metrics:
+            states = [state[metric.name] for alive, state in others
+                      if metric.name in state and (alive or metric.keep_dead)]
+            try:
+                lines.extend(metric.render(states))
+            except (TypeError, ValueError):
+                # A file from an older layout of this metric
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- EXPORT METRICS ---
+EXPORT_DURATION = REGISTRY.register(Histogram(
+    "grad_helper_export_duration_seconds",
+    "Export time from submission to finished file.", ["result"]))
+EXPORT_PHASE_DURATION = REGISTRY.register(Histogram(
+    "grad_helper_export_phase_duration_seconds",
+    "Time spent in each export phase (queue wait, parse, styles, equations, ...).", ["phase"]))
+EXPORTS_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_exports_total", "Exports by outcome (ok, failed, cache_hit).", ["result"]))
+EQUATIONS_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_equations_total",
+    "Equations by outcome: omml, image or fallback (placeholder text) when inserted; "
+    "rendered or cached for the LaTeX rasterizer.", ["outcome"]))
+CHAPTERS_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_chapters_total", "Chapters built from scratch or restored from the fragment cache.", ["source"]))
+IMAGES_EMBEDDED_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_images_embedded_total", "Figure images embedded into exported documents."))
+TABLES_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_tables_total", "Tables built in exported documents."))
+HARD_WRAP_SKIPPED_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_hard_wrap_skipped_total",
+    "Exports asking for locked line breaks that were written without (no metric-compatible font)."))
+BYTES_WRITTEN_TOTAL = REGISTRY.register(Counter(
+    "grad_helper_export_bytes_written_total", "Bytes of exported documents (.docx, .pdf) written."))
+
+# --- HTTP METRICS ---
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "grad_helper_http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]))
+
+# Export counters (as filled in by export_to_docx) -> (metric, labels)
+_COUNTER_METRICS = {
+    "equations_omml": (EQUATIONS_TOTAL, {"outcome": "omml"}),
+    "equations_image": (EQUATIONS_TOTAL, {"outcome": "image"}),
+    "equations_fallback": (EQUATIONS_TOTAL, {"outcome": "fallback"}),
+    "equations_rendered": (EQUATIONS_TOTAL, {"outcome": "rendered"}),
+    "equations_cached": (EQUATIONS_TOTAL, {"outcome": "cached"}),
+    "chapters_rendered": (CHAPTERS_TOTAL, {"source": "rendered"}),
+    "chapters_cached": (CHAPTERS_TOTAL, {"source": "cached"}),
+    "images_embedded": (IMAGES_EMBEDDED_TOTAL, {}),
+    "tables": (TABLES_TOTAL, {}),
+    "hard_wrap_skipped": (HARD_WRAP_SKIPPED_TOTAL, {}),
+    "bytes_written": (BYTES_WRITTEN_TOTAL, {}),
+}
+
+
+def record_export(result: str, duration: float, timings: dict = None, counters: dict = None):
+    """Record one finished export (result: ok, failed or cache_hit)."""
+    EXPORTS_TOTAL.inc(result=result)
+    EXPORT_DURATION.observe(duration, result=result)
+    for phase, seconds in (timings or {}).items():
+        EXPORT_PHASE_DURATION.observe(seconds, phase=phase)
+    for name, value in (counters or {}).items():
+        metric = _COUNTER_METRICS.get(name)
+        if metric is not None and value:
+            metric[0].inc(value, **metric[1])
+
+
+class PhaseTimer:
+    """Accumulates wall time per export phase into a caller-supplied dict (no-op for None)."""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """Charge the time since the previous mark to `phase`."""
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self._last
+        self._last = now
+
+
+def server_timing_header(timings: dict, total: float = None, desc: str = None) -> str:
+    """Format phase timings (seconds) as a Server-Timing header value (milliseconds)."""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    if total is not None:
+        total_part = f"total;dur={total * 1000:.1f}"
+        if desc:
+            total_part += f';desc="{desc}"'
+        parts.append(total_part)
+    return ", ".join(parts)
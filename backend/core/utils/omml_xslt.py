@@ -0,0 +1,39 @@
+import os
+from lxml import etree
+from core.config import MML2OMML_XSL_PATH
+
+# XSLT to convert MathML to OMML (Word's equation format)
+MATHML_TO_OMML_XSLT = None
+_XSLT_PROBED = False
+
+def load_mathml_to_omml_xslt():
+    """Probe the filesystem for MML2OMML.XSL and compile it. Call once at startup."""
+    global MATHML_TO_OMML_XSLT, _XSLT_PROBED
+    # This XSLT is bundled with Microsoft Office
+    # On Mac, it's typically at this location
+    xslt_paths = [
+        "/Applications/Microsoft Word.app/Contents/Resources/MML2OMML.XSL",
+        "/Applications/Microsoft Office/Microsoft Word.app/Contents/Resources/MML2OMML.XSL",
+        # Fallback for different Office versions
+        os.path.expanduser("~/Applications/Microsoft Word.app/Contents/Resources/MML2OMML.XSL"),
+    ]
+    if MML2OMML_XSL_PATH:
+        xslt_paths.insert(0, MML2OMML_XSL_PATH)
+    
+    for xslt_path in xslt_paths:
+        if os.path.exists(xslt_path):
+            xslt_doc = etree.parse(xslt_path)
+            MATHML_TO_OMML_XSLT = etree.XSLT(xslt_doc)
+            print(f"Loaded MML2OMML.XSL from: {xslt_path}")
+            break
+    
+    if MATHML_TO_OMML_XSLT is None:
+        print("Warning: MML2OMML.XSL not found. LaTeX equations will use fallback image rendering.")
+    _XSLT_PROBED = True
+    return MATHML_TO_OMML_XSLT
+
+def get_mathml_to_omml_xslt():
+    """Return the compiled MathML to OMML XSLT stylesheet (probed only once per process)."""
+    if not _XSLT_PROBED:
+        load_mathml_to_omml_xslt()
+    return MATHML_TO_OMML_XSLT
@@ -0,0 +1,412 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Sequence
+from PIL import Image
+from core.models.data_classes import Settings, Figure
+from core.utils.font_metrics import face_metrics
+from core.utils.line_breaking import LineBreaker, TextRun
+from core.utils.helpers import advance_heading_counts, heading_title
+from core.utils.image_prep import figure_key, index_figures, figure_width_cm
+from core.utils.math_cache import normalize_latex
+from core.utils.markdown_ast import (
+    MathSpan, Heading, Paragraph, BulletItem, TableBlock, TableCaption, FigureRef,
+)
+
+# Layout estimate of the .docx output: page numbers for the TOC and the lists
+# of figures/tables. The numbers below mirror setup_styles in export_docx.
+
+PT_PER_CM = 72 / 2.54
+PAGE_WIDTH_CM = 21.0
+PAGE_HEIGHT_CM = 29.7
+TOC_LEVELS = 3
+
+NORMAL_SPACE_AFTER = 8.5
+# style -> (space before, space after) in points
+HEADING_SPACING = {1: (24, 18), 2: (18, 12), 3: (12, 6), 4: (6, 6), 5: (6, 6)}
+FRONT_HEADING_SPACING = (24, 18)
+FIGURE_CAPTION_SPACING = (6, 12)
+TABLE_CAPTION_SPACING = (12, 6)
+EQUATION_SPACING = (6, 6)
+H5_LEFT_INDENT_CM = 0.63
+BULLET_HANGING_CM = 0.5
+BULLET_LEVEL_INDENT_CM = 0.75
+# TOC entry styles (toc 1-3): left indent per level, no first-line indent
+TOC_LEVEL_INDENT_CM = 0.5
+TOC_SPACE_AFTER = 4
+# Room kept free for the page number after the dot leader
+TOC_PAGE_NUMBER_CM = 1.0
+# Word's default left/right cell margins in "Table Grid"
+CELL_MARGIN_CM = 0.19
+
+# Inline equation width per visible symbol, in em
+MATH_SYMBOL_EM = 0.55
+_TALL_MATH_RE = re.compile(r"\\(d?frac|sum|int|prod|lim|begin|over|sqrt)")
+_LATEX_COMMAND_RE = re.compile(r"\\[A-Za-z]+")
+_LATEX_SYNTAX_RE = re.compile(r"[{}^_\\\s]")
+
+_EPS = 1e-6
+
+
+@dataclass
+class TocEntry:
+    level: int
+    text: str
+    page: int = 0
+
+
+@dataclass
+class DocumentLayout:
+    """Estimated pagination of an exported document (absolute page numbers, first page = 1)."""
+    headings: List[TocEntry] = field(default_factory=list)
+    figures: List[TocEntry] = field(default_factory=list)
+    tables: List[TocEntry] = field(default_factory=list)
+    front_pages: int = 0
+    pages: int = 0
+
+
+class _Pager:
+    """Stacks content top to bottom on fixed-height pages (all values in points)."""
+
+    def __init__(self, height: float):
+        self.height = height
+        self.page = 1
+        self.y = 0.0
+
+    def page_break(self):
+        self.page += 1
+        self.y = 0.0
+
+    def _top(self, before: float) -> float:
+        # Word drops the space before a paragraph at the top of a page
+        return self.y + before if self.y > 0 else 0.0
+
+    def lines(self, count: int, line_height: float, before: float = 0.0, after: float = 0.0,
+              keep_together: bool = False, keep_next: float = 0.0) -> int:
+        """
+        Place a paragraph of `count` lines and return the page of its first line.
+        Paragraphs split across pages with widow/orphan control (at least two
+        lines on each side); `keep_together` paragraphs never split, and
+        `keep_next` is room that must stay free below them (keep with next).
+        """
+        top = self._top(before)
+        room = self.height - top
+        if count * line_height + keep_next <= room + _EPS:
+            self.y = top + count * line_height + after
+            return self.page
+        fit = int((room + _EPS) // line_height)
+        if keep_together or count - fit < 2:
+            fit = 0 if keep_together else count - 2
+        if fit < 2 and self.y > 0:
+            self.page_break()
+            return self.lines(count, line_height, before, after, keep_together, keep_next)
+        fit = max(fit, 1)
+        first_page = self.page
+        remaining = count - fit
+        per_page = max(1, int((self.height + _EPS) // line_height))
+        while remaining > 0:
+            self.page_break()
+            take = min(remaining, per_page)
+            self.y = take * line_height
+            remaining -= take
+        self.y += after
+        return first_page
+
+    def block(self, height: float, before: float = 0.0, after: float = 0.0) -> int:
+        """Place something that cannot split (picture, equation, table row); returns its first page."""
+        top = self._top(before)
+        if top + height > self.height + _EPS and self.y > 0:
+            self.page_break()
+            top = 0.0
+        first_page = self.page
+        self.y = top + height
+        while self.y > self.height + _EPS:
+            # Taller than a page: it runs on, count the pages it covers
+            self.page += 1
+            self.y -= self.height
+        self.y += after
+        return first_page
+
+
+# Layout operations, recorded while walking the blocks and replayed on a _Pager
+# once all their lines have been broken:
+#   (_LINES, job, line_height, before, after, keep_together, keep_next, entry)
+#   (_ROW, jobs, line_height, extra)
+#   (_BLOCK, height, before, after)
+#   (_BREAK,)
+_LINES, _ROW, _BLOCK, _BREAK = range(4)
+
+
+class _Estimator:
+    """Turns blocks into layout operations, measured the way export_docx lays them out."""
+
+    def __init__(self, settings: Settings, figures: Sequence[Figure]):
+        self.settings = settings
+        scale = settings.page_content_scale or 1.0
+        self.width = (PAGE_WIDTH_CM - settings.margin_left - settings.margin_right) * PT_PER_CM * scale
+        self.height = (PAGE_HEIGHT_CM - settings.margin_top - settings.margin_bottom) * PT_PER_CM * scale
+        self.indent = settings.indent * PT_PER_CM
+        self.single_line = face_metrics(settings.font_family).line_height
+        self.breaker = LineBreaker(settings.font_family, settings.text_density or 1.0)
+        self.figure_index = index_figures(list(figures or []))
+        self.counts = [0, 0, 0, 0, 0]
+
+    def line_height(self, size: float) -> float:
+        s = self.settings
+        return self.single_line * size * s.line_spacing * (s.line_height_scale or 1.0)
+
+    def _math_width(self, latex: str, size: float) -> float:
+        # Equations are not rendered here: count their visible symbols
+        source = _LATEX_COMMAND_RE.sub("x", normalize_latex(latex))
+        return max(1, len(_LATEX_SYNTAX_RE.sub("", source))) * MATH_SYMBOL_EM * size
+
+    def _runs(self, inlines, size: float) -> List[TextRun]:
+        runs = []
+        for span in inlines:
+            if isinstance(span, MathSpan):
+                runs.append(TextRun("\ufffc", size, width=self._math_width(span.latex, size)))
+            else:
+                runs.append(TextRun(span.text, size, span.bold, span.italic))
+        return runs
+
+    def text(self, ops, text: str, size: float, spacing, bold=False, italic=False, left: float = 0.0,
+             first_indent: Optional[float] = None, keep_together=False, keep_next=0.0, entry=None):
+        """A paragraph of plain text in one face (headings, captions, TOC entries)."""
+        width = self.width - left
+        first = width - (self.indent if first_indent is None else first_indent)
+        job = self.breaker.add([TextRun(text, size, bold, italic)], first, width)
+        ops.append((_LINES, job, self.line_height(size), *spacing, keep_together, keep_next, entry))
+
+    def empty_paragraph(self, ops):
+        self.text(ops, "", self.settings.font_size, (0, NORMAL_SPACE_AFTER))
+
+    def table_rows(self, ops, rows: Sequence[Sequence[str]], cols: int):
+        size = self.settings.font_size
+        cell = self.width / cols - 2 * CELL_MARGIN_CM * PT_PER_CM
+        for r, row in enumerate(rows):
+            # Cell paragraphs are Normal: first-line indent and space after included
+            jobs = [self.breaker.add([TextRun(text, size, r == 0)], cell - self.indent, cell)
+                    for text in row[:cols]]
+            ops.append((_ROW, jobs, self.line_height(size), NORMAL_SPACE_AFTER))
+
+    # --- body blocks ---
+
+    def heading(self, ops, block: Heading, layout: DocumentLayout):
+        s = self.settings
+        level = block.level
+        advance_heading_counts(self.counts, level)
+        title = heading_title(s, self.counts, level, block.text)
+        size, bold, italic = {
+            1: (s.h1_size, True, False),
+            2: (s.h2_size, True, False),
+            3: (s.h3_size, True, True),
+            4: (s.font_size, True, True),
+            5: (s.font_size, False, True),
+        }[level]
+        entry = None
+        if level <= TOC_LEVELS:
+            entry = TocEntry(level, title.replace("\n", " "))
+            layout.headings.append(entry)
+        before, after = HEADING_SPACING[level]
+        # Heading styles keep with the next paragraph: leave room for its first two lines
+        keep_next = after + 2 * self.line_height(s.font_size)
+        left = H5_LEFT_INDENT_CM * PT_PER_CM if level == 5 else 0.0
+        self.text(ops, title, size, (before, after), bold, italic, left=left,
+                  keep_together=True, keep_next=keep_next, entry=entry)
+
+    def paragraph_job(self, inlines) -> int:
+        """Queue a Normal paragraph's text (first-line indent, full width)."""
+        size = self.settings.font_size
+        return self.breaker.add(self._runs(inlines, size), self.width - self.indent, self.width)
+
+    def bullet_job(self, block: BulletItem) -> int:
+        """Queue a bullet's text; the bullet and its tab sit in the hanging indent."""
+        s = self.settings
+        width = self.width - (s.indent + (block.level - 1) * BULLET_LEVEL_INDENT_CM + BULLET_HANGING_CM) * PT_PER_CM
+        return self.breaker.add(self._runs(block.inlines, s.font_size), width, width)
+
+    def paragraph(self, ops, block: Paragraph):
+        line = self.line_height(self.settings.font_size)
+        segments = text_segments(block.inlines)
+        for i, segment in enumerate(segments):
+            if i:
+                # The display equation before this segment
+                rows = 2 if _TALL_MATH_RE.search(segment.equation) else 1
+                ops.append((_BLOCK, rows * line, *EQUATION_SPACING))
+            if segment.inlines or len(segments) == 1:
+                job = self.paragraph_job(segment.inlines)
+                ops.append((_LINES, job, line, 0, NORMAL_SPACE_AFTER, False, 0.0, None))
+
+    def bullet(self, ops, block: BulletItem):
+        line = self.line_height(self.settings.font_size)
+        ops.append((_LINES, self.bullet_job(block), line, 0, NORMAL_SPACE_AFTER, False, 0.0, None))
+
+    def table_caption(self, ops, text: str, layout: DocumentLayout):
+        entry = TocEntry(1, text)
+        layout.tables.append(entry)
+        self.text(ops, text, self.settings.font_size, TABLE_CAPTION_SPACING, bold=True, entry=entry)
+
+    def table(self, ops, block: TableBlock, layout: DocumentLayout):
+        self.empty_paragraph(ops)
+        self.table_rows(ops, block.rows, len(block.rows[0]))
+        if block.caption:
+            self.table_caption(ops, block.caption, layout)
+        self.empty_paragraph(ops)
+
+    def figure(self, ops, block: FigureRef, layout: DocumentLayout):
+        s = self.settings
+        fig = self.figure_index.get(figure_key(block.number))
+        if fig is not None and not fig.path:
+            return
+        size = _image_size(os.path.abspath(fig.path)) if fig is not None else None
+        if size is None:
+            # export_docx writes a one-line "not found" note instead
+            self.empty_paragraph(ops)
+            return
+        width = figure_width_cm(fig) * PT_PER_CM
+        # An inline picture sets its line's height, and "multiple" line spacing scales that too
+        height = width * size[1] / size[0] * s.line_spacing * (s.line_height_scale or 1.0)
+        ops.append((_BLOCK, min(height, self.height), 0, NORMAL_SPACE_AFTER))
+        text = f"{block.number}: {block.caption}"
+        entry = TocEntry(1, text)
+        layout.figures.append(entry)
+        self.text(ops, text, s.font_size, FIGURE_CAPTION_SPACING, italic=True, entry=entry)
+
+    # --- front matter ---
+
+    def front_heading(self, ops, text: str):
+        self.text(ops, text, self.settings.h1_size, FRONT_HEADING_SPACING, bold=True)
+
+    def toc_entries(self, ops, entries: Sequence[TocEntry]):
+        for entry in entries:
+            left = (entry.level - 1) * TOC_LEVEL_INDENT_CM * PT_PER_CM
+            self.text(ops, entry.text, self.settings.font_size, (0, TOC_SPACE_AFTER),
+                      left=left + TOC_PAGE_NUMBER_CM * PT_PER_CM, first_indent=0.0)
+
+
+class TextSegment(NamedTuple):
+    # Display equation in front of the segment ("" for the first one)
+    equation: str
+    inlines: list
+
+
+def text_segments(inlines) -> List[TextSegment]:
+    """Split a paragraph's inlines at its display equations, which export_docx sets on their own lines."""
+    segments = [TextSegment("", [])]
+    for span in inlines:
+        if isinstance(span, MathSpan) and span.display:
+            segments.append(TextSegment(span.latex, []))
+        else:
+            segments[-1].inlines.append(span)
+    return segments
+
+
+def hard_wrap_lines(blocks, settings: Settings) -> Dict[int, List[List[int]]]:
+    """
+    Where the lines of every paragraph and bullet in `blocks` start, keyed by
+    id(block): one list of offsets per text segment (see text_segments), each
+    offset counting characters of the segment's text with one per inline
+    equation. Used to lock the line breaks of the .docx (settings.hard_wrap).
+    """
+    est = _Estimator(settings, ())
+    jobs = {}
+    for block in blocks:
+        if isinstance(block, Paragraph):
+            jobs[id(block)] = [est.paragraph_job(seg.inlines) for seg in text_segments(block.inlines)]
+        elif isinstance(block, BulletItem):
+            jobs[id(block)] = [est.bullet_job(block)]
+    lines = est.breaker.run()
+    return {key: [lines[job] for job in block_jobs] for key, block_jobs in jobs.items()}
+
+
+def _image_size(path: str) -> Optional[tuple]:
+    """Pixel size from the image header (the file is not decoded)."""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except (OSError, ValueError):
+        return None
+    return (width, height) if width and height else None
+
+
+def _replay(ops, lines: List[List[int]], height: float) -> int:
+    """Lay the operations out on pages; fills in the entries' pages and returns the page count."""
+    pager = _Pager(height)
+    for op in ops:
+        kind = op[0]
+        if kind == _LINES:
+            _, job, line_height, before, after, keep_together, keep_next, entry = op
+            page = pager.lines(len(lines[job]), line_height, before, after, keep_together, keep_next)
+            if entry is not None:
+                entry.page = page
+        elif kind == _ROW:
+            _, jobs, line_height, extra = op
+            pager.block(max(len(lines[job]) for job in jobs) * line_height + extra)
+        elif kind == _BLOCK:
+            pager.block(*op[1:])
+        else:
+            pager.page_break()
+    return pager.page
+
+
+def estimate_layout(blocks, settings: Settings, figures: Sequence[Figure] = (),
+                    abbreviations: Sequence[dict] = None) -> DocumentLayout:
+    """
+    Paginate the document export_to_docx builds from `blocks`: the front matter
+    (table of contents, lists of figures and tables, abbreviations) and the
+    body, measuring text with the font's glyph widths. Returns the TOC and
+    list entries with their estimated page numbers.
+
+    The calibration settings apply as in the preview: text_density scales the
+    measured text widths, line_height_scale the line height and
+    page_content_scale the usable page area.
+    """
+    est = _Estimator(settings, figures)
+    layout = DocumentLayout()
+    body = []
+    for block in blocks:
+        if isinstance(block, Heading):
+            est.heading(body, block, layout)
+        elif isinstance(block, Paragraph):
+            est.paragraph(body, block)
+        elif isinstance(block, BulletItem):
+            est.bullet(body, block)
+        elif isinstance(block, TableBlock):
+            est.table(body, block, layout)
+        elif isinstance(block, TableCaption):
+            est.table_caption(body, block.text, layout)
+        elif isinstance(block, FigureRef):
+            est.figure(body, block, layout)
+
+    # Front matter, in export_to_docx's order; each part ends with a page break
+    front = []
+    est.front_heading(front, "MỤC LỤC")
+    est.toc_entries(front, layout.headings)
+    if figures:
+        front.append((_BREAK,))
+        est.front_heading(front, "DANH MỤC HÌNH ẢNH")
+        est.toc_entries(front, layout.figures)
+    if layout.tables:
+        front.append((_BREAK,))
+        est.front_heading(front, "DANH MỤC BẢNG BIỂU")
+        est.toc_entries(front, layout.tables)
+    if abbreviations:
+        front.append((_BREAK,))
+        est.front_heading(front, "DANH MỤC CÁC CHỮ VIẾT TẮT VÀ KÝ HIỆU")
+        for kind, title in (("abbreviation", "Chữ viết tắt"), ("symbol", "Ký hiệu")):
+            items = [a for a in abbreviations if a.get('type') == kind]
+            if not items:
+                continue
+            est.text(front, title, settings.font_size, (0, NORMAL_SPACE_AFTER), bold=True)
+            rows = [[title, "Diễn giải đầy đủ"]]
+            rows += [[a.get('abbreviation', ''), a.get('fullForm', '')] for a in items]
+            est.table_rows(front, rows, 2)
+            if kind == "abbreviation":
+                est.empty_paragraph(front)
+
+    lines = est.breaker.run()
+    layout.front_pages = _replay(front, lines, est.height)
+    layout.pages = layout.front_pages + _replay(body, lines, est.height)
+    for entry in layout.headings + layout.figures + layout.tables:
+        entry.page += layout.front_pages
+    return layout
@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import threading
+import importlib.util
+from typing import Dict, Optional, Tuple
+from core.config import PDF_FONT_DIR
+
+STYLES = ("regular", "bold", "italic", "bolditalic")
+
+# File name endings of each style (after the family name, lowercase, letters only):
+# "LiberationSerif-BoldItalic.ttf", "Times New Roman Bold.ttf", "timesbd.ttf", ...
+_STYLE_SUFFIXES = {
+    "regular": ("", "regular", "roman", "book"),
+    "bold": ("bold", "bd"),
+    "italic": ("italic", "oblique", "i"),
+    "bolditalic": ("bolditalic", "boldoblique", "bi", "z"),
+}
+
+# Metric-compatible substitutes tried when a family itself is not installed
+_FAMILY_ALIASES = {
+    "timesnewroman": ("times", "liberationserif", "tinos"),
+    "arial": ("liberationsans", "arimo"),
+    "couriernew": ("cour", "liberationmono", "cousine"),
+}
+
+# Ships with matplotlib (already a dependency) and covers Vietnamese
+FALLBACK_FAMILY = "dejavuserif"
+
+# Used when no TrueType font is found at all (no Vietnamese glyphs)
+BUILTIN_FONTS = ("Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic")
+
+_INDEX = None
+_REGISTERED = {}
+_lock = threading.Lock()
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _font_dirs():
+    dirs = [PDF_FONT_DIR] if PDF_FONT_DIR else []
+    if sys.platform == "win32":
+        dirs.append(os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"))
+        if os.environ.get("LOCALAPPDATA"):
+            dirs.append(os.path.join(os.environ["LOCALAPPDATA"], "Microsoft", "Windows", "Fonts"))
+    elif sys.platform == "darwin":
+        dirs += ["/Library/Fonts", "/System/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    else:
+        dirs += ["/usr/share/fonts", "/usr/local/share/fonts",
+                 os.path.expanduser("~/.local/share/fonts"), os.path.expanduser("~/.fonts")]
+    # Located without importing matplotlib
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is not None and spec.submodule_search_locations:
+        dirs.append(os.path.join(spec.submodule_search_locations[0], "mpl-data", "fonts", "ttf"))
+    return dirs
+
+
+def _font_index() -> Dict[str, str]:
+    """Normalized file name (without .ttf) -> path, for every .ttf in the font folders (first one wins)."""
+    global _INDEX
+    if _INDEX is None:
+        index = {}
+        for directory in _font_dirs():
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    stem, ext = os.path.splitext(name)
+                    if ext.lower() == ".ttf":
+                        index.setdefault(_normalize(stem), os.path.join(root, name))
+        _INDEX = index
+    return _INDEX
+
+
+def _family_files(index, family: str) -> Optional[Dict[str, str]]:
+    files = {}
+    for style in STYLES:
+        for suffix in _STYLE_SUFFIXES[style]:
+            path = index.get(family + suffix)
+            if path is not None:
+                files[style] = path
+                break
+    if "regular" not in files:
+        return None
+    # Missing styles are drawn with the regular face
+    return {style: files.get(style, files["regular"]) for style in STYLES}
+
+
+def resolve_font_files(family: str, fallback: bool = True) -> Optional[Dict[str, str]]:
+    """
+    The .ttf files (style -> path) used for `family`: the family itself, a
+    metric-compatible substitute, or (with `fallback`) DejaVu Serif. None if
+    none is installed.
+    """
+    with _lock:
+        index = _font_index()
+    name = _normalize(family)
+    candidates = (name,) + _FAMILY_ALIASES.get(name, ())
+    if fallback:
+        candidates += (FALLBACK_FAMILY,)
+    for candidate in candidates:
+        files = _family_files(index, candidate)
+        if files is not None:
+            return files
+    return None
+
+
+def register_font_family(family: str) -> Tuple[str, str, str, str]:
+    """
+    Register the TrueType faces for `family` with reportlab (once per process)
+    and return their font names (regular, bold, italic, bold italic).
+    """
+    with _lock:
+        names = _REGISTERED.get(family)
+    if names is not None:
+        return names
+
+    files = resolve_font_files(family)
+    if files is None:
+        print(f"Warning: no TrueType font found for '{family}', PDF export uses Times-Roman (no Vietnamese)")
+        names = BUILTIN_FONTS
+    else:
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        names = tuple(os.path.splitext(os.path.basename(files[style]))[0] for style in STYLES)
+        with _lock:
+            for name, style in zip(names, STYLES):
+                if name not in pdfmetrics.getRegisteredFontNames():
+                    pdfmetrics.registerFont(TTFont(name, files[style]))
+            # <b>/<i> markup inside paragraphs switches between these faces
+            pdfmetrics.registerFontFamily(names[0], normal=names[0], bold=names[1],
+                                          italic=names[2], boldItalic=names[3])
+    with _lock:
+        _REGISTERED[family] = names
+    return names
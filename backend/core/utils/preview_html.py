@@ -0,0 +1,181 @@
+import json
+import hashlib
+from dataclasses import asdict, dataclass
+from html import escape
+from typing import Dict, List, Optional, Tuple
+from core.config import PREVIEW_BLOCK_CACHE_ITEMS, PREVIEW_CHAPTER_CACHE_ITEMS, PREVIEW_VERSION_ITEMS
+from core.models.data_classes import Figure, Settings
+from core.utils.cache import LRUCache
+from core.utils.helpers import advance_heading_counts, heading_title
+from core.utils.image_prep import figure_key, index_figures
+from core.utils.markdown_ast import (
+    MathSpan, Heading, Paragraph, BulletItem, TableBlock, TableCaption, FigureRef, FIGURE_RE,
+    iter_located_blocks, split_chapters,
+)
+
+# Bump when the HTML of a block changes so clients drop what they hold
+PREVIEW_FORMAT_VERSION = 1
+
+# Rendered HTML keyed by block hash
+BLOCK_HTML_CACHE = LRUCache(PREVIEW_BLOCK_CACHE_ITEMS)
+# Rendered chapters: chapter hash -> ([(line offset, block hash, html)], heading counters after the chapter)
+CHAPTER_CACHE = LRUCache(PREVIEW_CHAPTER_CACHE_ITEMS)
+# Preview version id -> the set of block hashes it contains
+VERSION_CACHE = LRUCache(PREVIEW_VERSION_ITEMS)
+
+BULLET_MARKS = {1: "-", 2: "+", 3: "-"}
+
+
+@dataclass
+class PreviewBlock:
+    hash: str
+    line: int  # index of the block's first line in the content
+
+
+def _inlines_html(inlines) -> str:
+    """Formatted spans as HTML; math stays LaTeX between KaTeX delimiters for the client to typeset."""
+    parts = []
+    for span in inlines:
+        if isinstance(span, MathSpan):
+            if span.display:
+                parts.append(f'<div class="math-display">$${escape(span.latex)}$$</div>')
+            else:
+                parts.append(f'<span class="math-inline">${escape(span.latex)}$</span>')
+            continue
+        text = escape(span.text)
+        if span.bold:
+            text = f"<b>{text}</b>"
+        if span.italic:
+            text = f"<i>{text}</i>"
+        if span.underline:
+            text = f"<u>{text}</u>"
+        parts.append(text)
+    return "".join(parts)
+
+
+def _figure_html(block: FigureRef, figure: Optional[Figure]) -> str:
+    caption = f'<p class="figure-caption">{escape(block.number)}: {escape(block.caption)}</p>'
+    if figure is None or not figure.url:
+        image = '<div class="figure-missing">Hình ảnh chưa upload hoặc URL lỗi</div>'
+    else:
+        width = f"{figure.width}cm" if figure.width else "16cm"
+        image = f'<img src="{escape(figure.url)}" alt="{escape(block.caption)}" style="width:{width}">'
+    return f'<div class="figure">{image}{caption}</div>'
+
+
+def _table_html(block: TableBlock) -> str:
+    head, *rows = block.rows
+    parts = []
+    if block.caption:
+        parts.append(f'<p class="table-caption">{escape(block.caption)}</p>')
+    parts.append('<table><thead><tr>')
+    parts.extend(f"<th>{escape(cell)}</th>" for cell in head)
+    parts.append("</tr></thead><tbody>")
+    for row in rows:
+        parts.append("<tr>" + "".join(f"<td>{escape(cell)}</td>" for cell in row) + "</tr>")
+    parts.append("</tbody></table>")
+    return "".join(parts)
+
+
+def render_block_html(block, context) -> str:
+    """
+    HTML of one block. `context` is whatever the block needs beyond its own
+    source: the numbered title of a heading, the figure of a figure reference,
+    the bullet indent.
+    """
+    if isinstance(block, Heading):
+        title = "<br>".join(escape(line) for line in context.split("\n"))
+        return f'<h{block.level} class="heading-{block.level}">{title}</h{block.level}>'
+    if isinstance(block, Paragraph):
+        return f'<div class="paragraph">{_inlines_html(block.inlines)}</div>'
+    if isinstance(block, BulletItem):
+        indent = context + (block.level - 1) * 0.75
+        mark = BULLET_MARKS.get(block.level, "-")
+        return (f'<div class="bullet bullet-{block.level}" style="padding-left:{indent:g}cm">'
+                f'<span class="bullet-mark">{mark}</span><span>{_inlines_html(block.inlines)}</span></div>')
+    if isinstance(block, TableBlock):
+        return _table_html(block)
+    if isinstance(block, TableCaption):
+        return f'<p class="table-caption">{escape(block.text)}</p>'
+    if isinstance(block, FigureRef):
+        return _figure_html(block, context)
+    return ""
+
+
+def _block_hash(block, context) -> str:
+    raw = json.dumps([PREVIEW_FORMAT_VERSION, type(block).__name__, asdict(block),
+                      asdict(context) if isinstance(context, Figure) else context],
+                     ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _render_chapter(source: str, settings: Settings, counts: List[int], figure_index) -> List[Tuple[int, str, str]]:
+    """Hash every block of a chapter (advancing `counts`), rendering the ones not in the HTML cache."""
+    blocks = []
+    for line, block in iter_located_blocks(source.split("\n")):
+        context = None
+        if isinstance(block, Heading):
+            advance_heading_counts(counts, block.level)
+            context = heading_title(settings, counts, block.level, block.text)
+        elif isinstance(block, BulletItem):
+            context = settings.indent
+        elif isinstance(block, FigureRef):
+            context = figure_index.get(figure_key(block.number))
+        block_hash = _block_hash(block, context)
+        html = BLOCK_HTML_CACHE.get(block_hash)
+        if html is None:
+            html = render_block_html(block, context)
+            BLOCK_HTML_CACHE.put(block_hash, html)
+        blocks.append((line, block_hash, html))
+    return blocks
+
+
+def _chapter_key(source: str, settings: Settings, counts, figure_index) -> str:
+    # Only the figures a chapter references matter to it
+    refs = sorted({figure_key(m.group(1)) for m in FIGURE_RE.finditer(source)})
+    figures = [asdict(figure_index[r]) if r in figure_index else None for r in refs]
+    raw = json.dumps([PREVIEW_FORMAT_VERSION, source, asdict(settings), list(counts), figures],
+                     ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_preview(text: str, settings: Settings, figures: List[Figure], since: Optional[str] = None) -> dict:
+    """
+    Per-block HTML preview of the content.
+
+    Returns the new version id, every block as {hash, line} in document order,
+    and the HTML of the blocks the client does not have yet: those whose hash
+    is not part of the `since` version (all of them when `since` is unknown,
+    e.g. evicted or issued by another server process). Unchanged chapters are
+    not even re-parsed, so the work follows the size of the edit.
+    """
+    figure_index = index_figures(figures)
+    counts = [0, 0, 0, 0, 0]
+    blocks: List[PreviewBlock] = []
+    html_by_hash: Dict[str, str] = {}
+    line_offset = 0
+    for source in split_chapters(text):
+        key = _chapter_key(source, settings, counts, figure_index)
+        cached = CHAPTER_CACHE.get(key)
+        if cached is None:
+            chapter_blocks = _render_chapter(source, settings, counts, figure_index)
+            CHAPTER_CACHE.put(key, (chapter_blocks, list(counts)))
+        else:
+            chapter_blocks, counts_after = cached
+            counts = list(counts_after)
+        for line, block_hash, html in chapter_blocks:
+            blocks.append(PreviewBlock(block_hash, line_offset + line))
+            html_by_hash[block_hash] = html
+        line_offset += source.count("\n") + 1
+
+    hashes = [b.hash for b in blocks]
+    version = hashlib.sha256("".join(hashes).encode("ascii")).hexdigest()[:32]
+    VERSION_CACHE.put(version, frozenset(hashes))
+    known = VERSION_CACHE.get(since) if since else None
+
+    return {
+        "version": version,
+        "base": since if known is not None else None,
+        "blocks": [asdict(b) for b in blocks],
+        "html": {h: html for h, html in html_by_hash.items() if known is None or h not in known},
+    }
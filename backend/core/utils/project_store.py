@@ -0,0 +1,371 @@
+import os
+import copy
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+from core.utils.cache import LRUCache
+from core.utils.file_lock import FileLock
+from core.utils.markdown_ast import split_chapters
+
+# Top-level fields of a project document
+PROJECT_FIELDS = ("name", "content", "settings", "figures", "citations", "tables", "abbreviations")
+# List fields whose items carry an "id"
+LIST_FIELDS = ("figures", "citations", "tables", "abbreviations")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    snapshot TEXT NOT NULL,
+    snapshot_version INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patches (
+    project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    ops TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (project_id, version)
+);
+"""
+
+
+class ProjectNotFoundError(Exception):
+    """Raised when a project id is unknown."""
+
+
+class VersionConflictError(Exception):
+    """Raised when a patch was made against an outdated version."""
+
+
+class InvalidPatchError(ValueError):
+    """Raised when a patch operation cannot be applied."""
+
+
+def empty_project() -> dict:
+    return {"name": "", "content": "", "settings": {}, "figures": [], "citations": [], "tables": [], "abbreviations": []}
+
+
+def _name(project: dict) -> str:
+    return str(project.get("name") or "")
+
+
+def _find_item(items: list, item_id) -> int:
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and item.get("id") == item_id:
+            return i
+    raise InvalidPatchError(f"Không tìm thấy mục có id {item_id!r}.")
+
+
+def _check_field(field, allowed):
+    if field not in allowed:
+        raise InvalidPatchError(f"Trường không hợp lệ: {field!r}.")
+
+
+def apply_ops(project: dict, ops: List[dict]) -> dict:
+    """
+    Apply patch operations to a project document (in place) and return it.
+
+    - {"op": "replace_lines", "start": i, "end": j, "lines": [...]}
+        content lines [i, j) are replaced by `lines`
+    - {"op": "replace_text", "line": i, "start": a, "end": b, "text": s}
+        characters [a, b) of content line i are replaced by `text` (which may hold newlines)
+    - {"op": "set", "field": f, "value": v}       replace a whole field
+    - {"op": "merge", "field": "settings", "value": {...}}
+    - {"op": "add", "field": f, "item": {...}}     append to a list field
+    - {"op": "update", "field": f, "id": x, "item": {...}}
+    - {"op": "remove", "field": f, "id": x}
+    """
+    for op in ops:
+        kind = op.get("op")
+        if kind == "replace_lines":
+            lines = project.get("content", "").split("\n")
+            start, end = op.get("start"), op.get("end")
+            if not (isinstance(start, int) and isinstance(end, int) and 0 <= start <= end <= len(lines)):
+                raise InvalidPatchError(f"Khoảng dòng không hợp lệ: {start}-{end}.")
+            lines[start:end] = [str(line) for line in op.get("lines", [])]
+            project["content"] = "\n".join(lines)
+        elif kind == "replace_text":
+            lines = project.get("content", "").split("\n")
+            index, start, end = op.get("line"), op.get("start"), op.get("end")
+            if not (isinstance(index, int) and 0 <= index < len(lines)):
+                raise InvalidPatchError(f"Dòng không hợp lệ: {index}.")
+            line = lines[index]
+            if not (isinstance(start, int) and isinstance(end, int) and 0 <= start <= end <= len(line)):
+                raise InvalidPatchError(f"Khoảng ký tự không hợp lệ: {start}-{end}.")
+            lines[index] = line[:start] + str(op.get("text", "")) + line[end:]
+            project["content"] = "\n".join(lines)
+        elif kind == "set":
+            _check_field(op.get("field"), PROJECT_FIELDS)
+            project[op["field"]] = op.get("value")
+        elif kind == "merge":
+            _check_field(op.get("field"), ("settings",))
+            project.setdefault("settings", {}).update(op.get("value") or {})
+        elif kind in ("add", "update", "remove"):
+            _check_field(op.get("field"), LIST_FIELDS)
+            items = project.setdefault(op["field"], [])
+            if kind == "add":
+                items.append(op.get("item"))
+            elif kind == "update":
+                items[_find_item(items, op.get("id"))].update(op.get("item") or {})
+            else:
+                del items[_find_item(items, op.get("id"))]
+        else:
+            raise InvalidPatchError(f"Thao tác không hợp lệ: {kind!r}.")
+    return project
+
+
+def project_view(project: dict, fields: Optional[List[str]] = None, chapters: Optional[List[int]] = None) -> dict:
+    """
+    The part of a project a client asked for: only `fields` (all when None),
+    and only the given chapters of the content (0 = text before the first
+    "# " heading). Unknown field names are ignored.
+    """
+    view = {k: v for k, v in project.items() if fields is None or k in fields}
+    if chapters is not None and "content" in view:
+        parts = split_chapters(view["content"])
+        view["content"] = "\n".join(parts[i] for i in sorted(set(chapters)) if 0 <= i < len(parts))
+        view["chapter_count"] = len(parts) - 1
+    return view
+
+
+def project_etag(project_id: str, version: int, updated_at: float, variant: str = "") -> str:
+    """Entity tag for one representation (`variant` = requested fields/chapters) of a project version."""
+    raw = f"{project_id}\x00{version}\x00{updated_at!r}\x00{variant}"
+    return f'"{version}-{hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]}"'
+
+
+class ProjectStore:
+    """
+    Projects in a local SQLite database. Each project is a JSON snapshot plus
+    the patches saved after it; loading replays the patches, and once
+    `compact_every` of them pile up they are folded into a new snapshot.
+    Every write is a single transaction, so a crash never leaves a half-saved
+    project, and several server processes can share one database file.
+    """
+
+    def __init__(self, db_path: str, compact_every: int = 200, open_projects: int = 32):
+        self.db_path = db_path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        # Recently used projects kept materialized: id -> [project, version, pending patches, updated_at]
+        self._open = LRUCache(open_projects)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Writers in other processes hold the lock briefly; wait for them rather than fail
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- reads ---
+
+    def _row(self, project_id: str):
+        row = self._conn.execute(
+            "SELECT snapshot, snapshot_version, version, updated_at FROM projects WHERE id = ?", (project_id,)
+        ).fetchone()
+        if row is None:
+            raise ProjectNotFoundError(project_id)
+        return row
+
+    def _materialize(self, project_id: str):
+        """
+        [project, version, pending patch count, updated_at], from the open-project
+        cache when current. Call inside a transaction so the snapshot and its
+        patches are read consistently (another process may be writing).
+        """
+        current = self._conn.execute("SELECT version, updated_at FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if current is None:
+            self._open.pop(project_id)
+            raise ProjectNotFoundError(project_id)
+        cached = self._open.get(project_id)
+        # updated_at too: a deleted and re-created project can reach the same version
+        if cached is not None and (cached[1], cached[3]) == tuple(current):
+            return cached
+
+        snapshot, snapshot_version, version, updated_at = self._row(project_id)
+        project = json.loads(snapshot)
+        patches = self._conn.execute(
+            "SELECT ops FROM patches WHERE project_id = ? AND version > ? ORDER BY version",
+            (project_id, snapshot_version),
+        ).fetchall()
+        for (ops,) in patches:
+            apply_ops(project, json.loads(ops))
+        entry = [project, version, len(patches), updated_at]
+        self._open.put(project_id, entry)
+        return entry
+
+    def exists(self, project_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is not None
+
+    def get(self, project_id: str) -> dict:
+        """{"id", "version", "updated_at", "data"} for a project."""
+        with self._lock, self._transaction("BEGIN"):
+            project, version, _, updated_at = self._materialize(project_id)
+            return {"id": project_id, "version": version, "updated_at": updated_at, "data": copy.deepcopy(project)}
+
+    def info(self, project_id: str):
+        """(version, updated_at) without loading the project; enough to revalidate a cached copy."""
+        with self._lock:
+            row = self._conn.execute("SELECT version, updated_at FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if row is None:
+            raise ProjectNotFoundError(project_id)
+        return row
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, name, version, created_at, updated_at "
+                "FROM projects ORDER BY updated_at DESC"
+            ).fetchall()
+        return [
+            {"id": pid, "name": name or "", "version": version, "created_at": created, "updated_at": updated}
+            for pid, name, version, created, updated in rows
+        ]
+
+    # --- writes ---
+
+    def create(self, data: Optional[dict] = None, project_id: Optional[str] = None) -> str:
+        project = empty_project()
+        project.update({k: v for k, v in (data or {}).items() if k in PROJECT_FIELDS})
+        project_id = project_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO projects (id, name, snapshot, snapshot_version, version, created_at, updated_at) "
+                "VALUES (?, ?, ?, 0, 0, ?, ?)",
+                (project_id, _name(project), json.dumps(project, ensure_ascii=False), now, now),
+            )
+        return project_id
+
+    def save(self, project_id: str, data: dict) -> int:
+        """Replace a whole project (creating it if needed). Returns the new version."""
+        project = empty_project()
+        project.update({k: v for k, v in data.items() if k in PROJECT_FIELDS})
+        snapshot = json.dumps(project, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._transaction():
+            row = self._conn.execute("SELECT version FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO projects (id, name, snapshot, snapshot_version, version, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 1, 1, ?, ?)",
+                    (project_id, _name(project), snapshot, now, now),
+                )
+                return 1
+            version = row[0] + 1
+            self._write_snapshot(project_id, project, snapshot, version, now)
+            self._open.pop(project_id)
+            return version
+
+    def patch(self, project_id: str, ops: List[dict], base_version: Optional[int] = None) -> int:
+        """
+        Append a patch. When `base_version` is given it must be the current
+        version (otherwise VersionConflictError). Returns the new version.
+        """
+        ops_json = json.dumps(ops, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._transaction():
+            entry = self._materialize(project_id)
+            project, version, pending, _ = entry
+            if base_version is not None and base_version != version:
+                raise VersionConflictError(f"Dự án đã thay đổi (phiên bản {version}, yêu cầu dựa trên {base_version}).")
+            try:
+                # Applying first validates the ops before anything is written
+                apply_ops(project, ops)
+                version += 1
+                if pending + 1 >= self.compact_every:
+                    self._write_snapshot(project_id, project, json.dumps(project, ensure_ascii=False), version, now)
+                    pending = 0
+                else:
+                    self._conn.execute(
+                        "INSERT INTO patches (project_id, version, ops, created_at) VALUES (?, ?, ?, ?)",
+                        (project_id, version, ops_json, now),
+                    )
+                    self._conn.execute(
+                        "UPDATE projects SET name = ?, version = ?, updated_at = ? WHERE id = ?",
+                        (_name(project), version, now, project_id),
+                    )
+                    pending += 1
+            except BaseException:
+                # The cached copy may be half-patched; reload it from the database next time
+                self._open.pop(project_id)
+                raise
+            entry[1], entry[2], entry[3] = version, pending, now
+            return version
+
+    def compact(self, project_id: str) -> int:
+        """Fold all pending patches into the snapshot."""
+        with self._lock, self._transaction():
+            entry = self._materialize(project_id)
+            project, version, pending, _ = entry
+            if pending:
+                now = time.time()
+                self._write_snapshot(project_id, project, json.dumps(project, ensure_ascii=False), version, now)
+                entry[2], entry[3] = 0, now
+            return version
+
+    def delete(self, project_id: str):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM patches WHERE project_id = ?", (project_id,))
+            if self._conn.execute("DELETE FROM projects WHERE id = ?", (project_id,)).rowcount == 0:
+                raise ProjectNotFoundError(project_id)
+            self._open.pop(project_id)
+
+    def _write_snapshot(self, project_id, project, snapshot, version, now):
+        self._conn.execute(
+            "UPDATE projects SET name = ?, snapshot = ?, snapshot_version = ?, version = ?, updated_at = ? WHERE id = ?",
+            (_name(project), snapshot, version, version, now, project_id),
+        )
+        self._conn.execute("DELETE FROM patches WHERE project_id = ?", (project_id,))
+
+    def _transaction(self, begin: str = "BEGIN IMMEDIATE"):
+        return _Transaction(self._conn, begin)
+
+    # --- migration ---
+
+    def import_legacy_file(self, path: str, project_id: str) -> bool:
+        """Import the old single-project JSON file once. Returns True if imported."""
+        # Every server process tries this at startup; only the first may import
+        with FileLock(f"{self.db_path}.migrate.lock"):
+            return self._import_legacy_file(path, project_id)
+
+    def _import_legacy_file(self, path: str, project_id: str) -> bool:
+        if not os.path.exists(path) or self.exists(project_id):
+            return False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not import {path}: {e}")
+            return False
+        self.save(project_id, data)
+        print(f"Imported {path} as project '{project_id}'")
+        return True
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE (or plain BEGIN for reads) ... COMMIT, rolled back on error."""
+
+    def __init__(self, conn, begin: str = "BEGIN IMMEDIATE"):
+        self.conn = conn
+        self.begin = begin
+
+    def __enter__(self):
+        self.conn.execute(self.begin)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
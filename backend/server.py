@@ -1,18 +1,44 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Body, Request, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import json
+import time
+import asyncio
 import shutil
+import argparse
+import threading
 import uvicorn
-import uuid
 from core.models.data_classes import Settings, Figure, Table, Citation
-from core.utils.export_docx import export_to_docx
+from core.utils.omml_xslt import load_mathml_to_omml_xslt, get_mathml_to_omml_xslt
+from core.utils.export_cache import EXPORT_CACHE, export_cache_key
+from core.utils.metrics import REGISTRY, HTTP_REQUEST_DURATION, Gauge, server_timing_header
+from core.utils.export_jobs import ExportJobQueue, QueueFullError, EXPORT_KINDS
+from core.utils.pdf_fonts import resolve_font_files
+from core.utils.preview_html import render_preview
+from core.utils.math_validate import EquationRef, find_equations, validate_equations
+from core.utils.batch_export import BatchExports, BatchProject
+from core.utils.image_store import ImageStore, UploadTooLargeError, too_large_message
+from core.utils.project_store import (
+    ProjectStore, ProjectNotFoundError, VersionConflictError, InvalidPatchError,
+    project_view, project_etag,
+)
+from core.config import (
+    BASE_DIR, SERVER_HOST, SERVER_PORT, SERVER_WORKERS,
+    EXPORT_WORKERS, EXPORT_QUEUE_SIZE, EXPORT_JOB_TTL, EXPORT_JOB_DIR, METRICS_DIR,
+    UPLOAD_DIR, UPLOAD_MAX_BYTES,
+    PROJECT_DB_PATH, PROJECT_COMPACT_EVERY, LEGACY_PROJECT_FILE, DEFAULT_PROJECT_ID,
+)
 
 app = FastAPI()
 
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
 # Allow CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,14 +46,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
+# Compress JSON responses (project loads can be several MB of markdown). The
+# exported .docx (a zip) and .pdf are compressed already: gzipping them again
+# only costs CPU and drops the Content-Length of the download
+app.add_middleware(GZipMiddleware, minimum_size=1024,
+                   exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + (DOCX_MEDIA_TYPE, "application/pdf"))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template so /api/projects/{id} is one series, not one per project
+    route = request.scope.get("route")
+    HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=request.method,
+                                  route=getattr(route, "path", "unmatched"), status=response.status_code)
+    return response
+
+# Warm-up progress, reported by /api/ready
+READINESS = {"ready": False, "error": None, "seconds": None}
+
+def warm_up_export_path():
+    """Compile MML2OMML.XSL (needed for export cache keys) and start and prime the export workers."""
+    start = time.perf_counter()
+    try:
+        load_mathml_to_omml_xslt()
+        export_queue.warm_up()
+        READINESS["ready"] = True
+    except Exception as e:
+        READINESS["error"] = str(e)
+        print(f"Warning: export warm-up failed: {e}")
+    READINESS["seconds"] = round(time.perf_counter() - start, 2)
+
+@app.on_event("startup")
+def start_warm_up():
+    # In the background, so the server serves requests (e.g. /api/load) right away
+    threading.Thread(target=warm_up_export_path, name="export-warm-up", daemon=True).start()
 
-# Create images directory
-if not os.path.exists("images"):
-    os.makedirs("images")
+# Content-addressed store for uploaded images (creates the directory)
+image_store = ImageStore(UPLOAD_DIR, UPLOAD_MAX_BYTES)
 
 # Mount images for preview
-app.mount("/images", StaticFiles(directory="images"), name="images")
+app.mount("/images", StaticFiles(directory=UPLOAD_DIR), name="images")
 
 class ExportRequest(BaseModel):
     content: str
@@ -37,89 +98,517 @@ class ExportRequest(BaseModel):
     citations: List[dict]
     abbreviations: List[dict] = []
 
+class PreviewRequest(BaseModel):
+    content: str
+    settings: dict = {}
+    figures: List[dict] = []
+    # Version id of the preview the client already holds
+    since: Optional[str] = None
+
+class MathValidateRequest(BaseModel):
+    # Either the document (every equation in it is checked) or the equations themselves
+    content: Optional[str] = None
+    equations: List[dict] = []  # {"latex": ..., "display": false}
+    font_size: int = Settings.font_size
+
+class BatchExportRequest(BaseModel):
+    # Stored projects to export; omit (and send no `projects`) to export all of them
+    project_ids: Optional[List[str]] = None
+    # Project documents sent inline, each with a "name"
+    projects: List[dict] = []
+    format: str = "docx"
+
 class ProjectData(BaseModel):
     content: str
     settings: dict
     figures: List[dict]
     citations: List[dict]
+    name: str = ""
+    tables: List[dict] = []
+    abbreviations: List[dict] = []
 
-PROJECT_FILE = "saved_project.json"
+class ProjectPatch(BaseModel):
+    ops: List[dict]
+    # Version the client's edits are based on; omit to apply unconditionally
+    base_version: Optional[int] = None
 
-@app.post("/api/save")
-async def save_project(data: ProjectData):
+# Export kind -> (download file name, media type)
+EXPORT_DOWNLOADS = {
+    "docx": ("thesis.docx", DOCX_MEDIA_TYPE),
+    "pdf": ("thesis.pdf", "application/pdf"),
+}
+
+# Exports run in a bounded process pool; extra requests wait in a bounded queue.
+# Identical requests are answered from the export cache.
+export_queue = ExportJobQueue(EXPORT_JOB_DIR, EXPORT_WORKERS, EXPORT_QUEUE_SIZE, EXPORT_JOB_TTL,
+                              cache=EXPORT_CACHE)
+export_queue.remove_stale_files()
+# Spawned processes (uvicorn's workers, the export pool) also run this file as
+# __mp_main__; only the copy imported as "server" (or run as __main__) serves
+if __name__ != "__mp_main__":
+    REGISTRY.register(Gauge("grad_helper_export_queue_pending", "Exports queued or running.", export_queue.pending_count))
+    if SERVER_WORKERS > 1:
+        # Each process only sees its own requests and exports; /api/metrics adds up all of them
+        REGISTRY.enable_multiprocess(METRICS_DIR)
+
+# Cohort exports: many projects into one zip, one batch at a time per server
+# process, exported in the export queue's pool (its processes and cores)
+batch_exports = BatchExports(EXPORT_JOB_DIR, EXPORT_WORKERS, export_queue.submit_task, EXPORT_JOB_TTL)
+
+# Projects live in SQLite: a snapshot per project plus small incremental patches
+project_store = ProjectStore(PROJECT_DB_PATH, PROJECT_COMPACT_EVERY)
+
+@app.on_event("startup")
+def migrate_legacy_project():
+    # The single saved_project.json of earlier versions becomes the "default" project
+    project_store.import_legacy_file(LEGACY_PROJECT_FILE, DEFAULT_PROJECT_ID)
+
+def run_project_op(fn, *args):
+    """Call a ProjectStore method, mapping its errors to HTTP errors."""
     try:
-        import json
-        with open(PROJECT_FILE, "w", encoding="utf-8") as f:
-            json.dump(data.dict(), f, ensure_ascii=False, indent=2)
-        return {"status": "success", "message": "Đã lưu dự án thành công!"}
+        return fn(*args)
+    except ProjectNotFoundError:
+        raise HTTPException(status_code=404, detail="Không tìm thấy dự án.")
+    except VersionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except InvalidPatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/load")
-async def load_project():
+# Sync handlers: FastAPI runs them in its thread pool, keeping SQLite off the event loop
+
+@app.post("/api/save")
+def save_project(data: ProjectData):
+    run_project_op(project_store.save, DEFAULT_PROJECT_ID, data.dict())
+    return {"status": "success", "message": "Đã lưu dự án thành công!"}
+
+def parse_list_param(value: Optional[str]):
+    """"a,b,c" -> ["a", "b", "c"]; None when the parameter is absent."""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def project_response(request: Request, project_id: str, fields: Optional[str], chapters: Optional[str], shape: str):
+    """
+    Load a project as JSON with an ETag. A matching If-None-Match gets a 304
+    without reading the project. `fields` / `chapters` limit what is sent.
+    """
+    field_list = parse_list_param(fields)
     try:
-        import json
-        if not os.path.exists(PROJECT_FILE):
-            return {"exists": False}
-            
-        with open(PROJECT_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return {"exists": True, "data": data}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        chapter_list = [int(c) for c in parse_list_param(chapters)] if chapters is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Tham số chapters không hợp lệ.")
+    # The representation depends on the route and the filters as well as the version
+    variant = f"{shape}|{fields}|{chapters}"
+
+    version, updated_at = run_project_op(project_store.info, project_id)
+    etag = project_etag(project_id, version, updated_at, variant)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    project = run_project_op(project_store.get, project_id)
+    headers["ETag"] = project_etag(project_id, project["version"], project["updated_at"], variant)
+    data = project_view(project["data"], field_list, chapter_list)
+    if shape == "load":
+        body = {"exists": True, "data": data, "version": project["version"]}
+    else:
+        body = dict(project, data=data)
+    return JSONResponse(body, headers=headers)
+
+@app.get("/api/load")
+def load_project(request: Request, fields: Optional[str] = None, chapters: Optional[str] = None):
+    if not project_store.exists(DEFAULT_PROJECT_ID):
+        return {"exists": False}
+    return project_response(request, DEFAULT_PROJECT_ID, fields, chapters, "load")
+
+@app.get("/api/projects")
+def list_projects():
+    return {"projects": project_store.list()}
+
+@app.post("/api/projects", status_code=201)
+def create_project(data: dict = Body(default={})):
+    project_id = run_project_op(project_store.create, data)
+    return {"id": project_id, "version": 0}
+
+@app.get("/api/projects/{project_id}")
+def get_project(request: Request, project_id: str, fields: Optional[str] = None, chapters: Optional[str] = None):
+    return project_response(request, project_id, fields, chapters, "project")
+
+@app.put("/api/projects/{project_id}")
+def put_project(project_id: str, data: ProjectData):
+    return {"id": project_id, "version": run_project_op(project_store.save, project_id, data.dict())}
+
+@app.patch("/api/projects/{project_id}")
+def patch_project(project_id: str, patch: ProjectPatch):
+    version = run_project_op(project_store.patch, project_id, patch.ops, patch.base_version)
+    return {"id": project_id, "version": version}
+
+@app.delete("/api/projects/{project_id}")
+def delete_project(project_id: str):
+    run_project_op(project_store.delete, project_id)
+    return {"status": "success"}
 
 @app.post("/api/upload")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(request: Request, file: UploadFile = File(...)):
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=too_large_message(UPLOAD_MAX_BYTES))
     try:
-        # Generate unique filename
-        file_ext = os.path.splitext(file.filename)[1]
-        filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join("images", filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
+        # Copy + hash in a worker thread; identical content is stored only once
+        stored = await asyncio.to_thread(image_store.save, file.file, file.filename)
         return {
-            "url": f"http://localhost:8080/images/{filename}",
-            "path": os.path.abspath(file_path),
-            "filename": filename
+            # Absolute URL as the client reached this server (host, port, proxy prefix)
+            "url": str(request.url_for("images", path=stored.relpath)),
+            "path": image_store.path_for(stored.relpath),
+            "filename": stored.relpath
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
 
-@app.post("/api/export/docx")
-async def export_docx_endpoint(req: ExportRequest):
-    # ... (giữ nguyên logic export cũ)
+@app.post("/api/preview")
+def preview_endpoint(req: PreviewRequest):
+    """
+    HTML of the content per block. Only blocks missing from the `since`
+    version are sent; the client reuses the HTML it holds for the others.
+    """
     try:
-        # Convert dicts back to data classes
         settings = Settings(**req.settings)
-        # Fix figures path: Ensure we use absolute paths from the request
-        figures = []
-        for f in req.figures:
-            # If path is a URL (http...), we need to resolve it to local path
-            # But for simplicity, the frontend should send the 'path' returned by upload API
-            figures.append(Figure(**f))
-            
-        tables = [Table(**t) for t in req.tables]
-        citations = [Citation(**c) for c in req.citations]
-        abbreviations = req.abbreviations if req.abbreviations else []
+        figures = [Figure(**f) for f in req.figures]
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return render_preview(req.content, settings, figures, req.since)
+
+@app.post("/api/math/validate")
+def validate_math_endpoint(req: MathValidateRequest):
+    """
+    Check equations against the export pipeline: per equation, whether Word
+    gets a native equation ("omml"), an image ("image") or the "[công thức]"
+    placeholder ("fallback"), plus the unsupported construct found, if any.
+    """
+    if req.content is not None:
+        equations = find_equations(req.content)
+    else:
+        try:
+            equations = [EquationRef(str(eq["latex"]), bool(eq.get("display", False))) for eq in req.equations]
+        except (KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Mỗi công thức cần có trường latex.")
+    return validate_equations(equations, req.font_size)
+
+def build_export_args(req: ExportRequest):
+    """Convert an export request into the arguments of export_to_docx (minus the output path)."""
+    # Convert dicts back to data classes
+    settings = Settings(**req.settings)
+    # Fix figures path: Ensure we use absolute paths from the request
+    figures = []
+    for f in req.figures:
+        # If path is a URL (http...), we need to resolve it to local path
+        # But for simplicity, the frontend should send the 'path' returned by upload API
+        figures.append(Figure(**f))
         
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-            output_path = tmp.name
-            
-        success, msg = export_to_docx(output_path, req.content, settings, figures, tables, citations, abbreviations)
+    tables = [Table(**t) for t in req.tables]
+    citations = [Citation(**c) for c in req.citations]
+    abbreviations = req.abbreviations if req.abbreviations else []
+    return req.content, settings, figures, tables, citations, abbreviations
+
+def export_etag(cache_key: Optional[str]) -> Optional[str]:
+    return f'"{cache_key[:32]}"' if cache_key else None
+
+def export_response(job, server_timing: Optional[str] = None):
+    """The finished export file (FileResponse streams it to the client in chunks); 410 once it is gone."""
+    headers = {}
+    if job.cache_key:
+        headers["ETag"] = export_etag(job.cache_key)
+    if server_timing:
+        headers["Server-Timing"] = server_timing
+        headers["Timing-Allow-Origin"] = "*"
+    filename, media_type = EXPORT_DOWNLOADS[job.kind]
+    # The file lives in the export cache, which may have evicted it since the job finished
+    try:
+        stat_result = os.stat(job.output_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="File đã bị xóa khỏi bộ nhớ đệm, vui lòng xuất lại.")
+    return FileResponse(job.output_path, filename=filename, media_type=media_type, headers=headers,
+                        stat_result=stat_result)
+
+def export_server_timing(job, key_seconds: float = None) -> str:
+    """Server-Timing value for an export: cache-key hashing, queue wait and each export phase."""
+    timings = {"key": key_seconds} if key_seconds is not None else {}
+    timings.update(job.timings)
+    total = (job.finished_at or time.time()) - job.created_at
+    if key_seconds is not None:
+        total += key_seconds
+    return server_timing_header(timings, total, "cache hit" if job.cache_hit else None)
+
+async def prepare_export(req: ExportRequest, kind: str = "docx"):
+    """Export arguments plus their cache key (hashing figure images happens off the event loop)."""
+    args = build_export_args(req)
+
+    def make_key():
+        if kind == "pdf":
+            # The fonts found on this machine shape the PDF
+            return export_cache_key(*args, extra=["pdf", resolve_font_files(args[1].font_family)])
+        # Word equations vs. image fallback changes the output, and the fonts
+        # measured for the table of contents' page numbers
+        omml_enabled = get_mathml_to_omml_xslt() is not None
+        return export_cache_key(*args, extra=[omml_enabled, resolve_font_files(args[1].font_family)])
+
+    cache_key = await asyncio.to_thread(make_key)
+    return args, cache_key
+
+def submit_export_job(args, cache_key, kind: str = "docx"):
+    try:
+        return export_queue.submit(*args, cache_key=cache_key, kind=kind)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+async def export_file(req: ExportRequest, request: Request, kind: str):
+    """Export and wait for the file (the work runs in the export worker pool)."""
+    try:
+        start = time.perf_counter()
+        args, cache_key = await prepare_export(req, kind)
+        key_seconds = time.perf_counter() - start
+        etag = export_etag(cache_key)
+        if etag_matches(request.headers.get("if-none-match"), etag) and EXPORT_CACHE.get_path(cache_key):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        # Run in the export worker pool so the event loop stays free for other requests
+        job = submit_export_job(args, cache_key, kind)
+        success, msg, _ = await asyncio.wrap_future(job.future)
         
         if not success:
             raise HTTPException(status_code=500, detail=msg)
+        # job.output_path already points into the cache: the queue's done callback
+        # was registered first, so it has run by the time wrap_future resolves
             
-        return FileResponse(output_path, filename="thesis.docx", media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        return export_response(job, export_server_timing(job, key_seconds))
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc() # Print full stack trace to console
         print(f"EXPORT ERROR: {str(e)}") # Print error message
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/export/docx")
+async def export_docx_endpoint(req: ExportRequest, request: Request):
+    return await export_file(req, request, "docx")
+
+@app.post("/api/export/pdf")
+async def export_pdf_endpoint(req: ExportRequest, request: Request):
+    return await export_file(req, request, "pdf")
+
+@app.post("/api/export/jobs", status_code=202)
+async def submit_export_endpoint(req: ExportRequest, kind: str = Query("docx", alias="format")):
+    if kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Định dạng không hỗ trợ: {kind}")
+    try:
+        args, cache_key = await prepare_export(req, kind)
+        job = submit_export_job(args, cache_key, kind)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+@app.get("/api/export/jobs/{job_id}")
+async def export_status_endpoint(job_id: str):
+    job = export_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu xuất file.")
+    return job.to_dict()
+
+@app.get("/api/export/jobs/{job_id}/download")
+async def export_download_endpoint(job_id: str, request: Request):
+    job = export_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu xuất file.")
+    status = job.status
+    if status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if status != "done":
+        raise HTTPException(status_code=409, detail="File chưa sẵn sàng.")
+    etag = export_etag(job.cache_key)
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return export_response(job, export_server_timing(job))
+
+# --- Working off the stored project ---
+# Clients send deltas (PATCH or the edit channel below); previews and exports
+# then read the server's copy instead of receiving the whole document again
+
+class ProjectPreviewRequest(BaseModel):
+    since: Optional[str] = None
+
+def preview_project(project_id: str, since: Optional[str] = None):
+    project = run_project_op(project_store.get, project_id)
+    data = project["data"]
+    req = PreviewRequest(content=data.get("content") or "", settings=data.get("settings") or {},
+                         figures=data.get("figures") or [], since=since)
+    return {**preview_endpoint(req), "project_version": project["version"]}
+
+# Project field -> value used when it is missing or empty
+EXPORT_PROJECT_FIELDS = (("content", ""), ("settings", {}), ("figures", []), ("tables", []),
+                         ("citations", []), ("abbreviations", []))
+
+async def export_project(project_id: str, kind: str):
+    """Queue an export of the stored project; returns the job (poll /api/export/jobs/{id})."""
+    if kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Định dạng không hỗ trợ: {kind}")
+    project = await asyncio.to_thread(run_project_op, project_store.get, project_id)
+    data = project["data"]
+    try:
+        req = ExportRequest(**{k: data.get(k) or default for k, default in EXPORT_PROJECT_FIELDS})
+        args, cache_key = await prepare_export(req, kind)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return submit_export_job(args, cache_key, kind)
+
+@app.post("/api/projects/{project_id}/preview")
+def project_preview_endpoint(project_id: str, req: ProjectPreviewRequest = Body(default=ProjectPreviewRequest())):
+    return preview_project(project_id, req.since)
+
+@app.post("/api/projects/{project_id}/export/jobs", status_code=202)
+async def project_export_endpoint(project_id: str, kind: str = Query("docx", alias="format")):
+    return (await export_project(project_id, kind)).to_dict()
+
+async def handle_edit_message(project_id: str, message: dict) -> dict:
+    kind = message.get("type")
+    if kind == "patch":
+        version = await asyncio.to_thread(run_project_op, project_store.patch, project_id,
+                                          message.get("ops") or [], message.get("base_version"))
+        return {"type": "ack", "version": version}
+    if kind == "preview":
+        return {"type": "preview", **(await asyncio.to_thread(preview_project, project_id, message.get("since")))}
+    if kind == "export":
+        job = await export_project(project_id, message.get("format", "docx"))
+        return {"type": "export", **job.to_dict()}
+    raise HTTPException(status_code=400, detail=f"Loại thông điệp không hợp lệ: {kind!r}.")
+
+@app.websocket("/api/projects/{project_id}/ws")
+async def project_edit_channel(websocket: WebSocket, project_id: str):
+    """
+    Edit channel for one project. Client messages (JSON), each answered in order:
+
+    - {"type": "patch", "ops": [...], "base_version": n}  -> {"type": "ack", "version": n + 1}
+      ops as for PATCH /api/projects/{id} (replace_lines / replace_text deltas, ...)
+    - {"type": "preview", "since": "..."}                   -> {"type": "preview", ...} as /api/preview
+    - {"type": "export", "format": "docx" | "pdf"}          -> {"type": "export", ...} an export job
+
+    An optional "id" is echoed back. Failures answer {"type": "error", "status", "detail"}
+    (409 when base_version is outdated) and leave the channel open.
+    """
+    await websocket.accept()
+    try:
+        version, _ = await asyncio.to_thread(project_store.info, project_id)
+    except ProjectNotFoundError:
+        await websocket.close(code=4404, reason="Không tìm thấy dự án.")
+        return
+    await websocket.send_json({"type": "hello", "project_id": project_id, "version": version})
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    message = None
+                if not isinstance(message, dict):
+                    raise HTTPException(status_code=400, detail="Thông điệp phải là một đối tượng JSON.")
+                reply = await handle_edit_message(project_id, message)
+            except HTTPException as e:
+                reply = {"type": "error", "status": e.status_code, "detail": e.detail}
+            if isinstance(message, dict) and "id" in message:
+                reply["id"] = message["id"]
+            await websocket.send_json(reply)
+    except WebSocketDisconnect:
+        pass
+
+@app.post("/api/export/batch", status_code=202)
+def submit_batch_export_endpoint(req: BatchExportRequest):
+    """Export many projects into one zip with manifest.json; poll /api/export/batch/{id}."""
+    if req.format not in EXPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Định dạng không hỗ trợ: {req.format}")
+    projects = [BatchProject(str(p.get("name") or f"project-{i + 1}"), lambda p=p: p)
+                for i, p in enumerate(req.projects)]
+    if req.project_ids is not None or not req.projects:
+        names = {p["id"]: p["name"] for p in project_store.list()}
+        ids = req.project_ids if req.project_ids is not None else list(names)
+        missing = [pid for pid in ids if pid not in names]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy dự án: {', '.join(missing)}")
+        projects += [BatchProject(names[pid] or pid, lambda pid=pid: project_store.get(pid)["data"]) for pid in ids]
+    if not projects:
+        raise HTTPException(status_code=400, detail="Không có dự án nào để xuất.")
+    try:
+        return batch_exports.start(projects, req.format)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+
+@app.get("/api/export/batch/{batch_id}")
+def batch_export_status_endpoint(batch_id: str):
+    record = batch_exports.get(batch_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy đợt xuất hàng loạt.")
+    return record
+
+@app.get("/api/export/batch/{batch_id}/download")
+def batch_export_download_endpoint(batch_id: str):
+    record = batch_exports.get(batch_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy đợt xuất hàng loạt.")
+    if record["status"] == "failed":
+        raise HTTPException(status_code=500, detail=record["error"])
+    if record["status"] != "done":
+        raise HTTPException(status_code=409, detail="File chưa sẵn sàng.")
+    return FileResponse(batch_exports.zip_path(batch_id), filename=f"export-{batch_id[:8]}.zip",
+                        media_type="application/zip")
+
+@app.get("/api/ready")
+def readiness_endpoint():
+    """503 until the export workers are started and warmed up, then 200."""
+    body = {**READINESS, "export": export_queue.warm_state}
+    return JSONResponse(body, status_code=200 if READINESS["ready"] else 503)
+
+@app.get("/api/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint: export latency/phase histograms, counters, HTTP latency (all server processes)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("shutdown")
+def shutdown_export_queue():
+    export_queue.shutdown()
+    REGISTRY.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Grad helper backend server")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"bind address (default {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"port (default {SERVER_PORT})")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help=f"server processes sharing the port (default {SERVER_WORKERS})")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    # Worker processes re-read the config; this lets them share the export pool size out
+    os.environ["GRAD_HELPER_SERVER_WORKERS"] = str(workers)
+    if workers == 1:
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        # Metrics files of a previous run would be counted as exited processes
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+        # Multiple workers need the app as an import string
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=workers, app_dir=BASE_DIR)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    main()
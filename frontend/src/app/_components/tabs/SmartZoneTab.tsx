@@ -1,4 +1,4 @@
-import React, { useMemo, useState } from "react";
+import React, { useEffect, useMemo, useState } from "react";
 import { AlertTriangle, ArrowRight, Code2, TextCursor } from "lucide-react";
 import { Button } from "../ui/Button";
 
@@ -22,22 +22,16 @@ interface LatexIssue {
     context: string;
 }
 
-// Unsupported LaTeX patterns that matplotlib can't render
-const UNSUPPORTED_LATEX_PATTERNS = [
-    { pattern: /\\begin\{/, name: "\\begin{...}" },
-    { pattern: /\\end\{/, name: "\\end{...}" },
-    { pattern: /\\underbrace/, name: "\\underbrace" },
-    { pattern: /\\overbrace/, name: "\\overbrace" },
-    { pattern: /\\xrightarrow/, name: "\\xrightarrow" },
-    { pattern: /\\xleftarrow/, name: "\\xleftarrow" },
-    { pattern: /\\substack/, name: "\\substack" },
-    { pattern: /\\overset/, name: "\\overset" },
-    { pattern: /\\underset/, name: "\\underset" },
-    { pattern: /\\stackrel/, name: "\\stackrel" },
-    { pattern: /\\binom/, name: "\\binom" },
-    { pattern: /\\pmatrix/, name: "\\pmatrix" },
-    { pattern: /\\bmatrix/, name: "\\bmatrix" },
-];
+// Equations the export cannot render become "[công thức]"; the backend checks them with its real pipeline
+const MATH_VALIDATE_URL = "http://localhost:8080/api/math/validate";
+const MATH_VALIDATE_DELAY_MS = 800;
+
+interface EquationVerdict {
+    latex: string;
+    line: number;
+    status: "omml" | "image" | "fallback";
+    pattern: string | null;
+}
 
 type TabType = "format" | "latex";
 
@@ -68,36 +62,43 @@ export function SmartZoneTab({ content, onJumpToLine, onFix }: SmartZoneTabProps
         return foundIssues;
     }, [content]);
 
-    const latexIssues = useMemo(() => {
-        const lines = content.split("\n");
-        const foundIssues: LatexIssue[] = [];
-
-        lines.forEach((line, lineIndex) => {
-            // Find all LaTeX formulas: $...$ or $$...$$
-            const latexRegex = /\$\$([^$]+)\$\$|\$([^$]+)\$/g;
-            let match;
-            while ((match = latexRegex.exec(line)) !== null) {
-                const latexContent = match[1] || match[2];
-
-                // Check for unsupported patterns
-                for (const { pattern, name } of UNSUPPORTED_LATEX_PATTERNS) {
-                    if (pattern.test(latexContent)) {
-                        const start = Math.max(0, match.index - 5);
-                        const end = Math.min(line.length, match.index + 50);
-                        const context = (start > 0 ? "..." : "") + line.substring(start, end) + (end < line.length ? "..." : "");
-
-                        foundIssues.push({
-                            line: lineIndex,
-                            latex: latexContent.substring(0, 40) + (latexContent.length > 40 ? "..." : ""),
-                            pattern: name,
-                            context: context
-                        });
-                        break; // Only report first issue per formula
-                    }
-                }
+    const [latexIssues, setLatexIssues] = useState<LatexIssue[]>([]);
+
+    useEffect(() => {
+        const controller = new AbortController();
+        const timer = setTimeout(async () => {
+            try {
+                const res = await fetch(MATH_VALIDATE_URL, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ content }),
+                    signal: controller.signal,
+                });
+                if (!res.ok) return;
+                const data: { equations: EquationVerdict[] } = await res.json();
+                const lines = content.split("\n");
+                setLatexIssues(data.equations
+                    .filter((eq) => eq.status === "fallback")
+                    .map((eq) => {
+                        const line = lines[eq.line] ?? "";
+                        const index = Math.max(0, line.indexOf(eq.latex));
+                        const start = Math.max(0, index - 5);
+                        const end = Math.min(line.length, index + 50);
+                        return {
+                            line: eq.line,
+                            latex: eq.latex.substring(0, 40) + (eq.latex.length > 40 ? "..." : ""),
+                            pattern: eq.pattern ?? "Không hiển thị được",
+                            context: (start > 0 ? "..." : "") + line.substring(start, end) + (end < line.length ? "..." : ""),
+                        };
+                    }));
+            } catch {
+                // Aborted by a newer edit, or the backend is not running
             }
-        });
-        return foundIssues;
+        }, MATH_VALIDATE_DELAY_MS);
+        return () => {
+            clearTimeout(timer);
+            controller.abort();
+        };
     }, [content]);
 
     const totalIssues = formatIssues.length + latexIssues.length;